@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+"""
+Pre-gig audio analysis: loudness, peaks, clipping and silence.
+
+WAV/AIFF payloads are memory-mapped straight from the offsets found by
+find_exact_duplicates.wav_data_range/aiff_ssnd_range; FLAC/MP3 (and anything
+else) are decoded through a streamed `ffmpeg` pipe. Samples are processed in
+fixed-size NumPy blocks, so memory stays flat whatever the track length.
+
+Per file
+- integrated loudness (ITU-R BS.1770: K-weighting, 400 ms blocks, absolute
+  -70 LUFS and relative -10 LU gates)
+- sample peak and true peak (4x oversampled) in dBFS / dBTP
+- clipped runs: consecutive frames at full scale
+- leading and trailing silence below SILENCE_DBFS
+
+K-weighting is applied as an FIR (the cascade's impulse response truncated
+after it has decayed) with FFT overlap-add, which keeps the filter
+vectorized without SciPy.
+
+Results are cached by payload hash (metadata-independent), with a
+(path, size, mtime) shortcut so unchanged files are not even re-hashed.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache_store import cache_dir
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+import io_throttle
+from fast_tags import ieee_extended, read_fast_tags
+from find_exact_duplicates import aiff_ssnd_range, content_digest, wav_data_range
+from records import scan_tree
+from scan_budget import budget_from_argv, newest_first
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # noqa: BLE001 - reported when the command runs
+    np = None  # type: ignore
+
+try:
+    from mutagen import File as MFile  # type: ignore
+except Exception:  # noqa: BLE001 - only needed for MP3 channel/rate lookup
+    MFile = None  # type: ignore
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+EXTENSIONS = {".wav", ".aiff", ".aif", ".flac", ".mp3", ".m4a", ".ogg", ".opus"}
+
+ANALYSIS_VERSION = 1
+COMMIT_EVERY = 50  # analyzed files between cache commits, so a killed run keeps its work
+BLOCK_FRAMES = 1 << 16
+KWEIGHT_TAPS = 8192
+SILENCE_DBFS = -60.0
+CLIP_LEVEL = 0.999  # |sample| at or above this counts as full scale
+MIN_CLIP_RUN = 3  # frames; shorter runs are normal for loud masters
+
+# Default flag thresholds
+QUIET_LUFS = -20.0
+MAX_TRUE_PEAK = 0.0
+MAX_SILENCE_S = 2.0
+
+# 4x oversampling interpolator for true peak: 48-tap windowed sinc, 4 phases
+_OVERSAMPLE = 4
+_TP_TAPS = 48
+
+
+def _db(x: float) -> float:
+    return 20.0 * math.log10(x) if x > 0 else -math.inf
+
+
+def _biquads(rate: int) -> List[Tuple[List[float], List[float]]]:
+    # K-weighting stages (high shelf, then high pass) for any sample rate
+    out = []
+    for kind, gain, q, fc in (("shelf", 4.0, 1 / math.sqrt(2), 1500.0), ("hp", 0.0, 0.5, 38.0)):
+        a_ = 10 ** (gain / 40.0)
+        w0 = 2.0 * math.pi * fc / rate
+        alpha = math.sin(w0) / (2.0 * q)
+        c = math.cos(w0)
+        if kind == "shelf":
+            sa = 2 * math.sqrt(a_) * alpha
+            b = [a_ * ((a_ + 1) + (a_ - 1) * c + sa), -2 * a_ * ((a_ - 1) + (a_ + 1) * c), a_ * ((a_ + 1) + (a_ - 1) * c - sa)]
+            a = [(a_ + 1) - (a_ - 1) * c + sa, 2 * ((a_ - 1) - (a_ + 1) * c), (a_ + 1) - (a_ - 1) * c - sa]
+        else:
+            b = [(1 + c) / 2, -(1 + c), (1 + c) / 2]
+            a = [1 + alpha, -2 * c, 1 - alpha]
+        out.append(([x / a[0] for x in b], [x / a[0] for x in a]))
+    return out
+
+
+_KERNELS: Dict[int, "np.ndarray"] = {}
+
+
+def kweight_kernel(rate: int) -> "np.ndarray":
+    """Impulse response of the K-weighting cascade, KWEIGHT_TAPS long."""
+    h = _KERNELS.get(rate)
+    if h is None:
+        x = [0.0] * KWEIGHT_TAPS
+        x[0] = 1.0
+        for b, a in _biquads(rate):
+            y = [0.0] * KWEIGHT_TAPS
+            x1 = x2 = y1 = y2 = 0.0
+            for i, xi in enumerate(x):
+                yi = b[0] * xi + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+                x2, x1, y2, y1 = x1, xi, y1, yi
+                y[i] = yi
+            x = y
+        h = np.asarray(x, dtype="f8")
+        _KERNELS[rate] = h
+    return h
+
+
+def _tp_phases() -> "np.ndarray":
+    n = np.arange(_TP_TAPS) - (_TP_TAPS - 1) / 2
+    h = np.sinc(n / _OVERSAMPLE) * np.hanning(_TP_TAPS + 2)[1:-1]
+    h *= _OVERSAMPLE / h.sum()
+    return h.reshape(-1, _OVERSAMPLE).T.copy()  # (phase, taps)
+
+
+class _Source:
+    """Blocks of float32 frames (frames, channels) plus rate/channels."""
+
+    def __init__(self, rate: int, channels: int, blocks: Iterator["np.ndarray"]) -> None:
+        self.rate = rate
+        self.channels = channels
+        self.blocks = blocks
+
+
+def _pcm_layout(path: str) -> Optional[Tuple[str, int, int, int]]:
+    """(numpy dtype, bytes per sample, channels, rate) of uncompressed
+    WAV/AIFF PCM; None for anything that needs decoding."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            little, fmt_id = True, b"fmt "
+        elif head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+            little, fmt_id = False, b"COMM"
+        else:
+            return None
+        aifc = head[8:12] == b"AIFC"
+        while True:
+            hdr = f.read(8)
+            if len(hdr) < 8:
+                return None
+            clen = int.from_bytes(hdr[4:8], "little" if little else "big")
+            if hdr[:4] == fmt_id:
+                body = f.read(min(clen, 64))
+                break
+            f.seek(clen + (clen % 2), os.SEEK_CUR)
+    if little:
+        tag = int.from_bytes(body[0:2], "little")
+        channels = int.from_bytes(body[2:4], "little")
+        rate = int.from_bytes(body[4:8], "little")
+        bits = int.from_bytes(body[14:16], "little")
+        if tag == 0xFFFE and len(body) >= 26:
+            tag = int.from_bytes(body[24:26], "little")  # WAVE_FORMAT_EXTENSIBLE subformat
+        order = "<"
+        floating = tag == 3
+        if tag not in (1, 3):
+            return None
+    else:
+        channels = int.from_bytes(body[0:2], "big")
+        bits = int.from_bytes(body[6:8], "big")
+        rate = int(ieee_extended(body[8:18]))
+        comp = body[18:22] if aifc and len(body) >= 22 else b"NONE"
+        if comp not in (b"NONE", b"sowt", b"fl32", b"FL32"):
+            return None
+        order = "<" if comp == b"sowt" else ">"
+        floating = comp in (b"fl32", b"FL32")
+    width = (bits + 7) // 8
+    if floating:
+        dtype = order + ("f4" if width == 4 else "f8")
+    elif width == 1:
+        dtype = "u1" if little else "i1"  # WAV 8-bit is unsigned, AIFF signed
+    elif width == 3:
+        dtype = order + "i3"  # assembled by hand
+    elif width in (2, 4):
+        dtype = order + f"i{width}"
+    else:
+        return None
+    if not channels or not rate:
+        return None
+    return dtype, width, channels, rate
+
+
+def _mapped_source(path: str) -> Optional[_Source]:
+    ext = os.path.splitext(path)[1].lower()
+    rng = wav_data_range(path) if ext == ".wav" else aiff_ssnd_range(path) if ext in (".aiff", ".aif") else None
+    layout = _pcm_layout(path) if rng else None
+    if not layout:
+        return None
+    dtype, width, channels, rate = layout
+    start, end = rng
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)  # truncated files: analyze what is there
+    frames = max(0, end - start) // (width * channels)
+    if frames == 0:
+        return _Source(rate, channels, iter(()))
+    if dtype.endswith("i3"):
+        raw = np.memmap(path, dtype="u1", mode="r", offset=start, shape=(frames, channels, 3))
+    else:
+        raw = np.memmap(path, dtype=dtype, mode="r", offset=start, shape=(frames, channels))
+
+    def blocks() -> Iterator["np.ndarray"]:
+        for i in range(0, frames, BLOCK_FRAMES):
+            chunk = raw[i:i + BLOCK_FRAMES]
+            io_throttle.throttle_read(chunk.nbytes)
+            if dtype.endswith("i3"):
+                b = chunk.astype("i4")
+                if dtype[0] == "<":
+                    v = b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)
+                else:
+                    v = b[..., 2] | (b[..., 1] << 8) | (b[..., 0] << 16)
+                v = np.where(v >= 1 << 23, v - (1 << 24), v)
+                yield (v / float(1 << 23)).astype("f4")
+            elif dtype[-2] == "f":
+                yield np.asarray(chunk, dtype="f4")
+            elif dtype == "u1":
+                yield ((chunk.astype("f4") - 128.0) / 128.0)
+            else:
+                yield chunk.astype("f4") / float(1 << (8 * width - 1))
+        with open(path, "rb") as f:
+            io_throttle.drop_cache(f.fileno(), start, end - start)
+
+    return _Source(rate, channels, blocks())
+
+
+def _decoded_source(path: str) -> _Source:
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("decoding this format needs ffmpeg on PATH")
+    tags = read_fast_tags(path) or {}
+    rate, channels = int(tags.get("sample_rate") or 0), int(tags.get("channels") or 0)
+    if (not rate or not channels) and MFile is not None:
+        try:
+            info = getattr(MFile(path), "info", None)
+            rate = rate or int(getattr(info, "sample_rate", 0) or 0)
+            channels = channels or int(getattr(info, "channels", 0) or 0)
+        except Exception:  # noqa: BLE001 - fall back to ffmpeg resampling below
+            pass
+    rate, channels = rate or 48000, channels or 2
+    cmd = ["ffmpeg", "-v", "error", "-nostdin", "-i", path, "-map", "0:a:0",
+           "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(rate), "-ac", str(channels), "-"]
+
+    def blocks() -> Iterator["np.ndarray"]:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            frame_bytes = 4 * channels
+            while True:
+                data = proc.stdout.read(BLOCK_FRAMES * frame_bytes)
+                if not data:
+                    break
+                usable = len(data) - len(data) % frame_bytes
+                yield np.frombuffer(data[:usable], dtype="<f4").reshape(-1, channels)
+        finally:
+            proc.stdout.close()
+            err = proc.stderr.read().decode("utf-8", "replace").strip()
+            proc.stderr.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed: {err.splitlines()[-1] if err else proc.returncode}")
+
+    return _Source(rate, channels, blocks())
+
+
+def analyze_source(src: _Source) -> Dict[str, object]:
+    rate, channels = src.rate, src.channels
+    kernel = kweight_kernel(rate)
+    taps = len(kernel)
+    nfft = 1 << (BLOCK_FRAMES + taps - 1).bit_length()
+    kspec = np.fft.rfft(kernel, nfft)
+    tp = _tp_phases()
+    seg = max(1, rate // 10)  # 100 ms gating segments
+
+    tail = np.zeros((taps - 1, channels))  # K-filter overlap-add carry
+    tp_carry = np.zeros((tp.shape[1] - 1, channels), dtype="f4")
+    seg_energy: List["np.ndarray"] = []  # per-segment sum of squares, per channel
+    partial = np.zeros(channels)
+    partial_n = 0
+    frames = 0
+    sample_peak = 0.0
+    true_peak = 0.0
+    first_loud = last_loud = None
+    clip_runs = clipped = longest = 0
+    run = 0
+    silence = 10 ** (SILENCE_DBFS / 20)
+
+    for block in src.blocks:
+        n = len(block)
+        if n == 0:
+            continue
+        x = block.astype("f8")
+        absmax = np.abs(block).max(axis=1)
+
+        # Peaks
+        sample_peak = max(sample_peak, float(absmax.max()))
+        ext = np.concatenate([tp_carry, block])
+        for ch in range(channels):
+            for phase in tp:
+                y = np.convolve(ext[:, ch], phase, mode="valid")
+                if len(y):
+                    true_peak = max(true_peak, float(np.abs(y).max()))
+        tp_carry = ext[-(tp.shape[1] - 1):]
+
+        # Silence: first/last frame above the threshold
+        loud = np.flatnonzero(absmax > silence)
+        if len(loud):
+            if first_loud is None:
+                first_loud = frames + int(loud[0])
+            last_loud = frames + int(loud[-1])
+
+        # Clipping runs across all channels, carried over block boundaries
+        hot = absmax >= CLIP_LEVEL
+        if hot.any() or run:
+            edges = np.diff(np.concatenate([[False], hot, [False]]).astype("i1"))
+            starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+            lengths = ends - starts
+            if run and hot[0]:
+                lengths[0] += run  # run continued from the previous block
+            elif run:
+                lengths = np.concatenate([[run], lengths])  # it ended at the boundary
+            run = 0
+            if hot[-1]:
+                run = int(lengths[-1])  # still open; counted once it ends
+                lengths = lengths[:-1]
+            long_runs = lengths[lengths >= MIN_CLIP_RUN]
+            clip_runs += len(long_runs)
+            clipped += int(long_runs.sum())
+            if len(long_runs):
+                longest = max(longest, int(long_runs.max()))
+
+        # K-weighting via FFT overlap-add
+        spec = np.fft.rfft(x, nfft, axis=0)
+        y = np.fft.irfft(spec * kspec[:, None], nfft, axis=0)[: n + taps - 1]
+        y[: taps - 1] += tail
+        tail = y[n:].copy()
+        sq = y[:n] ** 2
+
+        # 100 ms segment energies
+        pos = 0
+        if partial_n:
+            take = min(seg - partial_n, n)
+            partial += sq[:take].sum(axis=0)
+            partial_n += take
+            pos = take
+            if partial_n == seg:
+                seg_energy.append(partial.copy())
+                partial[:] = 0
+                partial_n = 0
+        whole = (n - pos) // seg
+        if whole:
+            seg_energy.extend(sq[pos:pos + whole * seg].reshape(whole, seg, channels).sum(axis=1))
+            pos += whole * seg
+        if pos < n:
+            partial += sq[pos:].sum(axis=0)
+            partial_n += n - pos
+        frames += n
+
+    if run >= MIN_CLIP_RUN:
+        clip_runs += 1
+        clipped += run
+        longest = max(longest, run)
+
+    # Gated integrated loudness over 400 ms blocks with 75% overlap
+    integrated = None
+    if len(seg_energy) >= 4:
+        e = np.asarray(seg_energy)
+        blocks = (e[:-3] + e[1:-2] + e[2:-1] + e[3:]) / (4 * seg)
+        weights = np.array([1.41 if c >= 3 else 1.0 for c in range(channels)])
+        z = blocks @ weights
+        with np.errstate(divide="ignore"):
+            lk = -0.691 + 10 * np.log10(z)
+        gated = z[lk > -70.0]
+        if len(gated):
+            rel = -0.691 + 10 * math.log10(gated.mean()) - 10.0
+            final = z[(lk > -70.0) & (lk > rel)]
+            if len(final):
+                integrated = round(-0.691 + 10 * math.log10(final.mean()), 2)
+
+    duration = frames / rate if rate else 0.0
+    return {
+        "version": ANALYSIS_VERSION,
+        "rate": rate,
+        "channels": channels,
+        "duration": round(duration, 3),
+        "integrated_lufs": integrated,
+        "sample_peak_dbfs": round(_db(sample_peak), 2) if sample_peak else None,
+        "true_peak_dbtp": round(_db(max(true_peak, sample_peak)), 2) if sample_peak else None,
+        "clip_runs": clip_runs,
+        "clipped_frames": clipped,
+        "longest_clip_run": longest,
+        "lead_silence": round((first_loud if first_loud is not None else frames) / rate, 3) if rate else None,
+        "trail_silence": round((frames - 1 - last_loud if last_loud is not None else frames) / rate, 3) if rate else None,
+    }
+
+
+def analyze_file(path: str) -> Dict[str, object]:
+    src = _mapped_source(path) or _decoded_source(path)
+    return analyze_source(src)
+
+
+class AnalysisCache:
+    """payload hash -> result, plus path -> (size, mtime_ns, hash)."""
+
+    def __init__(self, db_path: str) -> None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (digest BLOB PRIMARY KEY, version INTEGER NOT NULL, result TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest BLOB NOT NULL);
+            """
+        )
+
+    def known_digest(self, path: str, size: int, mtime_ns: int) -> Optional[bytes]:
+        row = self.db.execute("SELECT size, mtime_ns, digest FROM paths WHERE path = ?", (path,)).fetchone()
+        return row[2] if row and row[0] == size and row[1] == mtime_ns else None
+
+    def get(self, digest: bytes) -> Optional[Dict[str, object]]:
+        row = self.db.execute("SELECT version, result FROM results WHERE digest = ?", (digest,)).fetchone()
+        return json.loads(row[1]) if row and row[0] == ANALYSIS_VERSION else None
+
+    def put(self, path: str, size: int, mtime_ns: int, digest: bytes, result: Optional[Dict[str, object]]) -> None:
+        self.db.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)", (path, size, mtime_ns, digest))
+        if result is not None:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (digest, ANALYSIS_VERSION, json.dumps(result)))
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+
+def flags_for(r: Dict[str, object], quiet: float, max_tp: float, max_silence: float) -> List[str]:
+    out = []
+    if r["integrated_lufs"] is not None and r["integrated_lufs"] < quiet:
+        out.append(f"quiet ({r['integrated_lufs']:.1f} LUFS)")
+    if r["integrated_lufs"] is None and r["duration"]:
+        out.append("silent")
+    if r["clip_runs"]:
+        out.append(f"clipped ({r['clip_runs']} runs, longest {r['longest_clip_run']} frames)")
+    if r["true_peak_dbtp"] is not None and r["true_peak_dbtp"] > max_tp:
+        out.append(f"true peak {r['true_peak_dbtp']:+.1f} dBTP")
+    if r["lead_silence"] is not None and r["lead_silence"] > max_silence:
+        out.append(f"leading silence {r['lead_silence']:.1f}s")
+    if r["trail_silence"] is not None and r["trail_silence"] > max_silence:
+        out.append(f"trailing silence {r['trail_silence']:.1f}s")
+    return out
+
+
+def main():
+    # --format ndjson streams one JSON event per file on stdout
+    setup_from_argv("analyze_audio")
+    io_throttle.setup_from_argv()
+
+    # Get directory from command line or environment variable
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+        root = sys.argv[1]
+    else:
+        root = os.environ.get("MUSIC_LIBRARY_DIR")
+        if not root:
+            print("Error: No directory specified.")
+            print("Usage: python3 analyze_audio.py <directory> [--jobs N] [--flagged-only] [--quiet LUFS] "
+                  "[--max-true-peak DBTP] [--max-silence SECONDS] [--time-budget DURATION] [--full] [--format text|ndjson]")
+            print("Or set MUSIC_LIBRARY_DIR in your .env file")
+            sys.exit(1)
+    if np is None:
+        print("Error: analyze_audio requires numpy (python3 -m pip install numpy)")
+        sys.exit(1)
+
+    root = os.path.expanduser(root)
+    flagged_only = "--flagged-only" in sys.argv
+    full = "--full" in sys.argv
+    budget = budget_from_argv()
+    try:
+        jobs = int(arg_value("--jobs", str(os.cpu_count() or 4)))
+        quiet = float(arg_value("--quiet", str(QUIET_LUFS)))
+        max_tp = float(arg_value("--max-true-peak", str(MAX_TRUE_PEAK)))
+        max_silence = float(arg_value("--max-silence", str(MAX_SILENCE_S)))
+    except ValueError:
+        print("--jobs, --quiet, --max-true-peak and --max-silence expect numbers")
+        sys.exit(1)
+
+    if not os.path.isdir(root):
+        print(f"Root does not exist or is not a directory: {root}")
+        sys.exit(1)
+
+    table = scan_tree(root, lambda name: os.path.splitext(name)[1].lower() in EXTENSIONS, incremental=True, full=full)
+    if not len(table):
+        print("No files to examine.")
+        return
+    cache = AnalysisCache(os.path.join(cache_dir(), "analysis.sqlite"))
+
+    # The cache connection is only used on this thread: lookups happen here
+    # before work is submitted, workers only hash and analyze
+    Outcome = Tuple[int, Optional[bytes], Optional[Dict[str, object]], Optional[str], bool]  # (row, digest, result, error, cached)
+
+    def hash_job(row: int) -> Tuple[int, Optional[bytes], Optional[str]]:
+        try:
+            return row, content_digest(table.path(row)), None
+        except OSError as e:
+            return row, None, str(e)
+
+    def analyze_job(row: int, digest: bytes) -> Outcome:
+        try:
+            return row, digest, analyze_file(table.path(row)), None, False
+        except (OSError, RuntimeError, ValueError) as e:
+            return row, None, None, str(e), False
+
+    # With a budget, newest files first; analyzed results are committed as
+    # they come, so the next run picks up where this one stopped
+    rows = newest_first(table.rows(), table.mtime_ns.__getitem__) if budget.seconds else list(table.rows())
+    submitted = 0
+
+    def results() -> Iterator[Outcome]:
+        nonlocal submitted
+        # Bounded submission: an expired budget stops new work promptly
+        pending: deque = deque()  # (is_hash, future)
+        limit = 2 * max(1, jobs)
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+
+            def lookup(row: int, digest: bytes) -> Optional[Outcome]:
+                # A cached result for the payload, else queue its analysis
+                result = cache.get(digest)
+                if result is not None:
+                    return row, digest, result, None, True
+                pending.append((False, pool.submit(analyze_job, row, digest)))
+                return None
+
+            def drain() -> Iterator[Outcome]:
+                is_hash, future = pending.popleft()
+                if not is_hash:
+                    yield future.result()
+                    return
+                row, digest, error = future.result()
+                if error is not None:
+                    yield row, None, None, error, False
+                    return
+                hit = lookup(row, digest)
+                if hit is not None:
+                    yield hit
+
+            for row in rows:
+                if budget.expired():
+                    break
+                submitted += 1
+                digest = cache.known_digest(table.path(row), table.size[row], table.mtime_ns[row]) if not full else None
+                if digest is None:
+                    pending.append((True, pool.submit(hash_job, row)))
+                else:
+                    hit = lookup(row, digest)
+                    if hit is not None:
+                        yield hit
+                while len(pending) >= limit:
+                    yield from drain()
+            while pending:
+                yield from drain()
+
+    n_flagged = n_cached = n_err = 0
+    n_analyzed = 0
+    try:
+        for row, digest, result, error, cached in results():
+            path = table.path(row)
+            if error is not None:
+                n_err += 1
+                print(f"\n{path}\n  ERROR: {error}")
+                emit("error", path=path, message=error)
+                continue
+            cache.put(path, table.size[row], table.mtime_ns[row], digest, None if cached else result)
+            n_cached += cached
+            if not cached:
+                n_analyzed += 1
+                if n_analyzed % COMMIT_EVERY == 0:
+                    cache.commit()
+            flags = flags_for(result, quiet, max_tp, max_silence)
+            n_flagged += bool(flags)
+            emit("scanned", path=path, size=table.size[row], hash=digest.hex(), flags=flags, cached=cached, **{
+                k: v for k, v in result.items() if k != "version"})
+            if flagged_only and not flags:
+                continue
+            lufs = f"{result['integrated_lufs']:.1f} LUFS" if result["integrated_lufs"] is not None else "-- LUFS"
+            tp = f"{result['true_peak_dbtp']:+.1f} dBTP" if result["true_peak_dbtp"] is not None else "-- dBTP"
+            print(f"\n{path}\n  {lufs} | {tp} | lead {result['lead_silence']:.1f}s | trail {result['trail_silence']:.1f}s")
+            for flag in flags:
+                print(f"  FLAG: {flag}")
+    finally:
+        cache.close()
+
+    deferred = len(rows) - submitted
+    if deferred:
+        print(f"\nTime budget reached: {deferred} file(s) left; run again to continue.")
+    print(f"\nDone. Files: {len(table)} | Flagged: {n_flagged} | From cache: {n_cached} | Errors: {n_err}")
+    emit("done", files=len(table), flagged=n_flagged, cached=n_cached, errors=n_err, deferred=deferred or None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Where the utilities keep persistent state (walk snapshots, indexes, caches).
+
+Everything lives under `DECKREADY_CACHE_DIR` (default `~/.cache/deckready`),
+one file per (kind, library root). Files are replaced atomically so an
+interrupted run never leaves a half-written cache behind.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def cache_dir() -> str:
+    base = os.environ.get("DECKREADY_CACHE_DIR") or "~/.cache/deckready"
+    return os.path.expanduser(base)
+
+
+def cache_path(kind: str, root: str, suffix: str = ".json") -> str:
+    """Per-root state file, e.g. cache_path("walk", "/Volumes/NAS/Music")."""
+    key = hashlib.sha1(os.path.realpath(root).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(cache_dir(), f"{kind}-{key}{suffix}")
+
+
+def atomic_write_bytes(path: str, data: bytes, durable: bool = False) -> None:
+    """Write via a temp file and rename; `durable` fsyncs the data before the
+    rename (for removable drives that may be pulled at any moment)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_json(path: str, default: Any = None) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path: str, obj: Any) -> None:
+    atomic_write_bytes(path, json.dumps(obj, separators=(",", ":")).encode("utf-8"))
@@ -0,0 +1,219 @@
+"""
+Content-defined chunk index for spotting truncated and partial duplicates.
+
+Each file's audio payload (see find_exact_duplicates.payload_range) is cut at
+content-defined boundaries: a boundary falls wherever a hash of the preceding
+16 bytes has its top AVG_BITS bits clear, subject to MIN_CHUNK/MAX_CHUNK.
+Because boundaries depend only on local content, a truncated copy of a track
+produces the same chunk sequence as the good copy up to the point where it
+was cut, and shifted or partially shared payloads still line up.
+
+Chunk digests (16-byte BLAKE2b) are stored in a SQLite index next to the
+other caches, keyed by path + (size, mtime_ns), so re-runs only chunk new or
+changed files. Requires NumPy for the boundary scan.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # noqa: BLE001 - numpy is optional for the other modes
+    np = None  # type: ignore
+
+AVG_BITS = 20  # ~1 MiB average chunk
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+WINDOW = 16
+READ_SIZE = 16 * 1024 * 1024
+DIGEST_SIZE = 16
+
+# Chunks shared by more than this many files (digital silence, generic
+# intros) say nothing about two files being related and are ignored
+COMMON_CHUNK_FILES = 16
+
+_C1 = 0x9E3779B97F4A7C15
+_C2 = 0xC2B2AE3D27D4EB4F
+
+
+class Chunk(NamedTuple):
+    digest: bytes
+    length: int
+
+
+class PartialMatch(NamedTuple):
+    path: str
+    other: str
+    kind: str  # "prefix" (path is a truncated copy of other) or "overlap"
+    percent: float  # share of path's payload also found in other
+
+
+def _boundaries(buf: bytes) -> "np.ndarray":
+    # Candidate cut offsets (end-exclusive) where the 16-byte window hash hits
+    n = len(buf) - WINDOW + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    words = np.ndarray(shape=(len(buf) - 7,), dtype="<u8", buffer=buf, strides=(1,))
+    with np.errstate(over="ignore"):
+        h = (words[:n] * np.uint64(_C1)) ^ (words[8:8 + n] * np.uint64(_C2))
+    hits = (h >> np.uint64(64 - AVG_BITS)) == 0
+    return np.flatnonzero(hits) + WINDOW
+
+
+def iter_chunks(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Chunk]:
+    """Yield content-defined chunks of path[start:end]."""
+    if np is None:
+        raise RuntimeError("content-defined chunking requires numpy (python3 -m pip install numpy)")
+    size = os.path.getsize(path)
+    if end is None or end > size:
+        end = size
+    remaining = max(0, end - start)
+    carry = b""
+    with open(path, "rb") as f:
+        f.seek(start)
+        while True:
+            data = f.read(min(READ_SIZE, remaining)) if remaining else b""
+            remaining -= len(data)
+            eof = not data
+            buf = carry + data
+            cands = _boundaries(buf)
+            last = 0
+            while True:
+                i = int(np.searchsorted(cands, last + MIN_CHUNK))
+                cut = int(cands[i]) if i < len(cands) else None
+                if cut is None or cut - last > MAX_CHUNK:
+                    if last + MAX_CHUNK <= len(buf):
+                        cut = last + MAX_CHUNK
+                    else:
+                        break
+                piece = memoryview(buf)[last:cut]
+                yield Chunk(hashlib.blake2b(piece, digest_size=DIGEST_SIZE).digest(), cut - last)
+                last = cut
+            carry = buf[last:]
+            if eof:
+                if carry:
+                    yield Chunk(hashlib.blake2b(carry, digest_size=DIGEST_SIZE).digest(), len(carry))
+                return
+
+
+class ChunkIndex:
+    """Persistent path -> chunk sequence index backed by SQLite."""
+
+    def __init__(self, db_path: str) -> None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                payload INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                file_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                digest BLOB NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (file_id, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS chunks_digest ON chunks (digest);
+            """
+        )
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def is_current(self, path: str, size: int, mtime_ns: int) -> bool:
+        row = self.db.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime_ns
+
+    def update(self, path: str, size: int, mtime_ns: int, chunks: List[Chunk]) -> None:
+        cur = self.db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if cur:
+            self.db.execute("DELETE FROM chunks WHERE file_id = ?", (cur[0],))
+            self.db.execute("DELETE FROM files WHERE id = ?", (cur[0],))
+        fid = self.db.execute(
+            "INSERT INTO files (path, size, mtime_ns, payload) VALUES (?, ?, ?, ?)",
+            (path, size, mtime_ns, sum(c.length for c in chunks)),
+        ).lastrowid
+        self.db.executemany(
+            "INSERT INTO chunks (file_id, seq, digest, length) VALUES (?, ?, ?, ?)",
+            [(fid, i, c.digest, c.length) for i, c in enumerate(chunks)],
+        )
+
+    def prune(self, keep_paths: set) -> None:
+        """Drop files that no longer exist under the scanned root."""
+        stale = [(fid,) for fid, p in self.db.execute("SELECT id, path FROM files") if p not in keep_paths]
+        self.db.executemany("DELETE FROM chunks WHERE file_id = ?", stale)
+        self.db.executemany("DELETE FROM files WHERE id = ?", stale)
+
+    def _sequence(self, fid: int) -> List[bytes]:
+        return [d for (d,) in self.db.execute("SELECT digest FROM chunks WHERE file_id = ? ORDER BY seq", (fid,))]
+
+    def partial_matches(self, min_percent: float = 80.0, only_paths: Optional[set] = None) -> List[PartialMatch]:
+        """Pairs where one file's chunk sequence is a strict prefix of the
+        other's, or where at least min_percent of its payload bytes also
+        occur in the other. Identical sequences are left to the exact mode.
+        `only_paths` limits results to pairs involving those paths."""
+        self.db.execute("DROP TABLE IF EXISTS temp.informative")
+        self.db.execute(
+            """
+            CREATE TEMP TABLE informative AS
+            SELECT digest FROM chunks GROUP BY digest
+            HAVING COUNT(DISTINCT file_id) BETWEEN 2 AND ?
+            """,
+            (COMMON_CHUNK_FILES,),
+        )
+        shared: Dict[Tuple[int, int], int] = {}
+        for a, b, nbytes in self.db.execute(
+            """
+            SELECT a.file_id, b.file_id, SUM(a.length)
+            FROM chunks a
+            JOIN informative i ON i.digest = a.digest
+            JOIN chunks b ON b.digest = a.digest AND b.file_id <> a.file_id
+            GROUP BY a.file_id, b.file_id
+            """
+        ):
+            shared[(a, b)] = nbytes
+        files = {fid: (p, payload) for fid, p, payload in self.db.execute("SELECT id, path, payload FROM files")}
+        seqs: Dict[int, List[bytes]] = {}
+
+        def seq(fid: int) -> List[bytes]:
+            if fid not in seqs:
+                seqs[fid] = self._sequence(fid)
+            return seqs[fid]
+
+        out: List[PartialMatch] = []
+        for (a, b), nbytes in sorted(shared.items()):
+            if a > b and (b, a) in shared:
+                continue  # unordered pair, handled from the (b, a) side
+            path_a, payload_a = files[a]
+            path_b, payload_b = files[b]
+            if only_paths is not None and path_a not in only_paths and path_b not in only_paths:
+                continue
+            sa, sb = seq(a), seq(b)
+            if sa == sb:
+                continue
+            # A truncated copy matches every chunk except the one it was cut in
+            if payload_a < payload_b and len(sa) >= 2 and sa[:-1] == sb[:len(sa) - 1]:
+                out.append(PartialMatch(path_a, path_b, "prefix", 100.0 * payload_a / payload_b))
+                continue
+            if payload_b < payload_a and len(sb) >= 2 and sb[:-1] == sa[:len(sb) - 1]:
+                out.append(PartialMatch(path_b, path_a, "prefix", 100.0 * payload_b / payload_a))
+                continue
+            # Report the direction with the larger covered share
+            candidates = [(min(nbytes, payload_a) / payload_a if payload_a else 0.0, path_a, path_b)]
+            back = shared.get((b, a))
+            if back is not None and payload_b:
+                candidates.append((min(back, payload_b) / payload_b, path_b, path_a))
+            share, path, other = max(candidates)
+            if 100.0 * share >= min_percent:
+                out.append(PartialMatch(path, other, "overlap", 100.0 * share))
+        return out
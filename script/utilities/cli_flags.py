@@ -0,0 +1,31 @@
+"""
+Tiny helpers for the sys.argv-style flag parsing used by the utilities.
+"""
+
+from __future__ import annotations
+
+import sys
+from typing import List, Optional
+
+
+def arg_value(flag: str, default: Optional[str] = None, argv: Optional[List[str]] = None) -> Optional[str]:
+    """Value of `--flag VALUE` or `--flag=VALUE`; `default` when absent."""
+    args = sys.argv if argv is None else argv
+    for i, a in enumerate(args):
+        if a == flag and i + 1 < len(args):
+            return args[i + 1]
+        if a.startswith(flag + "="):
+            return a[len(flag) + 1:]
+    return default
+
+
+def arg_values(flag: str, argv: Optional[List[str]] = None) -> List[str]:
+    """All values of a repeatable `--flag VALUE` option, in order."""
+    args = sys.argv if argv is None else argv
+    out: List[str] = []
+    for i, a in enumerate(args):
+        if a == flag and i + 1 < len(args):
+            out.append(args[i + 1])
+        elif a.startswith(flag + "="):
+            out.append(a[len(flag) + 1:])
+    return out
@@ -0,0 +1,125 @@
+"""
+Directory-relative file operations for renames in deep trees.
+
+Every os.replace/os.path.exists/os.remove on an absolute path makes the
+kernel resolve each component again (`/Volumes/NAS/Music/Genre/Artist/...`),
+which is slow on network filesystems. DirFds opens each directory once and
+runs stat/rename/link/unlink/rmdir/scandir relative to that descriptor (`dir_fd=`),
+so a per-file operation costs one component lookup. Directories are opened
+relative to an already-open parent when there is one.
+
+Open descriptors are kept in a small LRU (MAX_OPEN). On platforms without
+dir_fd support the same methods fall back to plain path operations.
+"""
+
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from typing import Iterator, List
+
+MAX_OPEN = 64
+
+_DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+SUPPORTED = {os.stat, os.rename, os.replace, os.unlink, os.rmdir, os.open} <= os.supports_dir_fd and (
+    os.scandir in os.supports_fd
+)
+
+
+class DirFds:
+    """LRU of open directory descriptors keyed by absolute directory path."""
+
+    def __init__(self, max_open: int = MAX_OPEN) -> None:
+        self.max_open = max(2, max_open)
+        self._fds: "OrderedDict[str, int]" = OrderedDict()
+
+    def __enter__(self) -> "DirFds":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        while self._fds:
+            _path, fd = self._fds.popitem()
+            os.close(fd)
+
+    def fd(self, dirpath: str) -> int:
+        dirpath = os.path.abspath(dirpath)
+        fd = self._fds.get(dirpath)
+        if fd is not None:
+            self._fds.move_to_end(dirpath)
+            return fd
+        parent, name = os.path.split(dirpath)
+        parent_fd = self._fds.get(parent)
+        if parent_fd is not None and name:
+            fd = os.open(name, _DIR_FLAGS, dir_fd=parent_fd)
+        else:
+            fd = os.open(dirpath, _DIR_FLAGS)
+        self._fds[dirpath] = fd
+        while len(self._fds) > self.max_open:
+            _old, old_fd = self._fds.popitem(last=False)
+            os.close(old_fd)
+        return fd
+
+    def forget(self, dirpath: str) -> None:
+        """Close the descriptor of a directory that was removed or renamed."""
+        fd = self._fds.pop(os.path.abspath(dirpath), None)
+        if fd is not None:
+            os.close(fd)
+
+    def exists(self, path: str) -> bool:
+        if not SUPPORTED:
+            return os.path.exists(path)
+        dirpath, name = os.path.split(path)
+        try:
+            os.stat(name, dir_fd=self.fd(dirpath))
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        except OSError:
+            return os.path.exists(path)
+        return True
+
+    def replace(self, src: str, dst: str) -> None:
+        if not SUPPORTED:
+            os.replace(src, dst)
+            return
+        sdir, sname = os.path.split(src)
+        ddir, dname = os.path.split(dst)
+        os.replace(sname, dname, src_dir_fd=self.fd(sdir), dst_dir_fd=self.fd(ddir))
+
+    def link(self, src: str, dst: str) -> None:
+        if not SUPPORTED or os.link not in os.supports_dir_fd:
+            os.link(src, dst)
+            return
+        sdir, sname = os.path.split(src)
+        ddir, dname = os.path.split(dst)
+        os.link(sname, dname, src_dir_fd=self.fd(sdir), dst_dir_fd=self.fd(ddir))
+
+    def unlink(self, path: str) -> None:
+        if not SUPPORTED:
+            os.remove(path)
+            return
+        dirpath, name = os.path.split(path)
+        os.unlink(name, dir_fd=self.fd(dirpath))
+
+    def rmdir(self, path: str) -> None:
+        self.forget(path)
+        if not SUPPORTED:
+            os.rmdir(path)
+            return
+        parent, name = os.path.split(os.path.abspath(path))
+        os.rmdir(name, dir_fd=self.fd(parent))
+
+    def scandir(self, dirpath: str) -> Iterator[os.DirEntry]:
+        """Entries of a directory; with dir_fd support their .path is only
+        the name, so join with dirpath where a full path is needed."""
+        if not SUPPORTED:
+            return os.scandir(dirpath)
+        return os.scandir(self.fd(dirpath))
+
+    def listdir(self, dirpath: str) -> List[str]:
+        if not SUPPORTED:
+            return os.listdir(dirpath)
+        return os.listdir(self.fd(dirpath))
+
@@ -0,0 +1,199 @@
+"""
+Advisory per-directory locks and atomic name claims for concurrent runs.
+
+Two Automator drops into organize_audio, or a cron dedupe overlapping an
+organize run, may pick names in the same folder at the same time. Scripts
+that choose a destination name hold lock_dir(folder) from the existence
+check until the file is in place, so for cooperating processes the check
+and the write are one step. Independent folders never wait for each other.
+
+Locks are fcntl.flock on one small file per directory under
+<cache dir>/locks (named by a hash of the directory), so library folders
+stay clean; the kernel drops them when a process exits, even on a crash.
+They are local to this machine: runs on two hosts against one NAS are
+protected only by the atomic claims below.
+
+A name picked for a write that outlasts the folder lock (a copy or an
+extraction) is held by reserve_name(): the same kind of flock, keyed by the
+file's path, that reserved() lets other runs see. The bytes go to a hidden
+`.part` sibling that rename_noreplace() moves into place at the end, so a
+killed run leaves nothing under the final name and its reservation ends
+with the process.
+
+Names are claimed atomically as well, which also guards against programs
+that take no lock: rename_noreplace() links the new name (failing if it
+exists) before removing the old one, and claim_unique() creates an empty
+placeholder with O_CREAT|O_EXCL that the caller then replaces with the real
+file. Without fcntl the locks are no-ops and the claims remain.
+"""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import os
+from typing import Callable, Optional
+
+from cache_store import cache_dir
+from dir_fds import DirFds
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+
+def lock_path(dirpath: str) -> str:
+    key = hashlib.sha1(os.path.abspath(dirpath).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(cache_dir(), "locks", f"{key}.lock")
+
+
+class DirLock:
+    """Exclusive flock for one directory; a context manager. Separate
+    DirLock objects exclude each other across threads as well."""
+
+    def __init__(self, dirpath: str) -> None:
+        self.dirpath = dirpath
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> "DirLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def acquire(self) -> None:
+        if fcntl is None or self._fd is not None:
+            return
+        path = lock_path(self.dirpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_CLOEXEC", 0), 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is not None:
+            # Closing the descriptor drops the flock
+            os.close(self._fd)
+            self._fd = None
+
+
+def lock_dir(dirpath: str | os.PathLike) -> DirLock:
+    return DirLock(os.fspath(dirpath))
+
+
+class NameReservation(DirLock):
+    """reserve_name()'s lock. Its lock file is removed on release, so take,
+    test and release reservations while holding lock_dir() of the folder."""
+
+    def release(self) -> None:
+        if self._fd is not None:
+            try:
+                os.unlink(lock_path(self.dirpath))
+            except OSError:
+                pass
+        super().release()
+
+
+def reserve_name(path: str | os.PathLike) -> NameReservation:
+    """Hold path's name until release(); call under lock_dir() of its folder
+    after checking reserved()."""
+    reservation = NameReservation(os.fspath(path))
+    reservation.acquire()
+    return reservation
+
+
+def reserved(path: str | os.PathLike) -> bool:
+    """True while a run on this machine holds reserve_name(path)."""
+    if fcntl is None:
+        return False
+    try:
+        fd = os.open(lock_path(os.fspath(path)), os.O_RDWR | getattr(os, "O_CLOEXEC", 0))
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def part_path(path: str | os.PathLike) -> str:
+    """Hidden sibling that a write to path goes to before it is renamed in."""
+    path = os.fspath(path)
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.part")
+
+
+def claim(path: str) -> bool:
+    """Create an empty placeholder at path; False when the name is taken."""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0), 0o644)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+
+def claim_unique(path: str, taken: Optional[set] = None) -> str:
+    """Claim path, else `base (1).ext`, `base (2).ext`, ... (skipping names
+    in `taken`); returns the claimed name, whose placeholder the caller
+    replaces (os.replace, shutil.move/copy2) or release()s."""
+    base, ext = os.path.splitext(path)
+    candidate, n = path, 1
+    while (taken is not None and candidate in taken) or not claim(candidate):
+        candidate = f"{base} ({n}){ext}"
+        n += 1
+    return candidate
+
+
+def release(path: str) -> None:
+    """Remove a placeholder from claim()/claim_unique() that was not used."""
+    try:
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def rename_noreplace(src: str, dst: str, fs: Optional[DirFds] = None) -> None:
+    """os.rename that raises FileExistsError instead of replacing dst. Uses
+    link()+unlink(); where hard links are unsupported (exFAT, some SMB
+    shares) it checks and renames, which is atomic only under lock_dir()."""
+    link: Callable[[str, str], None] = fs.link if fs is not None else os.link
+    unlink: Callable[[str], None] = fs.unlink if fs is not None else os.unlink
+    try:
+        link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EXDEV, errno.EMLINK, errno.ENOSYS):
+            raise
+        exists = fs.exists if fs is not None else os.path.lexists
+        if exists(dst):
+            raise FileExistsError(errno.EEXIST, "File exists", dst) from None
+        if fs is not None:
+            fs.replace(src, dst)
+        else:
+            os.rename(src, dst)
+        return
+    unlink(src)
+
+
+def rename_unique(src: str, dirpath: str, name: str, unique: Callable[[str, str], str], fs: Optional[DirFds] = None) -> str:
+    """Rename src into dirpath as `unique(dirpath, name)` (a script's
+    ensure_unique_name), picking again whenever something else takes the
+    name first. Call it holding lock_dir(dirpath). Returns the new path."""
+    while True:
+        dst = os.path.join(dirpath, unique(dirpath, name))
+        try:
+            rename_noreplace(src, dst, fs)
+        except FileExistsError:
+            continue
+        return dst
@@ -0,0 +1,118 @@
+"""
+NDJSON event stream for machine consumers (`--format ndjson`).
+
+In ndjson mode stdout carries one JSON object per line, written as each
+decision is made, and the usual human-readable text moves to stderr. Every
+event has "event" and "tool" keys; the rest depend on the event type:
+
+- scanned: path, size, plus whatever the tool learned (hash, artist, title,
+           duration, issues)
+- group:   kind, key, paths, keep (the copy a duplicate group would keep)
+- op:      op (rename/move/copy/rm/prune), src, dst, keep, status
+           (suggested, planned, dry_run, applied, skipped), reason
+- error:   path, message
+- done:    counts for the run
+
+Keys that do not apply to an event are omitted rather than set to null.
+Decisions (group, op, error, done) are flushed as they are written. Scanned
+events are batched: they are flushed at most FLUSH_INTERVAL seconds after
+being written, by the next event or by a timer when the tool goes quiet
+(e.g. while hashing one large file), so a consumer sees early results
+without paying for a flush per line.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import sys
+import threading
+import time
+from typing import Any, List, Optional, TextIO
+
+from cli_flags import arg_value
+
+FORMATS = ("text", "ndjson")
+FLUSH_INTERVAL = 0.05
+FLUSH_NOW = {"group", "op", "error", "done"}
+
+_out: Optional[TextIO] = None
+_tool = ""
+_last_flush = 0.0
+_lock = threading.Lock()
+_timer: Optional[threading.Timer] = None
+# ASCII output keeps undecodable (surrogate-escaped) filenames writable
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def enabled() -> bool:
+    return _out is not None
+
+
+def enable(tool: str) -> None:
+    """Route events to stdout and the human text to stderr."""
+    global _out, _tool
+    if _out is not None:
+        return
+    _out = sys.stdout
+    _tool = tool
+    sys.stdout = sys.stderr
+    atexit.register(flush)
+
+
+def setup_from_argv(tool: str, argv: Optional[List[str]] = None) -> bool:
+    """Handle `--format text|ndjson`; returns True in ndjson mode."""
+    fmt = arg_value("--format", "text", argv)
+    if fmt not in FORMATS:
+        print(f"--format expects one of: {', '.join(FORMATS)}")
+        sys.exit(2)
+    if fmt == "ndjson":
+        enable(tool)
+    return enabled()
+
+
+def emit(event: str, **fields: Any) -> None:
+    """Write one event; a no-op outside ndjson mode. None-valued fields are dropped."""
+    global _timer
+    if _out is None:
+        return
+    rec = {"event": event, "tool": _tool}
+    for k, v in fields.items():
+        if v is not None:
+            rec[k] = v
+    line = _encode(rec) + "\n"
+    with _lock:
+        _out.write(line)
+        if event in FLUSH_NOW or time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+            _flush_locked()
+        elif _timer is None:
+            # Nothing may follow for a while; do not leave this line buffered
+            _timer = threading.Timer(FLUSH_INTERVAL, _flush_timer)
+            _timer.daemon = True
+            _timer.start()
+
+
+def _flush_locked() -> None:
+    global _last_flush, _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    try:
+        _out.flush()
+    except (OSError, ValueError):
+        pass
+    _last_flush = time.monotonic()
+
+
+def _flush_timer() -> None:
+    global _timer
+    with _lock:
+        _timer = None
+        if _out is not None:
+            _flush_locked()
+
+
+def flush() -> None:
+    if _out is not None:
+        with _lock:
+            _flush_locked()
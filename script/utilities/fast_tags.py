@@ -0,0 +1,372 @@
+"""
+Lightweight tag reader for the utilities.
+
+Reads only the tag region of a file and only the frames/fields the scripts
+actually use (artist, album artist, composer, title, album, genre, length).
+Picture frames (APIC/PIC, FLAC PICTURE blocks) are skipped with a seek, so
+neither time nor memory scales with embedded artwork.
+
+Supported without mutagen:
+- ID3v2.2/2.3/2.4 at the start of MP3 files
+- ID3 chunks inside AIFF (`ID3 `) and WAV (`id3 `/`ID3 `) containers
+- FLAC Vorbis comments (+ STREAMINFO for length)
+- WAV RIFF `LIST/INFO` (+ `fmt `/`data` for length)
+- AIFF `NAME`/`AUTH` text chunks (+ `COMM` for length)
+
+For FLAC/WAV/AIFF the stream header also yields "length", "sample_rate",
+"bits" and "channels". MP3 frame headers are not parsed and the ID3 TLEN
+frame is ignored (it is often missing, stale or wrong), so MP3 results carry
+no "length"; callers needing it take mutagen's info.length.
+
+`read_fast_tags()` returns None whenever a file uses something this reader
+does not handle (unsynchronised or compressed frames, unknown containers,
+truncated headers); callers then fall back to a single mutagen parse.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from typing import BinaryIO, Dict, List, Optional
+
+# Result keys, mirroring mutagen's "easy" names
+TEXT_KEYS = ("artist", "albumartist", "composer", "title", "album", "genre")
+
+ID3_FRAMES = {
+    "TPE1": "artist",
+    "TPE2": "albumartist",
+    "TCOM": "composer",
+    "TIT2": "title",
+    "TALB": "album",
+    "TCON": "genre",
+}
+
+# ID3v2.2 uses three-character frame ids
+ID3V22_FRAMES = {
+    "TP1": "TPE1",
+    "TP2": "TPE2",
+    "TCM": "TCOM",
+    "TT2": "TIT2",
+    "TAL": "TALB",
+    "TCO": "TCON",
+}
+
+VORBIS_FIELDS = {
+    "ARTIST": "artist",
+    "ALBUMARTIST": "albumartist",
+    "ALBUM ARTIST": "albumartist",
+    "COMPOSER": "composer",
+    "TITLE": "title",
+    "ALBUM": "album",
+    "GENRE": "genre",
+}
+
+RIFF_INFO_FIELDS = {
+    b"IART": "artist",
+    b"INAM": "title",
+    b"IPRD": "album",
+    b"IGNR": "genre",
+}
+
+AIFF_TEXT_CHUNKS = {
+    b"NAME": "title",
+    b"AUTH": "artist",
+}
+
+# Vorbis comments larger than this are never fields we want (e.g. embedded
+# METADATA_BLOCK_PICTURE) and are skipped unread
+_MAX_COMMENT = 64 * 1024
+
+
+class _Unsupported(Exception):
+    """Raised internally when the fast path cannot parse a file faithfully."""
+
+
+def _synchsafe(b: bytes) -> int:
+    return (b[0] & 0x7F) << 21 | (b[1] & 0x7F) << 14 | (b[2] & 0x7F) << 7 | (b[3] & 0x7F)
+
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) < n:
+        raise _Unsupported("truncated")
+    return data
+
+
+def _decode_id3_text(body: bytes) -> List[str]:
+    if not body:
+        return []
+    enc, raw = body[0], body[1:]
+    if enc == 0:
+        text, sep = raw.decode("latin-1"), "\0"
+    elif enc == 1:
+        text, sep = raw.decode("utf-16"), "\0"
+    elif enc == 2:
+        text, sep = raw.decode("utf-16-be"), "\0"
+    elif enc == 3:
+        text, sep = raw.decode("utf-8"), "\0"
+    else:
+        raise _Unsupported("text encoding")
+    values = (v.strip().lstrip("\ufeff") for v in text.split(sep))
+    return [v for v in values if v]
+
+
+def _add(tags: Dict[str, object], key: str, values: List[str]) -> None:
+    if not values:
+        return
+    existing = tags.setdefault(key, [])
+    assert isinstance(existing, list)
+    existing.extend(values)
+
+
+def _parse_id3(f: BinaryIO, tags: Dict[str, object], limit: Optional[int] = None) -> None:
+    """Parse an ID3v2 tag starting at the current offset. Only wanted frames
+    are read; everything else (including artwork) is skipped by seeking."""
+    base = f.tell()
+    head = _read_exact(f, 10)
+    if head[0:3] != b"ID3":
+        raise _Unsupported("no ID3 header")
+    major, flags = head[3], head[5]
+    if major not in (2, 3, 4):
+        raise _Unsupported("ID3 version")
+    if flags & 0x80:
+        # whole-tag unsynchronisation; let mutagen undo it
+        raise _Unsupported("unsynchronised tag")
+    end = base + 10 + _synchsafe(head[6:10])
+    if limit is not None:
+        end = min(end, limit)
+
+    if flags & 0x40 and major >= 3:
+        ext = _read_exact(f, 4)
+        if major == 4:
+            f.seek(base + 10 + _synchsafe(ext))
+        else:
+            f.seek(int.from_bytes(ext, "big"), os.SEEK_CUR)
+
+    hdr_len = 6 if major == 2 else 10
+    while f.tell() + hdr_len <= end:
+        fh = _read_exact(f, hdr_len)
+        if fh[0] == 0:
+            break  # padding
+        if major == 2:
+            fid = ID3V22_FRAMES.get(fh[0:3].decode("latin-1"), "")
+            size = int.from_bytes(fh[3:6], "big")
+            fflags = 0
+        else:
+            fid = fh[0:4].decode("latin-1")
+            raw_size = fh[4:8]
+            if major == 4 and not any(b & 0x80 for b in raw_size):
+                size = _synchsafe(raw_size)
+            else:
+                size = int.from_bytes(raw_size, "big")
+            fflags = int.from_bytes(fh[8:10], "big")
+        if size < 0 or f.tell() + size > end:
+            break
+        if size == 0:
+            continue
+        key = ID3_FRAMES.get(fid)
+        if key is None:
+            f.seek(size, os.SEEK_CUR)
+            continue
+        # compression / encryption / frame-level unsynchronisation
+        if (major == 3 and fflags & 0x00C0) or (major == 4 and fflags & 0x000E):
+            raise _Unsupported("encoded frame")
+        body = _read_exact(f, size)
+        if major == 4 and fflags & 0x0001:
+            body = body[4:]  # data length indicator
+        _add(tags, key, _decode_id3_text(body))
+
+
+def _read_mp3(f: BinaryIO, tags: Dict[str, object]) -> None:
+    if f.read(3) != b"ID3":
+        # no ID3v2 tag; mutagen also knows ID3v1/APE and MPEG length
+        raise _Unsupported("no ID3v2")
+    f.seek(0)
+    _parse_id3(f, tags)
+
+
+def _read_flac(f: BinaryIO, tags: Dict[str, object]) -> None:
+    if f.read(4) != b"fLaC":
+        raise _Unsupported("not FLAC")
+    while True:
+        hdr = _read_exact(f, 4)
+        is_last = hdr[0] & 0x80
+        btype = hdr[0] & 0x7F
+        length = int.from_bytes(hdr[1:4], "big")
+        block_end = f.tell() + length
+        if btype == 0 and length >= 18:
+            si = _read_exact(f, 18)
+            rate = int.from_bytes(si[10:13], "big") >> 4
+            total = int.from_bytes(si[13:18], "big") & 0xFFFFFFFFF
+            if rate and total:
+                tags["length"] = total / rate
+            if rate:
+                tags["sample_rate"] = rate
+                tags["channels"] = ((si[12] >> 1) & 0x7) + 1
+                tags["bits"] = (((si[12] & 0x1) << 4) | (si[13] >> 4)) + 1
+        elif btype == 4:
+            vendor_len = struct.unpack("<I", _read_exact(f, 4))[0]
+            f.seek(vendor_len, os.SEEK_CUR)
+            count = struct.unpack("<I", _read_exact(f, 4))[0]
+            for _ in range(count):
+                n = struct.unpack("<I", _read_exact(f, 4))[0]
+                if n > _MAX_COMMENT:
+                    f.seek(n, os.SEEK_CUR)
+                    continue
+                entry = _read_exact(f, n).decode("utf-8", "replace")
+                k, sep, v = entry.partition("=")
+                key = VORBIS_FIELDS.get(k.upper())
+                if sep and key and v.strip():
+                    _add(tags, key, [v.strip()])
+        f.seek(block_end)
+        if is_last:
+            return
+
+
+def _read_wav(f: BinaryIO, tags: Dict[str, object]) -> None:
+    if f.read(4) != b"RIFF":
+        raise _Unsupported("not RIFF")
+    f.seek(8)
+    if f.read(4) != b"WAVE":
+        raise _Unsupported("not WAVE")
+    byte_rate = 0
+    data_len = 0
+    info: Dict[str, object] = {}
+    id3: Dict[str, object] = {}
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            break
+        cid = hdr[0:4]
+        clen = int.from_bytes(hdr[4:8], "little")
+        start = f.tell()
+        if cid == b"fmt " and clen >= 16:
+            fmt = _read_exact(f, 16)
+            byte_rate = int.from_bytes(fmt[8:12], "little")
+            tags["channels"] = int.from_bytes(fmt[2:4], "little")
+            tags["sample_rate"] = int.from_bytes(fmt[4:8], "little")
+            tags["bits"] = int.from_bytes(fmt[14:16], "little")
+        elif cid == b"data":
+            data_len = clen
+        elif cid in (b"id3 ", b"ID3 "):
+            _parse_id3(f, id3, start + clen)
+        elif cid == b"LIST" and clen >= 4 and f.read(4) == b"INFO":
+            end = start + clen
+            while f.tell() + 8 <= end:
+                sh = _read_exact(f, 8)
+                slen = int.from_bytes(sh[4:8], "little")
+                key = RIFF_INFO_FIELDS.get(sh[0:4])
+                if key:
+                    raw = _read_exact(f, slen).split(b"\0", 1)[0]
+                    value = raw.decode("utf-8", "replace").strip()
+                    if value:
+                        _add(info, key, [value])
+                    f.seek(slen % 2, os.SEEK_CUR)
+                else:
+                    f.seek(slen + (slen % 2), os.SEEK_CUR)
+        f.seek(start + clen + (clen % 2))
+    # ID3 wins over RIFF INFO, matching what mutagen exposes
+    for key, value in info.items():
+        tags.setdefault(key, value)
+    tags.update(id3)
+    if byte_rate and data_len:
+        tags["length"] = data_len / byte_rate
+
+
+def ieee_extended(b: bytes) -> float:
+    # 80-bit IEEE 754 extended precision, used for the AIFF sample rate
+    expon = int.from_bytes(b[0:2], "big")
+    mant = int.from_bytes(b[2:10], "big")
+    sign = -1 if expon & 0x8000 else 1
+    expon &= 0x7FFF
+    if (expon == 0 and mant == 0) or expon == 0x7FFF:
+        return 0.0  # zero, or infinity/NaN in a corrupt COMM chunk: rate unknown
+    try:
+        return sign * mant * 2.0 ** (expon - 16383 - 63)
+    except OverflowError:
+        return 0.0
+
+
+def _read_aiff(f: BinaryIO, tags: Dict[str, object]) -> None:
+    if f.read(4) != b"FORM":
+        raise _Unsupported("not IFF")
+    f.seek(8)
+    if f.read(4) not in (b"AIFF", b"AIFC"):
+        raise _Unsupported("not AIFF")
+    text: Dict[str, object] = {}
+    id3: Dict[str, object] = {}
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            break
+        cid = hdr[0:4]
+        clen = int.from_bytes(hdr[4:8], "big")
+        start = f.tell()
+        if cid == b"COMM" and clen >= 18:
+            comm = _read_exact(f, 18)
+            frames = int.from_bytes(comm[2:6], "big")
+            rate = ieee_extended(comm[8:18])
+            if frames and rate:
+                tags["length"] = frames / rate
+            tags["channels"] = int.from_bytes(comm[0:2], "big")
+            tags["bits"] = int.from_bytes(comm[6:8], "big")
+            tags["sample_rate"] = int(rate)
+        elif cid == b"ID3 ":
+            _parse_id3(f, id3, start + clen)
+        elif cid in AIFF_TEXT_CHUNKS:
+            value = _read_exact(f, clen).split(b"\0", 1)[0].decode("latin-1").strip()
+            if value:
+                _add(text, AIFF_TEXT_CHUNKS[cid], [value])
+        f.seek(start + clen + (clen % 2))
+    for key, value in text.items():
+        tags.setdefault(key, value)
+    tags.update(id3)
+
+
+_READERS = {
+    ".mp3": _read_mp3,
+    ".flac": _read_flac,
+    ".wav": _read_wav,
+    ".aiff": _read_aiff,
+    ".aif": _read_aiff,
+}
+
+
+def read_fast_tags(path: str | os.PathLike) -> Optional[Dict[str, object]]:
+    """Return {"artist": [...], "title": [...], ..., "length": seconds} for
+    supported formats, or None when the caller should fall back to mutagen.
+    Missing fields are simply absent; "length" is a float when known, and
+    "sample_rate"/"bits"/"channels" are ints for FLAC/WAV/AIFF."""
+    if _READERS.get(os.path.splitext(str(path))[1].lower()) is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return read_fast_tags_from(f, str(path))
+    except OSError:
+        return None
+
+
+def read_fast_tags_from(f: BinaryIO, name: str) -> Optional[Dict[str, object]]:
+    """read_fast_tags() for an already open, seekable binary stream (e.g. a
+    ZIP member); `name` only selects the format by its extension."""
+    reader = _READERS.get(os.path.splitext(name)[1].lower())
+    if reader is None:
+        return None
+    tags: Dict[str, object] = {}
+    try:
+        reader(f, tags)
+    except (_Unsupported, OSError, EOFError, UnicodeDecodeError, struct.error, OverflowError, ValueError):
+        # Malformed headers: leave the file to the (guarded) mutagen path
+        return None
+    return tags
+
+
+def first_text(tags: Dict[str, object], *keys: str) -> Optional[str]:
+    """First non-empty value among the given keys, in order."""
+    for key in keys:
+        values = tags.get(key)
+        if isinstance(values, list):
+            for v in values:
+                if v:
+                    return v
+    return None
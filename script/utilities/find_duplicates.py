@@ -1,11 +1,19 @@
 import os
 import re
 import unicodedata
-from collections import defaultdict
 from mutagen import File
 import sys
 import shlex
 from pathlib import Path
+from typing import Iterator, Tuple
+
+from cli_flags import arg_value, arg_values
+from events import emit, setup_from_argv
+from fast_tags import read_fast_tags
+import io_tuning
+from plan_file import apply_from_argv, plan_from_argv
+from records import FileTable, group_rows
+from walk_cache import walk
 
 # Load .env file if available
 try:
@@ -49,6 +57,11 @@ def infer_from_filename(path: str):
     return artist, title
 
 def read_tags(path: str):
+    # Native reader skips artwork; fall back to mutagen when it can't give a length
+    fast = read_fast_tags(path)
+    if fast is not None and fast.get("length"):
+        tags = {k: norm(", ".join(fast.get(k, []))) for k in ("artist", "title", "album")}
+        return tags, int(fast["length"])
     try:
         audio = File(path, easy=True)
         if not audio:
@@ -64,9 +77,10 @@ def read_tags(path: str):
         print(f"[SKIP] {path} ({e})")
         return {}, None
 
-def make_key(path: str):
+def make_key(path: str, size: int | None = None):
     tags, length = read_tags(path)
-    size = os.path.getsize(path)
+    if size is None:
+        size = os.path.getsize(path)
 
     artist = tags.get("artist", "") if tags else ""
     title  = tags.get("title",  "") if tags else ""
@@ -86,15 +100,58 @@ def make_key(path: str):
     key = (artist, title, int(length) if length else None, size)
     return key
 
+def build_buckets(folder: str, full: bool = False, have=None, jobs: int | None = None):
+    """Scan folder into a compact FileTable and return {key: paths} for the
+    keys shared by more than one file. Per-file state stays in array columns;
+    only duplicate groups are materialised as path lists.
+    With a have_filter.FilterSet, files whose artist/title another machine
+    probably has are reported as they are scanned. Tags are read by `jobs`
+    threads (default: tuned for the folder's filesystem, see io_tuning).
+    Tags are read while the walk goes on, so "scanned" events follow the
+    walk directory by directory instead of waiting for it to finish."""
+    table = FileTable()
+    if jobs is None:
+        jobs = io_tuning.jobs_for(folder, "tags")
+
+    def walked() -> Iterator[Tuple[int, str, int]]:
+        # (row, path, size); workers never read the table while it grows
+        for dirpath, files in walk(folder, incremental=True, full=full):
+            for f in files:
+                if f.name.lower().endswith(EXTENSIONS):
+                    row = table.add_entry(dirpath, f.name, f)
+                    yield row, os.path.join(dirpath, f.name), f.st_size
+
+    def keyed_entry(entry: Tuple[int, str, int]):
+        row, path, size = entry
+        return row, path, size, make_key(path, size)
+
+    keyed = []
+    for row, path, size, key in io_tuning.imap(keyed_entry, walked(), jobs):
+        if not key:
+            emit("scanned", path=path, size=size)
+            continue
+        artist, title, length, _size = key
+        emit("scanned", path=path, size=size, artist=artist, title=title, duration=length)
+        if have is not None and have.has_track(artist, title):
+            print(f"HAVE: {path} ({artist or '∅-artist'}, {title})")
+            emit("group", kind="have", paths=[path], reason="tags")
+        table.set_names(row, artist, title)
+        table.set_duration(row, length)
+        keyed.append(row)
+
+    def row_key(row: int):
+        length = table.get_duration(row)
+        return (table.artist_id[row], table.title_id[row], -1 if length is None else int(length), table.size[row])
+
+    buckets = {}
+    for rows in group_rows(keyed, row_key):
+        length = table.get_duration(rows[0])
+        key = (table.artist(rows[0]), table.title(rows[0]), int(length) if length is not None else None, table.size[rows[0]])
+        buckets[key] = [table.path(r) for r in rows]
+    return buckets
+
 def find_duplicates(folder: str):
-    buckets = defaultdict(list)
-    for root, _, files in os.walk(folder):
-        for f in files:
-            if f.lower().endswith(EXTENSIONS):
-                path = os.path.join(root, f)
-                key = make_key(path)
-                if key:
-                    buckets[key].append(path)
+    buckets = build_buckets(folder)
 
     dup_count = 0
     for key, paths in buckets.items():
@@ -129,7 +186,7 @@ def report_and_optionally_emit_rm(buckets):
     if dup_count == 0:
         print("No duplicates found.")
 
-def report_and_emit_big_rm(buckets):
+def report_and_emit_big_rm(buckets, plan=None):
     dupes = []
     for key, paths in buckets.items():
         if len(paths) > 1:
@@ -140,7 +197,13 @@ def report_and_emit_big_rm(buckets):
             for p in paths:
                 print(f"   {p}")
             # keep the first file; mark the rest for deletion
+            emit("group", kind="tags", key=[artist, title, length, size], paths=paths, keep=paths[0])
+            for p in paths[1:]:
+                emit("op", op="rm", src=p, keep=paths[0], status="suggested")
             dupes.extend(paths[1:])
+            if plan is not None:
+                for p in paths[1:]:
+                    plan.add("rm", p, keep=paths[0])
 
     if dupes:
         quoted = " ".join(shlex.quote(p) for p in dupes)
@@ -148,8 +211,13 @@ def report_and_emit_big_rm(buckets):
         print(f"rm {quoted}\n")
     else:
         print("No duplicates found.")
+    emit("done", groups=len(buckets), suggested_rm=len(dupes))
+
+def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("find_duplicates")
+    apply_from_argv("find_duplicates")
 
-if __name__ == "__main__":
     # Get directory from command line or environment variable
     if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
         folder = sys.argv[1]
@@ -157,7 +225,7 @@ if __name__ == "__main__":
         folder = os.environ.get("MUSIC_LIBRARY_DIR")
         if not folder:
             print("Error: No directory specified.")
-            print("Usage: python3 find_duplicates.py <directory>")
+            print("Usage: python3 find_duplicates.py <directory> [--full] [--jobs N] [--have FILE]... [--plan-out FILE | --apply FILE] [--format text|ndjson]")
             print("Or set MUSIC_LIBRARY_DIR in your .env file")
             sys.exit(1)
 
@@ -166,12 +234,24 @@ if __name__ == "__main__":
         print(f"Error: Directory does not exist: {folder}")
         sys.exit(1)
 
-    buckets = defaultdict(list)
-    for root, _, files in os.walk(folder):
-        for f in files:
-            if f.lower().endswith(EXTENSIONS):
-                path = os.path.join(root, f)
-                key = make_key(path)
-                if key:
-                    buckets[key].append(path)
-    report_and_emit_big_rm(buckets)
+    plan, plan_out = plan_from_argv("find_duplicates", folder)
+    have = None
+    if arg_values("--have"):
+        from have_filter import FilterSet
+        try:
+            have = FilterSet(arg_values("--have"))
+        except (OSError, ValueError) as e:
+            print(f"Error: --have: {e}")
+            sys.exit(1)
+    try:
+        jobs = int(arg_value("--jobs")) if arg_value("--jobs") else None
+    except ValueError:
+        print("--jobs expects a number")
+        sys.exit(1)
+    buckets = build_buckets(folder, full="--full" in sys.argv, have=have, jobs=jobs)
+    report_and_emit_big_rm(buckets, plan)
+    if plan is not None:
+        plan.save(plan_out)
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,22 @@ import os
 import sys
 import hashlib
 import shlex
+import struct
 from collections import defaultdict
-from typing import Dict, List, Iterable, Tuple
+from typing import Callable, Dict, List, Iterable, Optional, Tuple, TypeVar
 from pathlib import Path
 
+from cache_store import cache_path
+from cli_flags import arg_value, arg_values
+from events import emit, setup_from_argv
+from io_throttle import drop_cache, throttle_read
+import io_throttle
+import io_tuning
+from plan_file import Plan, apply_from_argv, plan_from_argv
+from records import FileTable, group_rows, scan_tree
+from scan_budget import ResumeState, budget_from_argv, newest_first
+from walk_cache import in_quarantine
+
 # Load .env file if available
 try:
     from dotenv import load_dotenv
@@ -18,6 +30,36 @@ except ImportError:
 # Consider common audio extensions; set to None to scan all files
 EXTENSIONS = {".mp3", ".wav", ".aiff", ".aif", ".flac"}
 
+# Read size used when hashing in on-disk order; large sequential reads keep
+# rotational heads streaming instead of seeking between small requests
+DISK_ORDER_BUFSIZE = 8 * 1024 * 1024
+# With --time-budget, --disk-order sorts each run of this many newest-first
+# files, so the budget is still spent on the newest files
+DISK_ORDER_BATCH = 500
+
+# Hashed files between saves of the --time-budget resume state, so a killed
+# run keeps its work
+SAVE_EVERY = 200
+
+# Size groups up to this many files are compared byte-by-byte in lockstep
+# instead of hashed; larger groups (and runs that need the hashes) are hashed
+COMPARE_MAX_GROUP = 8
+# First lockstep block; doubles per round up to the read size, so files that
+# differ early cost one small read each
+COMPARE_FIRST_BLOCK = 64 * 1024
+
+# Linux FIEMAP ioctl (struct fiemap header + one struct fiemap_extent)
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HDR = struct.Struct("=QQIIII")
+_FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+
+
+T = TypeVar("T")
+
+
+def is_target_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in EXTENSIONS
+
 
 def is_target(path: str) -> bool:
     if not os.path.isfile(path):
@@ -34,7 +76,60 @@ def iter_files(root: str) -> Iterable[str]:
                 yield p
 
 
-def sha256_range(path: str, start: int = 0, end: int | None = None, bufsize: int = 1024 * 1024) -> str:
+def first_physical_offset(path: str) -> int | None:
+    # Physical byte offset of the file's first extent via FIEMAP; None when
+    # the platform or filesystem does not support it
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    buf = bytearray(_FIEMAP_HDR.size + _FIEMAP_EXTENT.size)
+    _FIEMAP_HDR.pack_into(buf, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    mapped = _FIEMAP_HDR.unpack_from(buf, 0)[3]
+    if not mapped:
+        return None
+    extent = _FIEMAP_EXTENT.unpack_from(buf, _FIEMAP_HDR.size)
+    physical, flags = extent[1], extent[5]
+    # FIEMAP_EXTENT_UNKNOWN (delalloc, network fs) or no real location
+    if flags & 0x2 or physical == 0:
+        return None
+    return physical
+
+
+def disk_order(items: Iterable[T], path_of: Callable[[T], str] = str) -> List[T]:
+    """Order items (paths, or anything `path_of` maps to a path) by where
+    they live on disk so a hashing pass reads them with minimal seeking.
+    Uses the first physical extent (FIEMAP) when available and falls back
+    to the inode number, which most filesystems allocate roughly in on-disk
+    order."""
+    keyed = []
+    for i, item in enumerate(items):
+        p = path_of(item)
+        try:
+            st = os.stat(p)
+        except OSError:
+            keyed.append((1, 0, 0, 0, i, item))
+            continue
+        phys = first_physical_offset(p)
+        if phys is not None:
+            keyed.append((0, st.st_dev, 0, phys, i, item))
+        else:
+            keyed.append((0, st.st_dev, 1, st.st_ino, i, item))
+    keyed.sort(key=lambda k: k[:5])
+    return [k[-1] for k in keyed]
+
+
+def sha256_range_digest(path: str, start: int = 0, end: int | None = None, bufsize: int = 1024 * 1024) -> bytes:
     h = hashlib.sha256()
     size = os.path.getsize(path)
     if end is None or end > size:
@@ -42,8 +137,13 @@ def sha256_range(path: str, start: int = 0, end: int | None = None, bufsize: int
     if start < 0:
         start = 0
     if start >= end:
-        return h.hexdigest()
+        return h.digest()
     with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(f.fileno(), start, end - start, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
         f.seek(start)
         remaining = end - start
         while remaining > 0:
@@ -51,9 +151,15 @@ def sha256_range(path: str, start: int = 0, end: int | None = None, bufsize: int
             chunk = f.read(to_read)
             if not chunk:
                 break
+            throttle_read(len(chunk))
             h.update(chunk)
             remaining -= len(chunk)
-    return h.hexdigest()
+        drop_cache(f.fileno(), start, end - start)
+    return h.digest()
+
+
+def sha256_range(path: str, start: int = 0, end: int | None = None, bufsize: int = 1024 * 1024) -> str:
+    return sha256_range_digest(path, start, end, bufsize).hex()
 
 
 def mp3_payload_range(path: str) -> Tuple[int, int | None]:
@@ -111,7 +217,7 @@ def aiff_ssnd_range(path: str) -> Tuple[int, int | None] | None:
         with open(path, "rb") as f:
             if f.read(4) != b"FORM":
                 return None
-            f.seek(8)  # size + 'AIFF'/'AIFC'
+            f.seek(12)  # skip size + 'AIFF'/'AIFC'
             # Loop chunks
             while True:
                 hdr = f.read(8)
@@ -154,30 +260,100 @@ def flac_payload_start(path: str) -> int | None:
         return None
 
 
-def content_hash(path: str, ignore_metadata: bool = True) -> str:
-    ext = os.path.splitext(path)[1].lower()
+def payload_range(path: str, ignore_metadata: bool = True) -> Tuple[int, int | None]:
+    # Byte range of the audio payload; (0, None) means the whole file
     if not ignore_metadata:
-        return sha256_range(path)
+        return 0, None
+    ext = os.path.splitext(path)[1].lower()
     try:
         if ext == ".mp3":
-            s, e = mp3_payload_range(path)
-            return sha256_range(path, s, e)
+            return mp3_payload_range(path)
         if ext == ".wav":
             rng = wav_data_range(path)
             if rng:
-                return sha256_range(path, rng[0], rng[1])
+                return rng
         if ext in {".aiff", ".aif"}:
             rng = aiff_ssnd_range(path)
             if rng:
-                return sha256_range(path, rng[0], rng[1])
+                return rng
         if ext == ".flac":
             start = flac_payload_start(path)
             if start is not None:
-                return sha256_range(path, start, None)
+                return start, None
     except Exception:
         pass
-    # Fallback: whole-file hash
-    return sha256_range(path)
+    # Fallback: whole file
+    return 0, None
+
+
+def content_digest(path: str, ignore_metadata: bool = True, bufsize: int = 1024 * 1024) -> bytes:
+    start, end = payload_range(path, ignore_metadata)
+    return sha256_range_digest(path, start, end, bufsize=bufsize)
+
+
+def content_hash(path: str, ignore_metadata: bool = True, bufsize: int = 1024 * 1024) -> str:
+    return content_digest(path, ignore_metadata, bufsize).hex()
+
+
+def lockstep_compare(
+    ranges: List[Tuple[str, int, int]], bufsize: int = 1024 * 1024
+) -> Tuple[List[List[int]], List[Tuple[int, OSError]]]:
+    """Compare files over (path, start, end) byte ranges by reading them all
+    block by block. A group splits as soon as its blocks differ and files
+    left on their own are closed and not read further.
+    Returns (groups of indices with identical ranges, [(index, error)])."""
+    groups: List[List[int]] = []
+    errors: List[Tuple[int, OSError]] = []
+    by_length: Dict[int, List[int]] = defaultdict(list)
+    for i, (_path, start, end) in enumerate(ranges):
+        by_length[end - start].append(i)
+
+    for length, members in by_length.items():
+        if len(members) < 2:
+            continue
+        files = {}
+        try:
+            for i in members:
+                path, start, _end = ranges[i]
+                try:
+                    f = open(path, "rb")
+                except OSError as e:
+                    errors.append((i, e))
+                    continue
+                files[i] = f
+                if hasattr(os, "posix_fadvise"):
+                    try:
+                        os.posix_fadvise(f.fileno(), start, length, os.POSIX_FADV_SEQUENTIAL)
+                    except OSError:
+                        pass
+                f.seek(start)
+            pending = [list(files)] if len(files) > 1 else []
+            offset, block = 0, COMPARE_FIRST_BLOCK
+            while pending and offset < length:
+                n = min(block, length - offset)
+                still: List[List[int]] = []
+                for group in pending:
+                    split: Dict[bytes, List[int]] = defaultdict(list)
+                    for i in group:
+                        try:
+                            data = files[i].read(n)
+                        except OSError as e:
+                            errors.append((i, e))
+                            continue
+                        throttle_read(len(data))
+                        split[data].append(i)
+                    for data, same in split.items():
+                        if len(same) > 1 and len(data) == n:
+                            still.append(same)
+                pending = still
+                offset += n
+                block = min(block * 2, bufsize)
+            groups.extend(pending)
+        finally:
+            for i, f in files.items():
+                drop_cache(f.fileno(), ranges[i][1], length)
+                f.close()
+    return groups, errors
 
 
 def has_numeric_suffix(name_without_ext: str) -> bool:
@@ -203,7 +379,113 @@ def base_len_after_normalize(path: str) -> int:
     return len(stem)
 
 
+def choose_keep(paths: List[str]) -> Tuple[str, List[str]]:
+    """Pick the copy to keep from a duplicate group; returns (keep, delete).
+    0) Never keep a copy parked in a flatten_all_songs quarantine over a live one
+    1) Prefer files WITHOUT trailing " (n)" before extension
+    2) Among those, keep the one with the longest base name length after collapsing duplicate extensions
+    3) Ties: keep lexicographically first; delete the rest"""
+    scored = []  # (quarantined, suffix_flag, -norm_len, base, path)
+    for p in paths:
+        base = os.path.basename(p)
+        stem, _ext = os.path.splitext(base)
+        suffix_flag = 1 if has_numeric_suffix(stem) else 0  # 1 means worse
+        scored.append((in_quarantine(p), suffix_flag, -base_len_after_normalize(p), base.lower(), p))
+    scored.sort()  # best first
+    return scored[0][-1], [t[-1] for t in scored[1:]]
+
+
+def report_have(table: FileTable, have) -> None:
+    """List files another machine probably has, per have_filter files.
+    Uses payload hashes computed by the exact scan and each file's
+    artist/title key; nothing is hashed just for this check."""
+    from find_duplicates import make_key
+
+    found = 0
+    for row in table.rows():
+        p = table.path(row)
+        d = table.digest(row)
+        reason = "content" if d is not None and have.has_digest(d) else None
+        if reason is None:
+            key = make_key(p, table.size[row])
+            if key and have.has_track(key[0], key[1]):
+                reason = "tags"
+        if reason is None:
+            continue
+        if not found:
+            print("\nProbably already in a --have library:")
+        found += 1
+        print(f"  - {p} (same {'audio' if reason == 'content' else 'artist/title'})")
+        emit("group", kind="have", paths=[p], reason=reason)
+    if not found:
+        print("\nNo files found in the --have filters.")
+
+
+def report_partial(
+    table: FileTable, root: str, strict: bool, min_percent: float, new_only: bool, plan: Optional[Plan] = None
+) -> None:
+    """Chunk new/changed payloads into the persistent index, then report
+    truncated copies and heavily overlapping files."""
+    from chunk_index import ChunkIndex, iter_chunks
+
+    index = ChunkIndex(cache_path("chunks", root, ".sqlite"))
+    seen = set()
+    changed = set()
+    try:
+        for row in table.rows():
+            p = table.path(row)
+            seen.add(p)
+            if index.is_current(p, table.size[row], table.mtime_ns[row]):
+                continue
+            try:
+                start, end = payload_range(p, ignore_metadata=not strict)
+                index.update(p, table.size[row], table.mtime_ns[row], list(iter_chunks(p, start, end)))
+            except OSError as e:
+                print(f"[SKIP] {p} ({e})")
+                emit("error", path=p, message=str(e))
+                continue
+            changed.add(p)
+            emit("scanned", path=p, size=table.size[row])
+        index.prune(seen)
+        matches = index.partial_matches(min_percent, only_paths=changed if new_only else None)
+    finally:
+        index.close()
+
+    print(f"Chunk index: {len(seen)} files ({len(changed)} new or changed)")
+    if not matches:
+        print("No partial duplicates found.")
+        return
+
+    print("\nPartial duplicates (content-defined chunk overlap):")
+    truncated: List[str] = []
+    for m in matches:
+        if m.kind == "prefix":
+            print(f"\nTRUNCATED ({m.percent:.1f}% of the other copy): {m.path}")
+            print(f"  prefix of: {m.other}")
+            emit("group", kind="truncated", paths=[m.path, m.other], keep=m.other, percent=round(m.percent, 1))
+            if m.path not in truncated:
+                emit("op", op="rm", src=m.path, keep=m.other, status="suggested")
+            if m.path not in truncated and plan is not None:
+                plan.add("rm", m.path, keep=m.other)
+            truncated.append(m.path)
+        else:
+            print(f"\nOVERLAP ({m.percent:.1f}% shared): {m.path}")
+            print(f"  overlaps: {m.other}")
+            emit("group", kind="overlap", paths=[m.path, m.other], percent=round(m.percent, 1))
+
+    if truncated:
+        print("\nOne big rm command (truncated copies):")
+        print("rm " + " ".join(shlex.quote(p) for p in sorted(set(truncated))))
+    emit("done", indexed=len(seen), changed=len(changed), truncated=len(set(truncated)),
+         overlaps=sum(1 for m in matches if m.kind == "overlap"))
+
+
 def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("find_exact_duplicates")
+    io_throttle.setup_from_argv()
+    apply_from_argv("find_exact_duplicates")
+
     # Get directory from command line or environment variable
     if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
         root = sys.argv[1]
@@ -211,84 +493,236 @@ def main():
         root = os.environ.get("MUSIC_LIBRARY_DIR")
         if not root:
             print("Error: No directory specified.")
-            print("Usage: python3 find_exact_duplicates.py <directory> [--strict]")
+            print("Usage: python3 find_exact_duplicates.py <directory> [--strict] [--disk-order] [--jobs N] [--full] [--partial [--min-overlap PCT] [--new-only]] [--time-budget DURATION] [--have FILE]... [--plan-out FILE | --apply FILE] [--format text|ndjson]")
             print("Or set MUSIC_LIBRARY_DIR in your .env file")
             sys.exit(1)
 
     root = os.path.expanduser(root)
     strict = "--strict" in sys.argv  # when set, hash entire files (include metadata)
+    # when set, read candidates in physical on-disk order (helps rotational drives)
+    by_disk_order = "--disk-order" in sys.argv
+    # when set, re-list every directory instead of trusting the walk snapshot
+    full = "--full" in sys.argv
+    # when set, look for truncated/partially shared payloads via chunk hashes
+    partial = "--partial" in sys.argv
+    # when set, hash newest files first, stop after the budget and resume next run
+    budget = budget_from_argv()
+    # parallel readers; default: tuned for the filesystem behind root (io_tuning)
+    try:
+        jobs = int(arg_value("--jobs")) if arg_value("--jobs") else None
+    except ValueError:
+        print("--jobs expects a number")
+        sys.exit(1)
+    # when set, write the deletions/renames with source fingerprints to FILE
+    plan, plan_out = plan_from_argv("find_exact_duplicates", root)
+    # filter files from have_filter.py: also list files other machines have
+    have = None
+    if arg_values("--have"):
+        from have_filter import FilterSet
+        try:
+            have = FilterSet(arg_values("--have"))
+        except (OSError, ValueError) as e:
+            print(f"Error: --have: {e}")
+            sys.exit(1)
 
     if not os.path.isdir(root):
         print(f"Root does not exist or is not a directory: {root}")
         sys.exit(1)
 
-    files = list(iter_files(root))
-    if not files:
+    table = scan_tree(root, is_target_name, incremental=True, full=full)
+    if not len(table):
         print("No files to examine.")
         return
 
-    # First pass: group by size to avoid hashing unique sizes
-    by_size: Dict[int, List[str]] = defaultdict(list)
-    for p in files:
+    if partial:
         try:
-            sz = os.path.getsize(p)
-        except OSError:
-            continue
-        by_size[sz].append(p)
+            min_percent = float(arg_value("--min-overlap", "80"))
+        except ValueError:
+            print("--min-overlap expects a percentage")
+            sys.exit(1)
+        try:
+            report_partial(table, root, strict, min_percent, new_only="--new-only" in sys.argv, plan=plan)
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if plan is not None:
+            plan.save(plan_out)
+        return
 
-    # Second pass: hash only groups with more than one file
-    dup_groups: List[Tuple[str, List[str]]] = []  # (hash, paths)
-    for sz, group in sorted(by_size.items()):
-        if len(group) < 2:
+    # First pass: group rows by size to avoid hashing unique sizes
+    candidates = list(group_rows(table.rows(), table.size.__getitem__))
+
+    # Small groups are compared byte-by-byte, which stops at the first
+    # differing block; large groups are hashed, as is everything when the
+    # hashes are kept (time-budget resume state) or needed (--have)
+    hash_all = bool(budget.seconds) or have is not None
+    compare = [g for g in candidates if not hash_all and len(g) <= COMPARE_MAX_GROUP]
+    hashed_groups = [g for g in candidates if hash_all or len(g) > COMPARE_MAX_GROUP]
+
+    # Second pass: hash the remaining groups. Reads may be scheduled in
+    # on-disk order; grouping below still follows size order.
+    to_hash = [row for group in hashed_groups for row in group]
+    resume = None
+    if budget.seconds:
+        # Newest first: that is where new duplicates appear
+        to_hash = newest_first(to_hash, table.mtime_ns.__getitem__)
+        resume = ResumeState("find_exact_duplicates", root, key="strict" if strict else "payload")
+        if resume.resumed:
+            print(f"Resuming an unfinished pass ({len(resume.results)} file(s) already hashed, "
+                  f"last: {resume.cursor[1] if resume.cursor else '?'})")
+    bufsize = 1024 * 1024
+    if by_disk_order:
+        if budget.seconds:
+            to_hash = [row for i in range(0, len(to_hash), DISK_ORDER_BATCH)
+                       for row in disk_order(to_hash[i:i + DISK_ORDER_BATCH], table.path)]
+        else:
+            to_hash = disk_order(to_hash, table.path)
+        compare = disk_order(compare, lambda g: table.path(g[0]))
+        bufsize = DISK_ORDER_BUFSIZE
+        # One reader keeps the physical order; parallel reads would seek again
+        jobs = jobs or 1
+    if jobs is None:
+        # A plan-only run does not probe an untuned mount; the report run does
+        jobs = io_tuning.jobs_for(root, "hash", [table.path(r) for r in to_hash or [g[0] for g in compare]],
+                                  probe_new=plan is None)
+    # Each group is reported (ndjson "group" event) as soon as all of its
+    # members are hashed or compared, while the rest is still being read
+    dup_groups: List[Tuple[str, List[str]]] = []  # (hash or "size-N-i" for compared groups, paths)
+    to_rm: List[str] = []
+    kept_by: Dict[str, str] = {}  # deleted path -> the copy kept in its place
+    mv_fixes: List[Tuple[str, str]] = []  # (src, dst) for duplicate-extension cleanup on kept files
+
+    def found(key: str, paths: List[str]) -> None:
+        paths = sorted(paths)
+        keep, delete = choose_keep(paths)
+        dup_groups.append((key, paths))
+        to_rm.extend(delete)
+        emit("group", kind="exact", key=key, paths=paths, keep=keep)
+        for p in delete:
+            emit("op", op="rm", src=p, keep=keep, status="suggested")
+            kept_by[p] = keep
+        # If kept file has duplicate extensions, suggest an mv fix to collapse to single extension
+        base_keep = os.path.basename(keep)
+        collapsed = collapse_duplicate_exts(base_keep)
+        if collapsed != base_keep:
+            mv_fixes.append((keep, os.path.join(os.path.dirname(keep), collapsed)))
+            emit("op", op="rename", src=keep, dst=mv_fixes[-1][1], status="suggested")
+
+    def resolve_hashed(group: List[int]) -> None:
+        by_hash: Dict[bytes, List[int]] = defaultdict(list)
+        for row in group:
+            d = table.digest(row)
+            if d is not None:
+                by_hash[d].append(row)
+        for d, rows in by_hash.items():
+            if len(rows) > 1:
+                found(d.hex(), [table.path(r) for r in rows])
+
+    # Rows still to hash per size group; a group resolves when it reaches 0
+    group_of: Dict[int, int] = {row: gi for gi, group in enumerate(hashed_groups) for row in group}
+    pending = [len(group) for group in hashed_groups]
+
+    def hashed(row: int) -> None:
+        gi = group_of[row]
+        pending[gi] -= 1
+        if not pending[gi]:
+            resolve_hashed(hashed_groups[gi])
+
+    work: List[int] = []
+    for row in to_hash:
+        cached = resume.get(table.path(row), table.size[row], table.mtime_ns[row]) if resume is not None else None
+        if cached:
+            table.set_digest(row, bytes.fromhex(cached))
+            emit("scanned", path=table.path(row), size=table.size[row], hash=cached)
+            hashed(row)
+        else:
+            work.append(row)
+
+    started = 0
+
+    def until_budget() -> Iterable[int]:
+        nonlocal started
+        for row in work:
+            if budget.expired():
+                return
+            started += 1
+            yield row
+
+    def digest_row(row: int) -> Tuple[int, Optional[bytes], Optional[OSError]]:
+        try:
+            return row, content_digest(table.path(row), ignore_metadata=not strict, bufsize=bufsize), None
+        except OSError as e:
+            return row, None, e
+
+    n_hashed = 0
+    for row, digest, err in io_tuning.imap(digest_row, until_budget(), jobs):
+        path = table.path(row)
+        size, mtime_ns = table.size[row], table.mtime_ns[row]
+        if err is not None:
+            print(f"[SKIP] {path} ({err})")
+            emit("error", path=path, message=str(err))
+            hashed(row)
             continue
-        by_hash: Dict[str, List[str]] = defaultdict(list)
-        for p in group:
+        if resume is not None:
+            resume.put(path, size, mtime_ns, digest.hex())
+            n_hashed += 1
+            if n_hashed % SAVE_EVERY == 0:
+                resume.save(complete=False)
+        table.set_digest(row, digest)
+        emit("scanned", path=path, size=size, hash=digest.hex())
+        hashed(row)
+    deferred = len(work) - started
+    # Groups cut short by the time budget cover the files hashed so far
+    for gi, group in enumerate(hashed_groups):
+        if pending[gi]:
+            resolve_hashed(group)
+
+    def compare_group(group: List[int]) -> Tuple[List[List[int]], List[Tuple[int, OSError]]]:
+        ranges = []
+        for row in group:
+            path = table.path(row)
             try:
-                h = content_hash(p, ignore_metadata=not strict)
-            except OSError as e:
-                print(f"[SKIP] {p} ({e})")
-                continue
-            by_hash[h].append(p)
-        for h, paths in by_hash.items():
-            if len(paths) > 1:
-                dup_groups.append((h, sorted(paths)))
+                start, end = payload_range(path, ignore_metadata=not strict)
+            except OSError:
+                start, end = 0, None
+            ranges.append((path, start, table.size[row] if end is None else min(end, table.size[row])))
+        same, errors = lockstep_compare(ranges, bufsize)
+        return [[group[i] for i in g] for g in same], [(group[i], e) for i, e in errors]
+
+    # Rows whose compared ranges matched to the last byte
+    identical = 0
+    for same, errors in io_tuning.imap(compare_group, compare, jobs):
+        for row, err in errors:
+            print(f"[SKIP] {table.path(row)} ({err})")
+            emit("error", path=table.path(row), message=str(err))
+        for rows in same:
+            found(f"size-{table.size[rows[0]]}-{identical}", [table.path(r) for r in rows])
+            identical += 1
+    compared = sum(len(g) for g in compare)
+    if resume is not None:
+        resume.save(complete=not deferred, keep=(table.path(r) for r in to_hash))
+        if deferred:
+            print(f"Time budget reached: {deferred} file(s) left to hash; run again to continue. "
+                  "Groups below cover the files hashed so far.\n")
+
+    if have is not None:
+        report_have(table, have)
+        print()
 
     if not dup_groups:
         print("No exact duplicates found.")
+        emit("done", files=len(table), hashed=len(to_hash) - deferred, compared=compared, deferred=deferred or None,
+             groups=0, suggested_rm=0)
         return
 
-    print("Exact duplicate groups (content-identical by SHA-256):")
-    to_rm: List[str] = []
-    mv_fixes: List[Tuple[str, str]] = []  # (src, dst) for duplicate-extension cleanup on kept files
+    print("Exact duplicate groups (content-identical by SHA-256 or byte comparison):")
     for h, paths in dup_groups:
-        print(f"\nHash: {h}")
+        if h.startswith("size-"):
+            print(f"\nByte-identical ({h.split('-')[1]} bytes each)")
+        else:
+            print(f"\nHash: {h}")
         for p in paths:
             print(f"  - {p}")
-        # Decide which to keep per rules:
-        # 1) Prefer files WITHOUT trailing " (n)" before extension
-        # 2) Among those, keep the one with the longest base name length after collapsing duplicate extensions
-        # 3) Ties: keep lexicographically first; delete the rest
-
-        # Build scoring
-        scored = []  # (suffix_flag, -norm_len, path)
-        import re
-        for p in paths:
-            base = os.path.basename(p)
-            stem, ext = os.path.splitext(base)
-            suffix_flag = 1 if has_numeric_suffix(stem) else 0  # 1 means worse
-            norm_len = base_len_after_normalize(p)
-            scored.append((suffix_flag, -norm_len, base.lower(), p))
-
-        scored.sort()  # best first
-        keep = scored[0][3]
-        delete = [t[3] for t in scored[1:]]
-        to_rm.extend(delete)
-
-        # If kept file has duplicate extensions, suggest an mv fix to collapse to single extension
-        base_keep = os.path.basename(keep)
-        collapsed = collapse_duplicate_exts(base_keep)
-        if collapsed != base_keep:
-            mv_fixes.append((keep, os.path.join(os.path.dirname(keep), collapsed)))
 
     if to_rm:
         print("\nOne big rm command:")
@@ -300,6 +734,16 @@ def main():
         for src, dst in mv_fixes:
             print(f"mv {shlex.quote(src)} {shlex.quote(dst)}")
 
+    emit("done", files=len(table), hashed=len(to_hash) - deferred, compared=compared, deferred=deferred or None,
+         groups=len(dup_groups), suggested_rm=len(to_rm))
+    if plan is not None:
+        # Deletions first: each one checks its kept copy, which the renames move
+        for p in to_rm:
+            plan.add("rm", p, keep=kept_by[p])
+        for src, dst in mv_fixes:
+            plan.add("rename", src, dst)
+        plan.save(plan_out)
+
 
 if __name__ == "__main__":
     main()
@@ -2,9 +2,18 @@
 import os
 import sys
 import shutil
-from typing import Iterable, Tuple
+from typing import Callable, Dict, Iterable, Optional, Tuple
 from pathlib import Path
 
+from cli_flags import arg_value
+from dir_fds import DirFds
+from dir_locks import claim_unique, lock_dir, release, rename_unique
+from events import emit, setup_from_argv
+from find_exact_duplicates import content_digest
+from io_throttle import move_file
+from plan_file import Plan, apply_from_argv, plan_from_argv
+from walk_cache import QUARANTINE_DIR, walk
+
 # Load .env file if available
 try:
     from dotenv import load_dotenv
@@ -20,49 +29,252 @@ EXTENSIONS = {".mp3", ".aiff", ".aif", ".wav", ".m4a"}
 # Junk files that prevent directories from being empty on macOS/Windows
 JUNK_FILES = {".DS_Store", "Thumbs.db"}
 
+# What to do with a file whose name collides at the root with identical audio
+DUPLICATE_MODES = ("quarantine", "drop", "suffix")
+
 
 def is_target_file(name: str) -> bool:
     return os.path.splitext(name)[1].lower() in EXTENSIONS
 
 
-def iter_files(root: str) -> Iterable[str]:
-    for dirpath, _dirnames, filenames in os.walk(root):
-        for fname in filenames:
-            if is_target_file(fname):
-                yield os.path.join(dirpath, fname)
+def iter_files(root: str, full: bool = False, exclude: Optional[str] = None) -> Iterable[str]:
+    # Unchanged directories are served from the walk snapshot unless full
+    for dirpath, files in walk(root, incremental=True, full=full):
+        if exclude and (os.path.abspath(dirpath) + os.sep).startswith(exclude + os.sep):
+            continue
+        for f in files:
+            if is_target_file(f.name):
+                path = os.path.join(dirpath, f.name)
+                emit("scanned", path=path, size=f.st_size)
+                yield path
+
+
+def default_quarantine(root: str) -> str:
+    """`<root>.flatten-duplicates` next to root: outside the library, so
+    other scanners and syncs never see the parked copies."""
+    root = os.path.normpath(os.path.abspath(root))
+    return os.path.join(os.path.dirname(root), os.path.basename(root) + QUARANTINE_DIR)
 
 
-def ensure_unique_name(root: str, filename: str) -> str:
+def quarantine_problem(path: str, create: bool = False) -> Optional[str]:
+    """Why the quarantine folder cannot be used, or None if it can. Next to
+    a mount root (/Volumes/Music) its parent is usually read-only. Creates
+    the folder only when `create`; otherwise checks its nearest ancestor."""
+    if create:
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            return str(e)
+    probe = path
+    while not os.path.lexists(probe) and os.path.dirname(probe) != probe:
+        probe = os.path.dirname(probe)
+    if not os.path.isdir(probe):
+        return f"{probe} is not a folder"
+    if not os.access(probe, os.W_OK | os.X_OK):
+        return f"{probe} is not writable"
+    return None
+
+
+def ensure_unique_name(root: str, filename: str, taken: Dict[str, str] | None = None, fs: DirFds | None = None) -> str:
+    # `taken` holds destinations already claimed by this run (dry runs/plans)
+    exists = fs.exists if fs is not None else os.path.exists
     base, ext = os.path.splitext(filename)
     candidate = filename
     n = 1
-    while os.path.exists(os.path.join(root, candidate)):
+    while exists(os.path.join(root, candidate)) or (taken and os.path.join(root, candidate) in taken):
         candidate = f"{base} ({n}){ext}"
         n += 1
     return candidate
 
 
-def move_to_root(root: str, path: str, dry_run: bool = False) -> Tuple[str, str]:
+class CollisionCheck:
+    """Decides whether a file colliding with a name at the root is the same
+    audio as the file holding that name: sizes first, then payload hashes
+    (whole files with strict), each file hashed at most once per run."""
+
+    def __init__(
+        self, mode: str, quarantine: str, strict: bool = False, digest: Callable[[str], bytes] | None = None
+    ) -> None:
+        # `digest` replaces content_digest, e.g. to share hashes with other passes
+        self.mode = mode
+        self.quarantine = quarantine
+        self.strict = strict
+        self.digest = digest
+        self.digests: Dict[str, bytes] = {}
+        self.quarantined: set = set()
+        self.duplicates = 0
+
+    def _digest(self, path: str) -> bytes:
+        if path not in self.digests:
+            if self.digest is not None:
+                self.digests[path] = self.digest(path)
+            else:
+                self.digests[path] = content_digest(path, ignore_metadata=not self.strict)
+        return self.digests[path]
+
+    def same(self, a: str, b: str) -> bool:
+        try:
+            if os.path.getsize(a) != os.path.getsize(b):
+                return False
+            return self._digest(a) == self._digest(b)
+        except OSError:
+            return False
+
+    def identical(
+        self, root: str, src: str, taken: Dict[str, str] | None, fs: DirFds | None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """(name at root, file holding it now) of a copy identical to src, or
+        (None, None). Walks the collision chain `name`, `name (1)`, ... like
+        ensure_unique_name; a name claimed earlier in this run but not moved
+        yet (dry runs, plans) is held by its source."""
+        exists = fs.exists if fs is not None else os.path.exists
+        base, ext = os.path.splitext(os.path.basename(src))
+        candidate, n = base + ext, 1
+        while True:
+            dest = os.path.join(root, candidate)
+            if exists(dest):
+                holder = dest
+            elif taken and dest in taken:
+                holder = taken[dest]
+            else:
+                return None, None
+            if self.same(src, holder):
+                return dest, holder
+            candidate = f"{base} ({n}){ext}"
+            n += 1
+
+    def quarantine_path(self, src: str) -> str:
+        """Free path for src in the quarantine folder, reserved for this run."""
+        base, ext = os.path.splitext(os.path.basename(src))
+        name, n = base + ext, 1
+        while os.path.exists(os.path.join(self.quarantine, name)) or os.path.join(self.quarantine, name) in self.quarantined:
+            name = f"{base} ({n}){ext}"
+            n += 1
+        dest = os.path.join(self.quarantine, name)
+        self.quarantined.add(dest)
+        return dest
+
+
+def drop_duplicate(
+    src: str,
+    keep: str,
+    holder: str,
+    check: CollisionCheck,
+    dry_run: bool = False,
+    plan: Plan | None = None,
+    fs: DirFds | None = None,
+) -> Tuple[str, str]:
+    """Delete (mode "drop") or quarantine src, an exact copy of `keep`.
+    Returns (src, dest) with dest the quarantine path or the kept copy."""
+    check.duplicates += 1
+    if check.mode == "drop":
+        if plan is not None:
+            plan.add("rm", src, keep=keep, keep_from=holder)
+            print(f"PLAN: rm {src} (same audio as {keep})")
+        elif dry_run:
+            print(f"DRY: rm {src} (same audio as {keep})")
+            emit("op", op="rm", src=src, keep=keep, status="dry_run")
+        else:
+            if fs is not None:
+                fs.unlink(src)
+            else:
+                os.remove(src)
+            print(f"rm {src} (same audio as {keep})")
+            emit("op", op="rm", src=src, keep=keep, status="applied")
+        return src, keep
+
+    dest = check.quarantine_path(src)
+    if plan is not None:
+        plan.add("move", src, dest)
+        print(f"PLAN: move {src} -> {dest} (same audio as {keep})")
+    elif dry_run:
+        print(f"DRY: move {src} -> {dest} (same audio as {keep})")
+        emit("op", op="move", src=src, dst=dest, keep=keep, status="dry_run")
+    else:
+        os.makedirs(check.quarantine, exist_ok=True)
+        # Atomic claim: a concurrent run quarantining the same name gets the next one
+        check.quarantined.discard(dest)
+        dest = claim_unique(os.path.join(check.quarantine, os.path.basename(src)), check.quarantined)
+        check.quarantined.add(dest)
+        try:
+            move_file(src, dest)
+        except BaseException:
+            release(dest)
+            raise
+        print(f"move {src} -> {dest} (same audio as {keep})")
+        emit("op", op="move", src=src, dst=dest, keep=keep, status="applied")
+    return src, dest
+
+
+def move_to_root(
+    root: str,
+    path: str,
+    dry_run: bool = False,
+    plan: Plan | None = None,
+    taken: Dict[str, str] | None = None,
+    fs: DirFds | None = None,
+    check: CollisionCheck | None = None,
+) -> Tuple[str, str]:
     """Move a file to the root directory, resolving collisions by suffixing.
+    With a plan, the move is recorded instead of performed. With `fs`, the
+    existence checks and the rename run relative to open directory fds.
+    `taken` maps destinations claimed by this run to their sources. With a
+    CollisionCheck (mode other than "suffix"), a file whose name collides
+    with the same audio is dropped or quarantined instead of suffixed.
     Returns (src, dest)."""
     src = os.path.abspath(path)
-    dest_name = ensure_unique_name(root, os.path.basename(src))
+    dest_name = ensure_unique_name(root, os.path.basename(src), taken, fs)
+    if check is not None and check.mode != "suffix" and dest_name != os.path.basename(src):
+        keep, holder = check.identical(root, src, taken, fs)
+        if keep is not None:
+            try:
+                return drop_duplicate(src, keep, holder, check, dry_run, plan, fs)
+            except OSError as e:
+                # Keep going: the file is suffixed like any other collision
+                check.duplicates -= 1
+                print(f"Warning: could not {'remove' if check.mode == 'drop' else 'quarantine'} {src} ({e}); suffixing instead", file=sys.stderr)
+                emit("error", path=src, message=str(e))
     dest = os.path.join(root, dest_name)
+    if taken is not None:
+        taken[dest] = src
 
     # If already at root with the final name, skip
     if os.path.abspath(os.path.dirname(src)) == os.path.abspath(root) and os.path.basename(src) == dest_name:
         return src, dest
 
+    if plan is not None:
+        plan.add("rename", src, dest)
+        print(f"PLAN: move {src} -> {dest}")
+        return src, dest
+
     if dry_run:
         print(f"DRY: move {src} -> {dest}")
+        emit("op", op="rename", src=src, dst=dest, status="dry_run")
         return src, dest
 
-    os.replace(src, dest)
+    # Re-checked under the root's lock: a concurrent run may have taken the name
+    if taken is not None:
+        taken.pop(dest, None)
+    with lock_dir(root):
+        dest = rename_unique(src, root, os.path.basename(src), lambda d, n: ensure_unique_name(d, n, taken, fs), fs)
+    if taken is not None:
+        taken[dest] = src
     print(f"move {src} -> {dest}")
+    emit("op", op="rename", src=src, dst=dest, status="applied")
     return src, dest
 
 
-def cleanup_empty_dirs(root: str, dry_run: bool = False) -> None:
+def cleanup_empty_dirs(root: str, dry_run: bool = False, fs: DirFds | None = None) -> None:
+    own = fs is None
+    fs = DirFds() if own else fs
+    try:
+        _cleanup_empty_dirs(root, dry_run, fs)
+    finally:
+        if own:
+            fs.close()
+
+
+def _cleanup_empty_dirs(root: str, dry_run: bool, fs: DirFds) -> None:
     # Walk bottom-up so children are removed before parents
     for dirpath, dirnames, filenames in os.walk(root, topdown=False):
         if os.path.abspath(dirpath) == os.path.abspath(root):
@@ -76,32 +288,41 @@ def cleanup_empty_dirs(root: str, dry_run: bool = False) -> None:
                 junk_path = os.path.join(dirpath, j)
                 if dry_run:
                     print(f"DRY: rm {junk_path}")
+                    emit("op", op="rm", src=junk_path, status="dry_run")
                 else:
                     try:
-                        os.remove(junk_path)
+                        fs.unlink(junk_path)
                         print(f"rm {junk_path}")
+                        emit("op", op="rm", src=junk_path, status="applied")
                     except FileNotFoundError:
                         pass
 
         # After junk removal, decide if the directory is empty
         try:
-            after = os.listdir(dirpath)
+            after = fs.listdir(dirpath)
         except FileNotFoundError:
             continue
 
         if not after:
             if dry_run:
                 print(f"DRY: rmdir {dirpath}")
+                emit("op", op="rmdir", src=dirpath, status="dry_run")
             else:
                 try:
-                    os.rmdir(dirpath)
+                    fs.rmdir(dirpath)
                     print(f"rmdir {dirpath}")
+                    emit("op", op="rmdir", src=dirpath, status="applied")
                 except OSError:
                     # Directory not empty or cannot remove; skip
                     pass
 
 
 def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("flatten_all_songs")
+    # --apply FILE executes a saved plan without rescanning
+    apply_from_argv("flatten_all_songs", junk=JUNK_FILES)
+
     # Get directory from command line or environment variable
     if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
         root = sys.argv[1]
@@ -109,33 +330,63 @@ def main():
         root = os.environ.get("MUSIC_LIBRARY_DIR")
         if not root:
             print("Error: No directory specified.")
-            print("Usage: python3 flatten_all_songs.py <directory> [--dry-run|-n]")
+            print("Usage: python3 flatten_all_songs.py <directory> [--dry-run|-n] [--full] [--on-duplicate quarantine|drop|suffix] [--quarantine DIR] [--strict] [--plan-out FILE | --apply FILE] [--format text|ndjson]")
             print("Or set MUSIC_LIBRARY_DIR in your .env file")
             sys.exit(1)
 
     # Expand ~ in paths
     root = os.path.expanduser(root)
     dry_run = "--dry-run" in sys.argv or "-n" in sys.argv
+    full = "--full" in sys.argv
+    plan, plan_out = plan_from_argv("flatten_all_songs", root)
+    # Name collisions with identical audio (same size, then same payload hash;
+    # whole file with --strict) are quarantined or dropped instead of suffixed
+    on_duplicate = arg_value("--on-duplicate", "quarantine")
+    if on_duplicate not in DUPLICATE_MODES:
+        print(f"--on-duplicate expects one of: {', '.join(DUPLICATE_MODES)}")
+        sys.exit(1)
+    quarantine = os.path.abspath(os.path.expanduser(arg_value("--quarantine") or default_quarantine(root)))
+    check = CollisionCheck(on_duplicate, quarantine, strict="--strict" in sys.argv)
 
     if not os.path.isdir(root):
         print(f"Root does not exist or is not a directory: {root}")
         sys.exit(1)
 
+    if on_duplicate == "quarantine":
+        # Checked before anything moves rather than failing on the first duplicate
+        problem = quarantine_problem(quarantine, create=plan is None and not dry_run)
+        if problem:
+            print(f"Warning: quarantine folder unusable ({problem}); using --on-duplicate suffix", file=sys.stderr)
+            emit("error", path=quarantine, message=problem)
+            check.mode = on_duplicate = "suffix"
+
     # Collect all target files first to avoid walking issues while moving
-    files = list(iter_files(root))
+    files = list(iter_files(root, full=full, exclude=quarantine))
 
     moved = 0
-    for src in files:
-        # Skip files already at root
-        if os.path.abspath(os.path.dirname(src)) == os.path.abspath(root):
-            continue
-        move_to_root(root, src, dry_run=dry_run)
-        moved += 1
+    taken: Dict[str, str] = {}
+    with DirFds() as fs:
+        for src in files:
+            # Skip files already at root
+            if os.path.abspath(os.path.dirname(src)) == os.path.abspath(root):
+                continue
+            move_to_root(root, src, dry_run=dry_run, plan=plan, taken=taken, fs=fs, check=check)
+            moved += 1
+        moved -= check.duplicates
 
-    cleanup_empty_dirs(root, dry_run=dry_run)
+        if plan is not None:
+            # Subfolders only become empty once the moves are applied
+            plan.add("prune", root)
+        else:
+            cleanup_empty_dirs(root, dry_run=dry_run, fs=fs)
 
-    print(f"\nDone. Files considered: {len(files)} | Moved: {moved}")
-    if dry_run:
+    duplicates = f" | Duplicates {'dropped' if on_duplicate == 'drop' else 'quarantined'}: {check.duplicates}"
+    print(f"\nDone. Files considered: {len(files)} | Moved: {moved}{duplicates if check.duplicates else ''}")
+    emit("done", considered=len(files), moved=moved, duplicates=check.duplicates or None)
+    if plan is not None:
+        plan.save(plan_out)
+        print("(plan only: no changes made)")
+    elif dry_run:
         print("(dry run: no changes made)")
 
 
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Compact "already have it" Bloom filters to share between machines.
+
+build  Record a library's payload hashes and normalized artist+title keys
+       (find_duplicates.norm, via make_key) in a Bloom filter file of a few
+       bytes per track. Sources are a directory (hashed through the
+       persistent library index, so re-builds only hash new files) and/or
+       library_manifest files.
+
+organize_audio, find_duplicates and find_exact_duplicates load any number of
+these files with `--have FILE` and check the cheap artist+title key before
+hashing anything; organize_audio hashes a file only after that key hits, to
+confirm the audio too before acting on it. A Bloom filter never misses a track it was built from but
+answers "maybe" for about `--fp-rate` of the tracks it was not, so hits are
+reported as probable, not certain.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from cache_store import atomic_write_bytes, cache_path
+from cli_flags import arg_value, arg_values
+import io_throttle
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+MAGIC = b"DRHAVE01"
+_HEADER = struct.Struct("<8sQII")  # magic, bits, hashes, items
+DEFAULT_FP_RATE = 0.001
+
+USAGE = (
+    "Usage: python3 have_filter.py build [<directory>] --out FILE [--manifest FILE]... [--fp-rate P] [--full]"
+)
+
+
+def digest_key(digest: bytes) -> bytes:
+    return b"h" + digest
+
+
+def track_key(artist: str, title: str) -> bytes:
+    # artist/title as returned by find_duplicates.make_key (already norm()'d)
+    return b"t" + artist.encode("utf-8", "surrogateescape") + b"\0" + title.encode("utf-8", "surrogateescape")
+
+
+def _positions(key: bytes, bits: int, hashes: int) -> Iterable[int]:
+    # Double hashing: k positions from two 64-bit halves of one BLAKE2b digest
+    h = hashlib.blake2b(key, digest_size=16).digest()
+    h1 = int.from_bytes(h[:8], "little")
+    h2 = int.from_bytes(h[8:], "little") | 1
+    return ((h1 + i * h2) % bits for i in range(hashes))
+
+
+class HaveFilter:
+    """One Bloom filter over digest and track keys."""
+
+    def __init__(self, bits: int, hashes: int, data: Optional[bytearray] = None, items: int = 0) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self.items = items
+        self.data = data if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_items(cls, n: int, fp_rate: float = DEFAULT_FP_RATE) -> "HaveFilter":
+        n = max(1, n)
+        bits = max(64, math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        hashes = max(1, round(bits / n * math.log(2)))
+        return cls(bits, hashes)
+
+    def add(self, key: bytes) -> None:
+        data = self.data
+        for pos in _positions(key, self.bits, self.hashes):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.items += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        data = self.data
+        return all(data[pos >> 3] >> (pos & 7) & 1 for pos in _positions(key, self.bits, self.hashes))
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(MAGIC, self.bits, self.hashes, self.items) + bytes(self.data)
+
+    @classmethod
+    def load(cls, path: str) -> "HaveFilter":
+        with open(path, "rb") as f:
+            raw = f.read()
+        if len(raw) < _HEADER.size:
+            raise ValueError(f"not a have-filter file: {path}")
+        magic, bits, hashes, items = _HEADER.unpack_from(raw)
+        if magic != MAGIC or len(raw) - _HEADER.size != (bits + 7) // 8 or not hashes:
+            raise ValueError(f"not a have-filter file: {path}")
+        return cls(bits, hashes, bytearray(raw[_HEADER.size:]), items)
+
+
+class FilterSet:
+    """Several filters (one per machine); a key is present if any has it."""
+
+    def __init__(self, paths: List[str]) -> None:
+        self.paths = paths
+        self.filters = [HaveFilter.load(os.path.expanduser(p)) for p in paths]
+
+    def has_track(self, artist: str, title: str) -> bool:
+        if not title:
+            return False
+        key = track_key(artist, title)
+        return any(key in f for f in self.filters)
+
+    def has_digest(self, digest: bytes) -> bool:
+        key = digest_key(digest)
+        return any(key in f for f in self.filters)
+
+    def check(self, path: str, size: Optional[int] = None) -> Tuple[Optional[str], Optional[bytes]]:
+        """("content" | "tags" | None, payload digest if it was computed).
+        The artist+title key is tried first and the file is only hashed
+        when it hits: "content" means the payload hash is in a filter too;
+        "tags" means only the key is, which is weaker evidence (a different
+        mix or a false positive) and is for reporting, not acting on."""
+        from find_duplicates import make_key
+        from find_exact_duplicates import content_digest
+
+        key = make_key(path, size)
+        if not (key and self.has_track(key[0], key[1])):
+            return None, None
+        digest = content_digest(path)
+        return ("content" if self.has_digest(digest) else "tags"), digest
+
+
+def library_keys(root: str, full: bool = False) -> List[Tuple[bytes, str, str]]:
+    """(digest, artist, title) for every file under root, via the library index."""
+    from library_index import LibraryIndex
+
+    index = LibraryIndex(cache_path("library", root, ".sqlite"))
+    try:
+        added, removed = index.refresh(root, full=full)
+        print(f"Library index: {added} new or changed, {removed} removed")
+        return [(bytes(d), a, t) for d, a, t in index.db.execute("SELECT digest, artist, title FROM files")]
+    finally:
+        index.close()
+
+
+def manifest_keys(path: str) -> List[Tuple[bytes, str, str]]:
+    from library_manifest import read_manifest
+
+    header, rows = read_manifest(path)
+    if header.get("strict"):
+        # Whole-file hashes never match the payload hashes the filter is checked with
+        raise ValueError(f"{path} was scanned with --strict; rescan it without --strict to build a filter from it")
+    return [(bytes.fromhex(r[3]), r[5], r[6]) for r in rows]
+
+
+def build(sources: List[Tuple[bytes, str, str]], fp_rate: float) -> HaveFilter:
+    digests = {d for d, _a, _t in sources}
+    tracks = {(a, t) for _d, a, t in sources if t}
+    flt = HaveFilter.for_items(len(digests) + len(tracks), fp_rate)
+    for d in digests:
+        flt.add(digest_key(d))
+    for a, t in tracks:
+        flt.add(track_key(a, t))
+    return flt
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != "build":
+        print(USAGE)
+        sys.exit(1)
+    io_throttle.setup_from_argv()
+    out = arg_value("--out")
+    manifests = arg_values("--manifest")
+    valued = {"--out", "--manifest", "--fp-rate", "--max-read-rate", "--max-write-rate"}
+    positional = [a for i, a in enumerate(args[1:], 1) if not a.startswith("-") and args[i - 1] not in valued]
+    root = positional[0] if positional else (None if manifests else os.environ.get("MUSIC_LIBRARY_DIR"))
+    if not out or (not root and not manifests):
+        print("Error: build needs --out FILE and a directory (or MUSIC_LIBRARY_DIR) and/or --manifest FILE")
+        print(USAGE)
+        sys.exit(1)
+    try:
+        fp_rate = float(arg_value("--fp-rate", str(DEFAULT_FP_RATE)))
+        if not 0 < fp_rate < 1:
+            raise ValueError
+    except ValueError:
+        print("--fp-rate expects a probability between 0 and 1")
+        sys.exit(1)
+
+    sources: List[Tuple[bytes, str, str]] = []
+    try:
+        if root:
+            root = os.path.abspath(os.path.expanduser(root))
+            if not os.path.isdir(root):
+                print(f"Root does not exist or is not a directory: {root}")
+                sys.exit(1)
+            sources.extend(library_keys(root, full="--full" in sys.argv))
+        for m in manifests:
+            sources.extend(manifest_keys(os.path.expanduser(m)))
+    except (OSError, ValueError, EOFError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    flt = build(sources, fp_rate)
+    out = os.path.expanduser(out)
+    atomic_write_bytes(out, flt.to_bytes())
+    print(f"Filter written: {out} | Files: {len(sources)} | Keys: {flt.items} | "
+          f"{len(flt.data) / 1024:.1f} KiB | {flt.hashes} hashes, ~{fp_rate:g} false positives")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Bandwidth limits and background priority for maintenance scans.
+
+Hashing a library or copying a big batch on the disk Rekordbox is streaming
+from competes with playback. Every utility that reads or writes audio in
+bulk accepts:
+
+- `--max-read-rate RATE` / `--max-write-rate RATE`: token-bucket limits
+  applied inside the hashing and copy loops, shared by all worker threads.
+  RATE is bytes per second with an optional K/M/G suffix (1024-based),
+  e.g. `20M`.
+- `--background`: idle I/O priority (Linux ioprio class 3, like `ionice -c3`;
+  throttled I/O policy on macOS), a higher CPU nice value, and
+  posix_fadvise(DONTNEED) on data once it has been consumed, so a scan does
+  not evict the DJ's working set from the page cache.
+
+Call setup_from_argv() (or configure()) once at startup, before any worker
+threads exist, so they inherit the I/O priority.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from cli_flags import arg_value
+
+COPY_BUFSIZE = 1024 * 1024
+BACKGROUND_NICE = 10
+
+# ioprio_set(2) syscall numbers; glibc has no wrapper
+_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "arm64": 30, "i386": 289, "i686": 289, "armv7l": 314}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+# macOS setiopolicy_np(IOPOL_TYPE_DISK, IOPOL_SCOPE_PROCESS, IOPOL_THROTTLE)
+_IOPOL_TYPE_DISK, _IOPOL_SCOPE_PROCESS, _IOPOL_THROTTLE = 0, 0, 3
+
+_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+class TokenBucket:
+    """Thread-safe byte budget refilled at `rate` bytes per second.
+
+    consume() may overdraw the bucket (one read can be larger than the
+    burst); the caller then sleeps until the debt is paid, so the average
+    rate holds however the reads are sized or spread across threads."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate / 4, 64 * 1024)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_read: Optional[TokenBucket] = None
+_write: Optional[TokenBucket] = None
+_background = False
+
+
+def parse_rate(text: str) -> int:
+    """'20M' -> 20971520 bytes per second."""
+    s = text.strip().upper()
+    for tail in ("/S", "B", "I"):
+        if s.endswith(tail):
+            s = s[: -len(tail)]
+    unit = s[-1:] if s[-1:] in _SUFFIXES else ""
+    value = float(s[: len(s) - len(unit)] if unit else s)
+    if value <= 0:
+        raise ValueError(text)
+    return int(value * _SUFFIXES[unit])
+
+
+def _set_idle_io_priority() -> bool:
+    if sys.platform.startswith("linux"):
+        nr = _IOPRIO_SET.get(platform.machine())
+        if nr is None:
+            return False
+        libc = ctypes.CDLL(None, use_errno=True)
+        prio = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+        return libc.syscall(nr, _IOPRIO_WHO_PROCESS, 0, prio) == 0
+    if sys.platform == "darwin":
+        lib = ctypes.util.find_library("c")
+        if not lib:
+            return False
+        libc = ctypes.CDLL(lib, use_errno=True)
+        return libc.setiopolicy_np(_IOPOL_TYPE_DISK, _IOPOL_SCOPE_PROCESS, _IOPOL_THROTTLE) == 0
+    return False
+
+
+def configure(max_read: Optional[int] = None, max_write: Optional[int] = None, background: bool = False) -> None:
+    global _read, _write, _background
+    _read = TokenBucket(max_read) if max_read else None
+    _write = TokenBucket(max_write) if max_write else None
+    _background = background
+    if background:
+        try:
+            os.nice(BACKGROUND_NICE)
+        except (AttributeError, OSError):
+            pass
+        try:
+            if not _set_idle_io_priority():
+                print("Note: --background could not set idle I/O priority on this system")
+        except (AttributeError, OSError):
+            print("Note: --background could not set idle I/O priority on this system")
+
+
+def setup_from_argv(argv: Optional[List[str]] = None) -> None:
+    """Handle --max-read-rate, --max-write-rate and --background."""
+    args = sys.argv if argv is None else argv
+    rates = []
+    for flag in ("--max-read-rate", "--max-write-rate"):
+        value = arg_value(flag, None, args)
+        try:
+            rates.append(parse_rate(value) if value else None)
+        except ValueError:
+            print(f"{flag} expects a rate in bytes per second, e.g. 500K, 20M or 1G")
+            sys.exit(2)
+    configure(rates[0], rates[1], "--background" in args)
+
+
+def throttle_read(n: int) -> None:
+    if _read is not None:
+        _read.consume(n)
+
+
+def throttle_write(n: int) -> None:
+    if _write is not None:
+        _write.consume(n)
+
+
+def drop_cache(fd: int, offset: int = 0, length: int = 0) -> None:
+    """In --background mode, tell the kernel these pages will not be reused."""
+    if _background and hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def active() -> bool:
+    return _read is not None or _write is not None or _background
+
+
+def copy_contents(src: str, dst: str) -> None:
+    """shutil.copyfile with the read/write limits and cache dropping applied."""
+    if not active():
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while True:
+            chunk = fin.read(COPY_BUFSIZE)
+            if not chunk:
+                break
+            throttle_read(len(chunk))
+            throttle_write(len(chunk))
+            fout.write(chunk)
+        drop_cache(fin.fileno())
+        if _background:
+            # Dirty pages cannot be dropped; write them out first
+            fout.flush()
+            os.fsync(fout.fileno())
+            drop_cache(fout.fileno())
+
+
+def copy_file(src: str, dst: str) -> str:
+    """shutil.copy2 through copy_contents; plain copy2 (and its fast kernel
+    paths) when no limits are configured."""
+    if not active():
+        return shutil.copy2(src, dst)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    copy_contents(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def move_file(src: str, dst: str) -> str:
+    """shutil.move; cross-device moves copy through copy_file."""
+    return shutil.move(src, dst, copy_function=copy_file)
@@ -0,0 +1,351 @@
+"""
+Per-filesystem I/O concurrency for the hashing, copying and tag-reading stages.
+
+The best number of parallel readers depends on what is behind a root: an
+NVMe SSD wants many requests in flight, a USB hard disk wants one or two
+(more just adds seeks), and SMB/NFS hides its latency only with many
+outstanding reads. Instead of one `--jobs` default that is wrong for most
+machines:
+
+- describe() identifies the mount behind a path: filesystem type from
+  statfs(2) (magic number on Linux, type name on macOS) or
+  /proc/self/mountinfo, and for local block devices whether
+  /sys/block/<dev>/queue/rotational says it spins
+- the first real (not dry-run or plan-only) hashing or copy run on a mount
+  runs a short probe (PROBE_SECONDS per level) that reads uncached 1 MiB
+  blocks of the files about to be processed at several concurrency levels
+  and keeps the smallest level within PROBE_MARGIN of the best throughput;
+  callers opt in with `probe=True`
+- the result is stored per mount in the cache directory and reused by every
+  later run; `--retune-io` probes again (e.g. after moving the library to
+  another disk)
+
+An explicit `--jobs N` always wins. Probing is skipped while
+`--max-read-rate` or `--background` is active (the numbers would measure the
+limit, not the device); such runs use the stored value or the kind default.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, TypeVar
+
+import io_throttle
+from cache_store import cache_dir, load_json, save_json
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+TUNING_VERSION = 1
+PROBE_BLOCK = 1024 * 1024
+PROBE_SECONDS = 0.4
+PROBE_MARGIN = 0.9  # smallest level reaching this share of the best rate wins
+PROBE_FILES = 64
+MIN_PROBE_BYTES = 16 * PROBE_BLOCK  # less data than this makes no measurement
+MAX_PROBE_REGIONS = 4096
+
+# Starting points when a mount has not been probed
+DEFAULT_JOBS = {"ssd": 8, "hdd": 1, "network": 8, "memory": 8, "unknown": 4}
+PROBE_LEVELS = {
+    "ssd": (1, 2, 4, 8, 16),
+    "hdd": (1, 2, 4),
+    "network": (1, 2, 4, 8, 16),
+    "memory": (),
+    "unknown": (1, 2, 4, 8),
+}
+MAX_JOBS = 32
+
+# statfs f_type values (linux/magic.h)
+FS_MAGIC = {
+    0xEF53: "ext",
+    0x58465342: "xfs",
+    0x9123683E: "btrfs",
+    0x2FC12FC1: "zfs",
+    0x01021994: "tmpfs",
+    0x794C7630: "overlay",
+    0x6969: "nfs",
+    0x517B: "smb",
+    0xFF534D42: "cifs",
+    0xFE534D42: "smb2",
+    0x65735546: "fuse",
+    0x4D44: "vfat",
+    0x2011BAB0: "exfat",
+    0x5346544E: "ntfs",
+    0x7366746E: "ntfs3",
+    0x482B: "hfsplus",
+    0xF15F: "ecryptfs",
+}
+NETWORK_FS = {"nfs", "nfs4", "smb", "smb3", "cifs", "smb2", "smbfs", "afpfs", "webdav", "9p",
+              "fuse.sshfs", "fuse.rclone", "ceph", "glusterfs"}
+MEMORY_FS = {"tmpfs", "ramfs"}
+
+_RETUNE_FLAG = "--retune-io"
+_lock = threading.Lock()
+_memo: Dict[str, int] = {}  # mount key -> jobs, for repeated lookups in one run
+
+
+class Mount(NamedTuple):
+    mountpoint: str
+    source: str
+    fstype: str
+    rotational: Optional[bool]
+    kind: str  # ssd, hdd, network, memory or unknown
+
+    @property
+    def key(self) -> str:
+        return f"{self.mountpoint}|{self.source}|{self.fstype}"
+
+
+def _statfs_type(path: str) -> Optional[str]:
+    """Filesystem type name straight from statfs(2), or None."""
+    lib = ctypes.util.find_library("c")
+    if not lib:
+        return None
+    libc = ctypes.CDLL(lib, use_errno=True)
+    buf = ctypes.create_string_buffer(512)
+    if sys.platform.startswith("linux"):
+        if libc.statfs(os.fsencode(path), buf) != 0:
+            return None
+        magic = ctypes.c_ulong.from_buffer(buf).value & 0xFFFFFFFF
+        return FS_MAGIC.get(magic)
+    if sys.platform == "darwin":
+        try:
+            fn = libc["statfs$INODE64"]
+        except AttributeError:
+            fn = libc.statfs
+        if fn(os.fsencode(path), buf) != 0:
+            return None
+        # struct statfs (64-bit inodes): f_fstypename[16] at offset 72
+        return buf.raw[72:88].split(b"\0", 1)[0].decode("ascii", "replace") or None
+    return None
+
+
+def _unescape(field: str) -> str:
+    return field.replace("\\040", " ").replace("\\011", "\t").replace("\\012", "\n").replace("\\134", "\\")
+
+
+def _mountinfo(path: str) -> tuple:
+    """(mountpoint, source, fstype) of the longest mount containing path."""
+    best = ("/", "", "")
+    try:
+        with open("/proc/self/mountinfo", "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                left, _, right = line.partition(" - ")
+                fields, tail = left.split(), right.split()
+                if len(fields) < 5 or len(tail) < 2:
+                    continue
+                mnt = _unescape(fields[4])
+                inside = path == mnt or path.startswith(mnt.rstrip("/") + "/")
+                if inside and len(mnt) >= len(best[0]):
+                    best = (mnt, _unescape(tail[1]), tail[0])
+    except OSError:
+        pass
+    return best
+
+
+def _rotational(path: str) -> Optional[bool]:
+    """queue/rotational of the block device holding path (None if unknown)."""
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    if os.major(dev) == 0:
+        return None  # anonymous device: network, tmpfs, fuse
+    sys_dev = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    for d in (sys_dev, os.path.dirname(sys_dev)):  # a partition's queue lives on its disk
+        try:
+            with open(os.path.join(d, "queue", "rotational"), "r") as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def describe(path: str) -> Mount:
+    path = os.path.realpath(path)
+    mountpoint, source, fstype = _mountinfo(path)
+    try:
+        magic_type = _statfs_type(path)
+    except (AttributeError, OSError):
+        magic_type = None
+    if magic_type and magic_type != "fuse":
+        fstype = magic_type  # mountinfo's type is kept only to name the FUSE driver
+    fstype = fstype or magic_type or ""
+    rotational = _rotational(path)
+    if fstype in NETWORK_FS or fstype.startswith(("nfs", "fuse.sshfs")):
+        kind = "network"
+    elif fstype in MEMORY_FS:
+        kind = "memory"
+    elif rotational is None:
+        kind = "unknown"
+    else:
+        kind = "hdd" if rotational else "ssd"
+    if sys.platform == "darwin" and mountpoint == "/":
+        mountpoint = _darwin_mountpoint(path)
+    return Mount(mountpoint, source, fstype or "unknown", rotational, kind)
+
+
+def _darwin_mountpoint(path: str) -> str:
+    # No mountinfo: the mount point is where st_dev changes
+    try:
+        dev = os.stat(path).st_dev
+        while path != "/" and os.stat(os.path.dirname(path)).st_dev == dev:
+            path = os.path.dirname(path)
+    except OSError:
+        return "/"
+    return path
+
+
+def _regions(paths: Sequence[str]) -> List[tuple]:
+    """Distinct (path, offset) blocks, round-robin over a sample of files."""
+    files = []
+    for p in random.Random(0).sample(list(paths), min(len(paths), PROBE_FILES)):
+        try:
+            size = os.path.getsize(p)
+        except OSError:
+            continue
+        if size >= PROBE_BLOCK:
+            files.append((p, size))
+    out: List[tuple] = []
+    off = 0
+    while files and len(out) < MAX_PROBE_REGIONS:
+        files = [(p, size) for p, size in files if off + PROBE_BLOCK <= size]
+        out.extend((p, off) for p, _size in files)
+        off += 4 * PROBE_BLOCK  # skip ahead: defeats readahead
+    return out[:MAX_PROBE_REGIONS]
+
+
+def _probe_level(level: int, regions: Iterator[tuple]) -> Optional[float]:
+    """Bytes per second with `level` concurrent readers, or None when too
+    little was read for a meaningful number."""
+    take = threading.Lock()
+    total = [0]
+    deadline = time.monotonic() + PROBE_SECONDS
+
+    def reader() -> None:
+        while time.monotonic() < deadline:
+            with take:
+                region = next(regions, None)
+            if region is None:
+                return
+            path, off = region
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, off, PROBE_BLOCK, os.POSIX_FADV_DONTNEED)
+                n = len(os.pread(fd, PROBE_BLOCK, off))
+            except OSError:
+                n = 0
+            finally:
+                os.close(fd)
+            with take:
+                total[0] += n
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(level)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    if total[0] < MIN_PROBE_BYTES or elapsed <= 0:
+        return None
+    return total[0] / elapsed
+
+
+def probe(mount: Mount, sample: Sequence[str]) -> Optional[dict]:
+    """Measure read throughput at the kind's levels; None if nothing usable.
+    Each level reads its own share of the sample's blocks, so no level is
+    served from pages an earlier one pulled into the cache."""
+    levels = PROBE_LEVELS.get(mount.kind, ())
+    regions = _regions(sample)
+    if not levels or len(regions) * PROBE_BLOCK < len(levels) * MIN_PROBE_BYTES:
+        return None
+    rates: Dict[int, float] = {}
+    for i, level in enumerate(levels):
+        rate = _probe_level(level, iter(regions[i::len(levels)]))
+        if rate is None:
+            break
+        rates[level] = rate
+    if not rates:
+        return None
+    best = max(rates.values())
+    jobs = min(level for level, rate in rates.items() if rate >= PROBE_MARGIN * best)
+    return {"jobs": jobs, "rates": {str(k): round(v) for k, v in rates.items()}}
+
+
+def _state_path() -> str:
+    return os.path.join(cache_dir(), "io-tuning.json")
+
+
+def _stage_jobs(jobs: int, mount: Mount, stage: str) -> int:
+    # Tag reads are a few small requests per file: latency-bound, so SSDs
+    # and network mounts benefit from twice the streaming concurrency
+    if stage == "tags" and mount.kind in ("ssd", "network", "unknown"):
+        jobs *= 2
+    return max(1, min(MAX_JOBS, jobs))
+
+
+def jobs_for(root: str, stage: str = "hash", sample: Sequence[str] = (), retune: Optional[bool] = None,
+             probe_new: bool = False) -> int:
+    """Worker count for `stage` ("hash", "copy" or "tags") on root's mount.
+
+    Uses the stored value for the mount; probes with `sample` (paths of
+    files on that mount) when `--retune-io` was passed, or when there is no
+    stored value yet and `probe_new` is set (callers set it only for runs
+    that really hash or copy); falls back to DEFAULT_JOBS for the mount's
+    kind."""
+    if retune is None:
+        retune = _RETUNE_FLAG in sys.argv
+    mount = describe(root)
+    with _lock:
+        jobs = _memo.get(mount.key)
+        if jobs is None:
+            state = load_json(_state_path(), None)
+            if not isinstance(state, dict) or state.get("version") != TUNING_VERSION:
+                state = {"version": TUNING_VERSION, "mounts": {}}
+            entry = state["mounts"].get(mount.key)
+            wanted = retune or (entry is None and probe_new)
+            if wanted and sample and not io_throttle.active() and PROBE_LEVELS.get(mount.kind):
+                # stderr: stdout may be an ndjson stream or a report being piped
+                print(f"I/O tuning: probing {mount.mountpoint} ({mount.fstype}, {mount.kind}) ...", file=sys.stderr)
+                result = probe(mount, sample)
+                if result is not None:
+                    rates = ", ".join(f"{k}: {v / (1 << 20):.0f} MiB/s" for k, v in result["rates"].items())
+                    print(f"I/O tuning: {result['jobs']} concurrent reader(s) ({rates})", file=sys.stderr)
+                    entry = dict(result, fstype=mount.fstype, kind=mount.kind,
+                                 probed=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+                    state["mounts"][mount.key] = entry
+                    save_json(_state_path(), state)
+            jobs = entry["jobs"] if entry else DEFAULT_JOBS.get(mount.kind, DEFAULT_JOBS["unknown"])
+            _memo[mount.key] = jobs
+    return _stage_jobs(jobs, mount, stage)
+
+
+def imap(fn: Callable[[T], R], items: Iterable[T], jobs: int) -> Iterator[R]:
+    """fn over items with `jobs` threads, results in input order. Items are
+    pulled lazily (at most 2 * jobs in flight), so a generator feeding it can
+    stop early, e.g. when a time budget runs out."""
+    if jobs <= 1:
+        yield from map(fn, items)
+        return
+    pending: deque = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
@@ -0,0 +1,388 @@
+"""
+Importable, generator-based API over the utilities, for tools that chain
+several steps in one process instead of running the scripts and parsing
+their output.
+
+    sys.path.insert(0, "script/utilities")
+    import library_api as lib
+
+    cache = lib.LibraryCache()
+    for group in lib.exact_duplicate_groups(lib.scan(root, cache), cache):
+        print(group.keep, group.delete)
+    ops = list(lib.plan_normalize(lib.scan(root, cache), cache))  # no second walk or tag read
+
+Every function yields NamedTuple records as it goes, so a consumer can stop
+early. A LibraryCache passed to several calls keeps what they learned: the
+files of each scanned root, and the tags and payload hashes of single files
+(reused while size and mtime are unchanged). With a library_index.LibraryIndex
+attached, stored hashes are reused as well and organize() checks incoming
+files against it.
+
+The plan_* functions change nothing on disk; to_plan() turns their output
+into a plan_file.Plan, which plan_file.apply_plan() (or a script's --apply
+after Plan.save) executes with the usual fingerprint checks. organize() acts
+like organize_audio and prints the same progress lines.
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import io_tuning
+from fast_tags import read_fast_tags
+from find_exact_duplicates import COMPARE_MAX_GROUP, choose_keep, content_digest, lockstep_compare, payload_range
+from flatten_all_songs import DUPLICATE_MODES, EXTENSIONS as FLATTEN_EXTS, CollisionCheck, default_quarantine
+from flatten_all_songs import ensure_unique_name as unique_root_name
+from organize_audio import SUPPORTED_EXTS, Organized, iter_organize
+from plan_file import Plan
+from walk_cache import walk
+from zip_input import DEFAULT_MEMORY, is_zip, workers_for
+
+try:
+    from mutagen import File as MFile  # type: ignore
+except Exception:  # noqa: BLE001 - mutagen may not be installed
+    MFile = None  # type: ignore
+
+
+class FileRecord(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+class Metadata(NamedTuple):
+    path: str
+    artist: str  # "" when unknown; multiple values joined with ", "
+    title: str
+    album: str
+    genre: str
+    length: Optional[float]  # seconds
+
+
+class DuplicateGroup(NamedTuple):
+    key: str  # payload hash (hex), or "size-N-i" for a byte-compared group
+    size: int
+    paths: List[str]
+    keep: str  # find_exact_duplicates.choose_keep()
+    delete: List[str]
+
+
+class PlannedOp(NamedTuple):
+    op: str  # plan_file operation: rename, move, rm or prune
+    src: str
+    dst: Optional[str] = None
+    keep: Optional[str] = None  # rm: the identical copy that stays
+    keep_from: Optional[str] = None  # where `keep` is now, when an earlier op moves it there
+
+
+# Files are passed as paths or as FileRecords from scan()
+Source = Union[str, "os.PathLike[str]", FileRecord]
+
+
+def _path(item: Source) -> str:
+    return item.path if isinstance(item, FileRecord) else os.fspath(item)
+
+
+def _record(item: Source) -> FileRecord:
+    if isinstance(item, FileRecord):
+        return item
+    path = os.fspath(item)
+    st = os.stat(path)
+    return FileRecord(path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class LibraryCache:
+    """State shared by the functions of one pipeline. Tags and hashes are
+    keyed by path and trusted while size and mtime match; scans are kept
+    until invalidate(), e.g. after applying a plan that moved files."""
+
+    def __init__(self, index: Any = None) -> None:
+        self.index = index  # library_index.LibraryIndex, optional
+        # SQLite connections belong to the thread that opened them; worker
+        # threads only see what load_digests() copied from the index
+        self._index_thread = threading.get_ident()
+        self.scans: Dict[str, List[FileRecord]] = {}
+        self.metadata: Dict[str, Tuple[int, int, Metadata]] = {}
+        self.digests: Dict[Tuple[str, bool], Tuple[int, int, bytes]] = {}
+
+    def invalidate(self, root: Optional[str] = None) -> None:
+        """Forget the scan of root (of every root when None)."""
+        if root is None:
+            self.scans.clear()
+        else:
+            self.scans.pop(os.path.abspath(os.path.expanduser(root)), None)
+
+    def get_metadata(self, rec: FileRecord) -> Optional[Metadata]:
+        hit = self.metadata.get(rec.path)
+        return hit[2] if hit is not None and hit[:2] == (rec.size, rec.mtime_ns) else None
+
+    def load_digests(self, recs: Iterable[FileRecord]) -> None:
+        """Copy the payload hashes the index holds for recs into the cache.
+        Call on the thread that opened the index, before handing recs to
+        worker threads."""
+        if self.index is None or threading.get_ident() != self._index_thread:
+            return
+        for rec in recs:
+            hit = self.digests.get((rec.path, False))
+            if hit is not None and hit[:2] == (rec.size, rec.mtime_ns):
+                continue
+            stored = self.index.get(os.path.abspath(rec.path))
+            if stored is not None and stored[:2] == (rec.size, rec.mtime_ns) and stored[2].digest:
+                self.digests[(rec.path, False)] = (rec.size, rec.mtime_ns, stored[2].digest)
+
+    def digest(self, rec: FileRecord, strict: bool = False) -> bytes:
+        """Payload hash (whole file with strict) of rec, computed at most once."""
+        if not strict:
+            self.load_digests([rec])  # no-op off the index's thread
+        hit = self.digests.get((rec.path, strict))
+        if hit is not None and hit[:2] == (rec.size, rec.mtime_ns):
+            return hit[2]
+        digest = content_digest(rec.path, ignore_metadata=not strict)
+        self.digests[(rec.path, strict)] = (rec.size, rec.mtime_ns, digest)
+        return digest
+
+
+def scan(
+    root: str,
+    cache: Optional[LibraryCache] = None,
+    extensions: Optional[Iterable[str]] = SUPPORTED_EXTS,
+    full: bool = False,
+) -> Iterator[FileRecord]:
+    """Files under root with one of `extensions` (lowercase, with dot; None
+    for every file), from the incremental walk (see walk_cache). With a
+    cache, a completed walk is kept and later scans of root replay it."""
+    root = os.path.abspath(os.path.expanduser(root))
+    exts = {e.lower() for e in extensions} if extensions is not None else None
+
+    def wanted(name: str) -> bool:
+        return exts is None or os.path.splitext(name)[1].lower() in exts
+
+    if cache is not None and not full and root in cache.scans:
+        for rec in cache.scans[root]:
+            if wanted(rec.path):
+                yield rec
+        return
+    seen: List[FileRecord] = []
+    for dirpath, files in walk(root, incremental=True, full=full):
+        for f in files:
+            rec = FileRecord(os.path.join(dirpath, f.name), f.st_size, f.st_mtime_ns, f.st_ino)
+            if cache is not None:
+                seen.append(rec)
+            if wanted(f.name):
+                yield rec
+    if cache is not None:
+        cache.scans[root] = seen
+
+
+def _from_fast(path: str, fast: Dict[str, Any]) -> Metadata:
+    text = [", ".join(fast.get(k, [])).strip() for k in ("artist", "title", "album", "genre")]
+    return Metadata(path, *text, fast.get("length"))
+
+
+def _read_metadata(path: str) -> Metadata:
+    # Native reader first (artwork is never loaded); mutagen when it gives
+    # up or cannot tell the length
+    fast = read_fast_tags(path)
+    if fast is not None and (fast.get("length") or MFile is None):
+        return _from_fast(path, fast)
+    try:
+        audio = MFile(path, easy=True) if MFile is not None else None
+    except Exception:  # noqa: BLE001 - mutagen raises its own error types
+        audio = None
+    if not audio:
+        return _from_fast(path, fast) if fast is not None else Metadata(path, "", "", "", "", None)
+    text = [", ".join(str(v) for v in audio.get(k) or []).strip() for k in ("artist", "title", "album", "genre")]
+    return Metadata(path, *text, getattr(getattr(audio, "info", None), "length", None))
+
+
+def _metadata(item: Source, cache: Optional[LibraryCache]) -> Metadata:
+    try:
+        rec = _record(item)
+    except OSError:
+        return Metadata(_path(item), "", "", "", "", None)
+    if cache is not None:
+        hit = cache.get_metadata(rec)
+        if hit is not None:
+            return hit
+    meta = _read_metadata(rec.path)
+    if cache is not None:
+        cache.metadata[rec.path] = (rec.size, rec.mtime_ns, meta)
+    return meta
+
+
+def read_metadata(paths: Iterable[Source], cache: Optional[LibraryCache] = None, jobs: Optional[int] = None) -> Iterator[Metadata]:
+    """One Metadata per input, in input order; unreadable files get empty
+    fields. Tags are read by `jobs` threads (default: tuned for the first
+    file's filesystem, see io_tuning), pulling inputs lazily."""
+    items = iter(paths)
+    first = next(items, None)
+    if first is None:
+        return
+    if jobs is None:
+        jobs = io_tuning.jobs_for(os.path.dirname(os.path.abspath(_path(first))), "tags")
+    yield from io_tuning.imap(lambda item: _metadata(item, cache), itertools.chain([first], items), jobs)
+
+
+def exact_duplicate_groups(
+    files: Iterable[Source],
+    cache: Optional[LibraryCache] = None,
+    strict: bool = False,
+    jobs: Optional[int] = None,
+) -> Iterator[DuplicateGroup]:
+    """Groups of files with identical audio payloads (whole files with
+    strict), in ascending size order. Files are grouped by size first; like
+    find_exact_duplicates, small groups are compared byte by byte and large
+    ones hashed. With a cache everything is hashed, so the hashes can be
+    reused. Files that cannot be read are left out."""
+    by_size: Dict[int, List[FileRecord]] = defaultdict(list)
+    seen = set()
+    for item in files:
+        try:
+            rec = _record(item)
+        except OSError:
+            continue
+        if rec.path not in seen:
+            seen.add(rec.path)
+            by_size[rec.size].append(rec)
+    candidates = [by_size[size] for size in sorted(by_size) if len(by_size[size]) > 1]
+    if not candidates:
+        return
+    if cache is not None and not strict:
+        cache.load_digests(rec for group in candidates for rec in group)
+    if jobs is None:
+        # Library calls never probe (see io_tuning): that is a CLI decision
+        jobs = io_tuning.jobs_for(os.path.dirname(candidates[0][0].path), "hash", retune=False)
+
+    def resolve(group: List[FileRecord]) -> List[DuplicateGroup]:
+        size = group[0].size
+        found: List[Tuple[str, List[str]]] = []
+        if cache is None and len(group) <= COMPARE_MAX_GROUP:
+            ranges = []
+            for rec in group:
+                try:
+                    start, end = payload_range(rec.path, ignore_metadata=not strict)
+                except OSError:
+                    start, end = 0, None
+                ranges.append((rec.path, start, size if end is None else min(end, size)))
+            same, _errors = lockstep_compare(ranges)
+            found = [(f"size-{size}-{n}", [group[i].path for i in g]) for n, g in enumerate(same)]
+        else:
+            by_digest: Dict[bytes, List[str]] = defaultdict(list)
+            for rec in group:
+                try:
+                    d = cache.digest(rec, strict) if cache is not None else content_digest(rec.path, ignore_metadata=not strict)
+                except OSError:
+                    continue
+                by_digest[d].append(rec.path)
+            found = [(d.hex(), paths) for d, paths in by_digest.items() if len(paths) > 1]
+        groups = []
+        for key, paths in found:
+            keep, delete = choose_keep(paths)
+            groups.append(DuplicateGroup(key, size, sorted(paths), keep, delete))
+        return groups
+
+    for groups in io_tuning.imap(resolve, candidates, jobs):
+        yield from groups
+
+
+def plan_normalize(files: Iterable[Source], cache: Optional[LibraryCache] = None, jobs: Optional[int] = None) -> Iterator[PlannedOp]:
+    """Renames to "Artist - Title.ext" in each file's folder, as
+    normalize_filenames would make them; files without a title are left
+    out. Names picked earlier in the run count as taken."""
+    # normalize_filenames needs mutagen; only this function does
+    from normalize_filenames import compute_target_name, ensure_unique_name, norm_ws
+
+    taken: set = set()
+    for meta in read_metadata(files, cache, jobs):
+        target = compute_target_name(meta.path, (norm_ws(meta.artist), norm_ws(meta.title)))
+        dirpath, fname = os.path.split(meta.path)
+        if not target or target == fname:
+            continue
+        dst = os.path.join(dirpath, ensure_unique_name(dirpath, target, taken))
+        taken.add(dst)
+        yield PlannedOp("rename", meta.path, dst)
+
+
+def plan_flatten(
+    root: str,
+    files: Optional[Iterable[Source]] = None,
+    cache: Optional[LibraryCache] = None,
+    on_duplicate: str = "quarantine",
+    quarantine: Optional[str] = None,
+    strict: bool = False,
+) -> Iterator[PlannedOp]:
+    """Moves of every file below root up into root, as flatten_all_songs
+    would make them (default files: scan(root) with its extensions), then
+    a final prune of the emptied folders. `on_duplicate` is one of
+    DUPLICATE_MODES for name collisions with identical audio."""
+    if on_duplicate not in DUPLICATE_MODES:
+        raise ValueError(f"on_duplicate expects one of: {', '.join(DUPLICATE_MODES)}")
+    root = os.path.abspath(os.path.expanduser(root))
+    quarantine = os.path.abspath(os.path.expanduser(quarantine or default_quarantine(root)))
+    if files is None:
+        files = scan(root, cache, FLATTEN_EXTS)
+    digest = (lambda path: cache.digest(_record(path), strict)) if cache is not None else None
+    check = CollisionCheck(on_duplicate, quarantine, strict, digest)
+    taken: Dict[str, str] = {}
+    for item in files:
+        src = os.path.abspath(_path(item))
+        if os.path.dirname(src) == root or (src + os.sep).startswith(quarantine + os.sep):
+            continue
+        name = os.path.basename(src)
+        dest_name = unique_root_name(root, name, taken)
+        if on_duplicate != "suffix" and dest_name != name:
+            keep, holder = check.identical(root, src, taken, None)
+            if keep is not None:
+                if on_duplicate == "drop":
+                    yield PlannedOp("rm", src, keep=keep, keep_from=holder)
+                else:
+                    yield PlannedOp("move", src, check.quarantine_path(src), keep=keep)
+                continue
+        dest = os.path.join(root, dest_name)
+        taken[dest] = src
+        yield PlannedOp("rename", src, dest)
+    yield PlannedOp("prune", root)
+
+
+def to_plan(ops: Iterable[PlannedOp], tool: str, root: Optional[str] = None) -> Plan:
+    """A plan_file.Plan of ops, fingerprinting each source as it is now.
+    `tool` is the script whose --apply may run it (e.g. "flatten_all_songs")."""
+    plan = Plan(tool, root)
+    for op in ops:
+        plan.add(op.op, op.src, op.dst, keep=op.keep, keep_from=op.keep_from)
+    return plan
+
+
+def organize(
+    inputs: Iterable[Source],
+    dest_root: str,
+    cache: Optional[LibraryCache] = None,
+    mode: str = "move",
+    dry_run: bool = False,
+    on_duplicate: str = "skip",
+    plan: Optional[Plan] = None,
+    have: Any = None,
+    log_path: Optional[str] = None,
+    jobs: Optional[int] = None,
+    zip_memory: int = DEFAULT_MEMORY,
+) -> Iterator[Organized]:
+    """organize_audio's filing of files, folders and .zip archives into
+    dest_root/Artist/Title.ext, one Organized record per input file. The
+    cache's index (if any) is checked for duplicates and learns each file
+    that lands; dry runs and plans record their files in it too, so close
+    it with commit=False after those."""
+    paths = [Path(_path(p)).expanduser() for p in inputs]
+    dest = Path(dest_root).expanduser()
+    workers = 1
+    if any(is_zip(p) for p in paths):
+        jobs = jobs or io_tuning.jobs_for(str(dest if dest.exists() else dest.parent), "copy")
+        workers = workers_for(zip_memory, jobs)
+    index = cache.index if cache is not None else None
+    yield from iter_organize(paths, dest, mode, dry_run, on_duplicate, False,
+                             Path(log_path) if log_path else None, plan, index, have, workers)
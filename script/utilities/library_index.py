@@ -0,0 +1,152 @@
+"""
+Persistent content index of a destination library, for duplicate checks on
+ingest.
+
+Every audio file under the library root is recorded with its payload hash
+(find_exact_duplicates.content_digest, so retagged copies still match) and
+its normalized (artist, title, duration) key (find_duplicates.make_key).
+Lookups are single indexed SQLite queries, so checking an incoming file
+costs the same whatever the library size.
+
+refresh() brings the index up to date using the incremental walk (see
+walk_cache) and only hashes new or changed files; add() records a file as
+soon as it lands, so later files in the same run see it.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from find_duplicates import make_key
+from find_exact_duplicates import content_digest
+from walk_cache import walk
+
+# Durations read from different encodes of one track can differ by a second
+DURATION_SLACK = 1
+
+# Everything organize_audio files into a library; all users of one index
+# must agree on this or each refresh would prune the others' rows
+INDEX_EXTS = {".mp3", ".m4a", ".aac", ".wav", ".aiff", ".aif", ".flac", ".ogg", ".oga", ".opus"}
+
+
+def is_indexed_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in INDEX_EXTS
+
+
+class Identity(NamedTuple):
+    digest: bytes
+    artist: str
+    title: str
+    duration: Optional[int]
+
+
+class Match(NamedTuple):
+    path: str
+    reason: str  # "content" (same payload hash) or "tags" (same artist/title/duration)
+
+
+def identify(path: str, size: Optional[int] = None, digest: Optional[bytes] = None) -> Identity:
+    """Payload hash and normalized artist/title/duration of one file.
+    Pass `digest` when the payload has already been hashed."""
+    digest = digest if digest is not None else content_digest(path)
+    key = make_key(path, size)
+    if key is None:
+        return Identity(digest, "", "", None)
+    artist, title, duration, _size = key
+    return Identity(digest, artist, title, duration)
+
+
+class LibraryIndex:
+    """path -> (size, mtime_ns, payload hash, artist, title, duration)."""
+
+    def __init__(self, db_path: str) -> None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest BLOB NOT NULL,
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                duration INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+            CREATE INDEX IF NOT EXISTS files_key ON files (title, artist, duration);
+            """
+        )
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def close(self, commit: bool = True) -> None:
+        if commit:
+            self.db.commit()
+        else:
+            self.db.rollback()
+        self.db.close()
+
+    def add(self, path: str, size: int, mtime_ns: int, ident: Identity) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, artist, title, duration)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, ident.digest, ident.artist, ident.title, ident.duration),
+        )
+
+    def get(self, path: str) -> Optional[Tuple[int, int, Identity]]:
+        """(size, mtime_ns, Identity) stored for path, or None."""
+        row = self.db.execute(
+            "SELECT size, mtime_ns, digest, artist, title, duration FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, digest, artist, title, duration = row
+        return size, mtime_ns, Identity(digest, artist, title, duration)
+
+    def remove(self, path: str) -> None:
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def refresh(self, root: str, full: bool = False, accept: Callable[[str], bool] = is_indexed_name) -> Tuple[int, int]:
+        """Index new/changed files under root and forget vanished ones.
+        Returns (indexed, removed)."""
+        known = {p: (s, m) for p, s, m in self.db.execute("SELECT path, size, mtime_ns FROM files")}
+        seen = set()
+        indexed = 0
+        for dirpath, files in walk(root, incremental=True, full=full):
+            for f in files:
+                if not accept(f.name):
+                    continue
+                path = os.path.join(dirpath, f.name)
+                seen.add(path)
+                if known.get(path) == (f.st_size, f.st_mtime_ns):
+                    continue
+                try:
+                    self.add(path, f.st_size, f.st_mtime_ns, identify(path, f.st_size))
+                except OSError as e:
+                    print(f"[SKIP] {path} ({e})")
+                    continue
+                indexed += 1
+        gone = [(p,) for p in known if p not in seen]
+        self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+        self.db.commit()
+        return indexed, len(gone)
+
+    def find(self, ident: Identity, exclude: Optional[str] = None) -> Optional[Match]:
+        """An indexed file with the same payload, else one with the same
+        artist/title and a duration within DURATION_SLACK seconds."""
+        for (path,) in self.db.execute("SELECT path FROM files WHERE digest = ? LIMIT 2", (ident.digest,)):
+            if path != exclude:
+                return Match(path, "content")
+        if not ident.title or ident.duration is None:
+            return None
+        for (path,) in self.db.execute(
+            "SELECT path FROM files WHERE title = ? AND artist = ? AND duration BETWEEN ? AND ? LIMIT 2",
+            (ident.title, ident.artist, ident.duration - DURATION_SLACK, ident.duration + DURATION_SLACK),
+        ):
+            if path != exclude:
+                return Match(path, "tags")
+        return None
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Sharded library manifests and a global duplicate merge.
+
+scan   Walk a library (or the shard of it picked by path hash), hash each
+       audio payload, read duration and normalized artist/title, and write a
+       compact gzip'd NDJSON manifest. Run it on each NAS host against its
+       local disks instead of scanning network mounts from one machine.
+merge  Read any number of manifests and report exact duplicate groups (same
+       size + payload hash) across all of them, plus probable duplicates
+       (same normalized artist/title/duration, different audio). Audio files
+       are never opened.
+
+A file belongs to shard I of N when a hash of its path relative to the root
+is I modulo N, so shards of the same root agree across hosts and runs.
+Re-running scan with the same --out reuses hashes and tags for files whose
+size and mtime are unchanged. With --time-budget, scan hashes the newest
+files first and, when the budget runs out, writes a manifest marked
+incomplete; the next scan reuses it and carries on with the rest.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import socket
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from cache_store import atomic_write_bytes
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+import io_throttle
+import io_tuning
+from find_duplicates import make_key
+from find_exact_duplicates import choose_keep, content_digest, is_target_name
+from records import scan_tree
+from scan_budget import Budget, budget_from_argv, newest_first
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+MANIFEST_VERSION = 1
+
+USAGE = (
+    "Usage: python3 library_manifest.py scan <directory> --out FILE [--shard I/N] [--host NAME] [--strict] [--jobs N] [--time-budget DURATION] [--full]\n"
+    "       python3 library_manifest.py merge FILE... [--format text|ndjson]"
+)
+
+
+class Entry(NamedTuple):
+    host: str
+    path: str
+    size: int
+    hash: str
+    duration: Optional[int]
+    artist: str
+    title: str
+
+
+def shard_of(rel: str, n: int) -> int:
+    """Shard index of a root-relative path; stable across hosts and runs."""
+    h = hashlib.blake2b(rel.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(h, "big") % n
+
+
+def parse_shard(spec: Optional[str]) -> Tuple[int, int]:
+    if not spec:
+        return 0, 1
+    try:
+        i, n = (int(x) for x in spec.split("/", 1))
+    except ValueError:
+        raise ValueError(f"--shard expects I/N, got {spec!r}")
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"--shard {spec}: need 0 <= I < N")
+    return i, n
+
+
+def read_manifest(path: str) -> Tuple[dict, Iterator[list]]:
+    """(header, rows) of a manifest; rows are
+    [rel, size, mtime_ns, hash, duration, artist, title]."""
+    f = gzip.open(path, "rt", encoding="utf-8")
+    try:
+        header = json.loads(f.readline() or "null")
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("manifest") != MANIFEST_VERSION:
+        f.close()
+        raise ValueError(f"not a library manifest: {path}")
+
+    def rows() -> Iterator[list]:
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, rows()
+
+
+def scan(root: str, out: str, shard: Tuple[int, int], host: str, strict: bool, full: bool,
+         budget: Optional[Budget] = None, jobs: Optional[int] = None) -> None:
+    i, n = shard
+    previous: Dict[str, list] = {}
+    if os.path.exists(out):
+        try:
+            header, rows = read_manifest(out)
+            if (header.get("root"), header.get("shard"), header.get("strict")) == (root, [i, n], strict):
+                previous = {r[0]: r for r in rows}
+        except (OSError, ValueError, EOFError):
+            previous = {}
+
+    table = scan_tree(root, is_target_name, incremental=True, full=full)
+    lines: List[str] = []
+    hashed = reused = 0
+    rows = table.rows()
+    if budget is not None and budget.seconds:
+        rows = newest_first(rows, table.mtime_ns.__getitem__)
+    work: List[int] = []
+    for row in rows:
+        path = table.path(row)
+        rel = os.path.relpath(path, root)
+        if n > 1 and shard_of(rel, n) != i:
+            continue
+        size, mtime_ns = table.size[row], table.mtime_ns[row]
+        prev = previous.get(rel)
+        if prev and prev[1] == size and prev[2] == mtime_ns:
+            reused += 1
+            emit("scanned", path=path, size=size, hash=prev[3], duration=prev[4], artist=prev[5], title=prev[6])
+            lines.append(json.dumps(prev, separators=(",", ":")))
+        else:
+            work.append(row)
+
+    started = 0
+
+    def until_budget() -> Iterator[int]:
+        nonlocal started
+        for row in work:
+            if budget is not None and budget.expired():
+                return
+            started += 1
+            yield row
+
+    def record(row: int) -> Tuple[int, Optional[list], Optional[OSError]]:
+        path = table.path(row)
+        try:
+            digest = content_digest(path, ignore_metadata=not strict).hex()
+        except OSError as e:
+            return row, None, e
+        key = make_key(path, table.size[row])
+        artist, title, duration = (key[0], key[1], key[2]) if key else ("", "", None)
+        rel = os.path.relpath(path, root)
+        return row, [rel, table.size[row], table.mtime_ns[row], digest, duration, artist, title], None
+
+    if jobs is None:
+        jobs = io_tuning.jobs_for(root, "hash", [table.path(r) for r in work], probe_new=True)
+    for row, rec, err in io_tuning.imap(record, until_budget(), jobs):
+        path = table.path(row)
+        if err is not None:
+            print(f"[SKIP] {path} ({err})")
+            emit("error", path=path, message=str(err))
+            continue
+        hashed += 1
+        emit("scanned", path=path, size=rec[1], hash=rec[3], duration=rec[4], artist=rec[5], title=rec[6])
+        lines.append(json.dumps(rec, separators=(",", ":")))
+    deferred = len(work) - started
+
+    header = {
+        "manifest": MANIFEST_VERSION,
+        "host": host,
+        "root": root,
+        "shard": [i, n],
+        "strict": strict,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "files": len(lines),
+        "complete": not deferred,
+    }
+    body = json.dumps(header, separators=(",", ":")) + "\n" + "".join(l + "\n" for l in lines)
+    atomic_write_bytes(out, gzip.compress(body.encode("utf-8"), compresslevel=6))
+    print(f"Manifest written: {out} | Files: {len(lines)} (hashed {hashed}, reused {reused}) | Shard {i}/{n}")
+    if deferred:
+        print(f"Time budget reached: {deferred} file(s) not yet in the manifest; run scan again to continue")
+    emit("done", files=len(lines), hashed=hashed, reused=reused, deferred=deferred or None, shard=[i, n])
+
+
+def load_entries(paths: List[str]) -> List[Entry]:
+    entries: List[Entry] = []
+    seen = set()
+    shards: Dict[Tuple[str, str], set] = defaultdict(set)
+    totals: Dict[Tuple[str, str], int] = {}
+    for mpath in paths:
+        header, rows = read_manifest(mpath)
+        host, root = header.get("host", "?"), header["root"]
+        i, n = header.get("shard", [0, 1])
+        shards[(host, root)].add(i)
+        if not header.get("complete", True):
+            print(f"Warning: {mpath} is incomplete (scan stopped at its time budget)")
+        totals[(host, root)] = n
+        for rel, size, _mtime, digest, duration, artist, title in rows:
+            full_path = os.path.join(root, rel)
+            if (host, full_path) in seen:
+                continue  # overlapping manifests list the same file twice
+            seen.add((host, full_path))
+            entries.append(Entry(host, full_path, size, digest, duration, artist, title))
+    for (host, root), got in sorted(shards.items()):
+        missing = sorted(set(range(totals[(host, root)])) - got)
+        if missing:
+            print(f"Warning: {host}:{root} is missing shard(s) {', '.join(map(str, missing))} of {totals[(host, root)]}")
+    return entries
+
+
+def merge(paths: List[str]) -> None:
+    entries = load_entries(paths)
+    hosts = sorted({e.host for e in entries})
+    print(f"Loaded {len(entries)} files from {len(paths)} manifest(s) on {len(hosts)} host(s)")
+
+    def label(e: Entry) -> str:
+        return f"{e.host}:{e.path}" if len(hosts) > 1 else e.path
+
+    exact: Dict[Tuple[int, str], List[Entry]] = defaultdict(list)
+    for e in entries:
+        exact[(e.size, e.hash)].append(e)
+    exact_groups = [g for g in exact.values() if len(g) > 1]
+
+    to_rm: Dict[str, List[str]] = defaultdict(list)  # host -> paths
+    if exact_groups:
+        print("\nExact duplicate groups (same size and payload hash):")
+    for group in sorted(exact_groups, key=lambda g: g[0].hash):
+        by_label = {label(e): e for e in group}
+        keep_label, delete = choose_keep(sorted(by_label))
+        print(f"\nHash: {group[0].hash}")
+        for lab in sorted(by_label):
+            print(f"  - {lab}")
+        emit("group", kind="exact", key=group[0].hash, paths=sorted(by_label), keep=keep_label)
+        for lab in delete:
+            e = by_label[lab]
+            to_rm[e.host].append(e.path)
+            emit("op", op="rm", src=e.path, host=e.host, keep=keep_label, status="suggested")
+
+    # Probable duplicates: same normalized artist/title/duration but different audio
+    probable: Dict[Tuple[str, str, int], Dict[Tuple[int, str], Entry]] = defaultdict(dict)
+    for e in entries:
+        if e.title and e.duration is not None:
+            probable[(e.artist, e.title, e.duration)].setdefault((e.size, e.hash), e)
+    probable_groups = [(k, list(v.values())) for k, v in sorted(probable.items()) if len(v) > 1]
+    if probable_groups:
+        print("\nProbable duplicates (same artist/title/duration, different audio):")
+    for (artist, title, duration), group in probable_groups:
+        print(f"\n({artist or '∅-artist'}, {title}, {duration}s)")
+        for e in sorted(group, key=label):
+            print(f"  - {label(e)} ({e.size}B)")
+        emit("group", kind="probable", key=[artist, title, duration], paths=sorted(label(e) for e in group))
+
+    if not exact_groups and not probable_groups:
+        print("No duplicates found.")
+    for host in sorted(to_rm):
+        print(f"\nOne big rm command{f' (on {host})' if len(hosts) > 1 else ''}:")
+        print("rm " + " ".join(shlex.quote(p) for p in to_rm[host]))
+    emit("done", files=len(entries), manifests=len(paths), exact_groups=len(exact_groups),
+         probable_groups=len(probable_groups), suggested_rm=sum(len(v) for v in to_rm.values()))
+
+
+def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("library_manifest")
+    io_throttle.setup_from_argv()
+    args = sys.argv[1:]
+    if not args or args[0] not in ("scan", "merge"):
+        print(USAGE)
+        sys.exit(1)
+
+    # Positional arguments: everything that is not a flag or a flag's value
+    valued = {"--out", "--shard", "--host", "--format", "--time-budget", "--jobs", "--max-read-rate", "--max-write-rate"}
+    positional: List[str] = []
+    skip = False
+    for a in args[1:]:
+        if skip:
+            skip = False
+            continue
+        if a in valued:
+            skip = True
+        elif not a.startswith("-"):
+            positional.append(a)
+
+    if args[0] == "merge":
+        if not positional:
+            print(USAGE)
+            sys.exit(1)
+        try:
+            merge([os.path.expanduser(p) for p in positional])
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
+
+    root = positional[0] if positional else os.environ.get("MUSIC_LIBRARY_DIR")
+    out = arg_value("--out")
+    if not root or not out:
+        print("Error: scan needs a directory (or MUSIC_LIBRARY_DIR) and --out FILE")
+        print(USAGE)
+        sys.exit(1)
+    root = os.path.realpath(os.path.expanduser(root))
+    if not os.path.isdir(root):
+        print(f"Root does not exist or is not a directory: {root}")
+        sys.exit(1)
+    try:
+        shard = parse_shard(arg_value("--shard"))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    host = arg_value("--host") or socket.gethostname()
+    try:
+        jobs = int(arg_value("--jobs")) if arg_value("--jobs") else None
+    except ValueError:
+        print("--jobs expects a number")
+        sys.exit(1)
+    scan(root, os.path.expanduser(out), shard, host, strict="--strict" in sys.argv, full="--full" in sys.argv,
+         budget=budget_from_argv(), jobs=jobs)
+
+
+if __name__ == "__main__":
+    main()
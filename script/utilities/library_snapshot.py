@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Columnar snapshot of library metadata, and vectorized queries over it.
+
+build  Scan a library and write one .npy file per column into a snapshot
+       directory (default: in the cache dir, keyed by root). Files whose size
+       and mtime match the previous snapshot are copied from it, so only new
+       or changed files have their headers/tags read and payload hashed.
+query  Memory-map the columns and answer filters and aggregates with NumPy;
+       nothing is re-read from the audio files.
+
+Columns
+- size, mtime_ns (int64), duration (float32 seconds, NaN when unknown)
+- sample_rate (uint32), bits, channels (uint8; 0 when unknown)
+- format (uint8 index into meta.json "formats")
+- dir_id, name_id (uint32 into the "paths" string pool)
+- artist_id, title_id, genre_id (uint32 into the "tags" string pool)
+- hash (32 bytes per row: payload SHA-256 as in find_exact_duplicates, zeros if skipped)
+
+String pools are stored as a UTF-8 blob plus an offsets column, so they are
+memory-mapped like everything else and only decoded when a query needs them.
+"""
+
+from __future__ import annotations
+
+import io
+import math
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cache_store import atomic_write_bytes, cache_path, load_json, save_json
+from cli_flags import arg_value, arg_values
+from events import emit, setup_from_argv
+import io_throttle
+from fast_tags import first_text, read_fast_tags
+from records import StringPool, scan_tree
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # noqa: BLE001 - reported when the command runs
+    np = None  # type: ignore
+
+try:
+    from mutagen import File as MFile  # type: ignore
+except Exception:  # noqa: BLE001 - mutagen is optional; native reader covers FLAC/WAV/AIFF
+    MFile = None  # type: ignore
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+SNAPSHOT_VERSION = 1
+
+FORMATS = ["", "mp3", "wav", "aiff", "flac", "m4a", "aac", "ogg", "opus"]
+_EXT_FORMAT = {".aif": "aiff", ".oga": "ogg"}
+EXTENSIONS = {".mp3", ".wav", ".aiff", ".aif", ".flac", ".m4a", ".aac", ".ogg", ".oga", ".opus"}
+
+NUMERIC = {
+    "size": "<i8",
+    "mtime_ns": "<i8",
+    "duration": "<f4",
+    "sample_rate": "<u4",
+    "bits": "u1",
+    "channels": "u1",
+    "format": "u1",
+    "dir_id": "<u4",
+    "name_id": "<u4",
+    "artist_id": "<u4",
+    "title_id": "<u4",
+    "genre_id": "<u4",
+}
+# Query names for the string-valued columns: name -> (id column, pool)
+STRING_COLUMNS = {
+    "artist": ("artist_id", "tags"),
+    "title": ("title_id", "tags"),
+    "genre": ("genre_id", "tags"),
+    "dir": ("dir_id", "paths"),
+    "name": ("name_id", "paths"),
+}
+QUERY_NUMERIC = ("size", "mtime_ns", "duration", "sample_rate", "bits", "channels")
+
+USAGE = (
+    "Usage: python3 library_snapshot.py build [<directory>] [--snapshot DIR] [--no-hash] [--full]\n"
+    "       python3 library_snapshot.py query [<directory>] [--snapshot DIR] [--where 'COL OP VALUE']...\n"
+    "              [--group-by COL] [--agg count|sum:COL|mean:COL|min:COL|max:COL]... [--list] [--limit N]"
+)
+
+
+def _require_numpy() -> None:
+    if np is None:
+        print("Error: library_snapshot requires numpy (python3 -m pip install numpy)")
+        sys.exit(1)
+
+
+def format_of(name: str) -> int:
+    ext = os.path.splitext(name)[1].lower()
+    fmt = _EXT_FORMAT.get(ext, ext[1:])
+    return FORMATS.index(fmt) if fmt in FORMATS else 0
+
+
+def read_metadata(path: str) -> Tuple[float, int, int, int, str, str, str]:
+    """(duration, sample_rate, bits, channels, artist, title, genre); unknown
+    numbers are NaN/0. Native header/tag reader first, one mutagen parse for
+    whatever it could not provide."""
+    tags = read_fast_tags(path)
+    duration = float(tags.get("length") or math.nan) if tags else math.nan
+    rate = int(tags.get("sample_rate") or 0) if tags else 0
+    bits = int(tags.get("bits") or 0) if tags else 0
+    channels = int(tags.get("channels") or 0) if tags else 0
+    if (tags is None or math.isnan(duration) or not rate) and MFile is not None:
+        try:
+            audio = MFile(path, easy=True)
+        except Exception:  # noqa: BLE001 - unreadable files keep the unknowns
+            audio = None
+        if audio is not None:
+            info = getattr(audio, "info", None)
+            if math.isnan(duration) and getattr(info, "length", None):
+                duration = float(info.length)
+            rate = rate or int(getattr(info, "sample_rate", 0) or 0)
+            bits = bits or int(getattr(info, "bits_per_sample", 0) or 0)
+            channels = channels or int(getattr(info, "channels", 0) or 0)
+            if tags is None:
+                tags = {k: list(audio.get(k, [])) for k in ("artist", "title", "genre")} if audio.tags else {}
+    tags = tags or {}
+    return (
+        duration,
+        rate,
+        bits,
+        channels,
+        first_text(tags, "artist", "albumartist") or "",
+        first_text(tags, "title") or "",
+        first_text(tags, "genre") or "",
+    )
+
+
+def _npy_bytes(arr: "np.ndarray") -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, arr, allow_pickle=False)
+    return buf.getvalue()
+
+
+def _pool_arrays(pool: StringPool) -> Tuple["np.ndarray", "np.ndarray"]:
+    encoded = [pool.get(i).encode("utf-8", "surrogateescape") for i in range(len(pool))]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype="u1"), offsets
+
+
+class Snapshot:
+    """Read side: memory-mapped columns plus lazily decoded string pools."""
+
+    def __init__(self, dirpath: str) -> None:
+        self.dir = dirpath
+        self.meta = load_json(os.path.join(dirpath, "meta.json"))
+        if not isinstance(self.meta, dict) or self.meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"no snapshot in {dirpath} (run build first)")
+        self.rows = int(self.meta["rows"])
+        self._cols: Dict[str, "np.ndarray"] = {}
+        self._pools: Dict[str, List[str]] = {}
+
+    def col(self, name: str) -> "np.ndarray":
+        arr = self._cols.get(name)
+        if arr is None:
+            arr = np.load(os.path.join(self.dir, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+            if name not in ("paths_blob", "paths_off", "tags_blob", "tags_off") and len(arr) != self.rows:
+                raise ValueError(f"snapshot column {name} is inconsistent; rebuild it")
+            self._cols[name] = arr
+        return arr
+
+    def pool(self, kind: str) -> List[str]:
+        strings = self._pools.get(kind)
+        if strings is None:
+            blob = self.col(f"{kind}_blob").tobytes()
+            off = self.col(f"{kind}_off").tolist()
+            strings = [blob[off[i]:off[i + 1]].decode("utf-8", "surrogateescape") for i in range(len(off) - 1)]
+            self._pools[kind] = strings
+        return strings
+
+    def path(self, row: int) -> str:
+        paths = self.pool("paths")
+        return os.path.join(paths[int(self.col("dir_id")[row])], paths[int(self.col("name_id")[row])])
+
+
+# Columns a rebuild copies for unchanged files
+REUSED = ("size", "mtime_ns", "duration", "sample_rate", "bits", "channels", "artist_id", "title_id", "genre_id", "hash")
+
+
+def build(root: str, out_dir: str, hash_payload: bool, full: bool) -> None:
+    from find_exact_duplicates import content_digest
+
+    previous: Dict[str, int] = {}
+    prev_cols: Dict[str, "np.ndarray"] = {}
+    tag_strings: List[str] = []
+    try:
+        prev = Snapshot(out_dir)
+        if prev.meta.get("root") == root and prev.meta.get("hashed") == hash_payload:
+            # Everything reused is loaded and checked here, so a snapshot left
+            # inconsistent by an interrupted build is simply not reused
+            paths = prev.pool("paths")
+            dir_ids, name_ids = prev.col("dir_id"), prev.col("name_id")
+            prev_cols = {name: prev.col(name) for name in REUSED}
+            tag_strings = prev.pool("tags")
+            for name in ("artist_id", "title_id", "genre_id"):
+                if len(prev_cols[name]) and int(prev_cols[name].max()) >= len(tag_strings):
+                    raise ValueError("snapshot tag pool is inconsistent")
+            previous = {os.path.join(paths[d], paths[n]): i for i, (d, n) in enumerate(zip(dir_ids.tolist(), name_ids.tolist()))}
+    except (OSError, ValueError, KeyError, IndexError):
+        previous, prev_cols, tag_strings = {}, {}, []
+
+    table = scan_tree(root, lambda name: os.path.splitext(name)[1].lower() in EXTENSIONS, incremental=True, full=full)
+    n = len(table)
+    cols = {name: np.zeros(n, dtype=dt) for name, dt in NUMERIC.items()}
+    cols["duration"][:] = np.nan
+    digests = np.zeros((n, 32), dtype="u1")
+    paths_pool, tags_pool = StringPool(), StringPool()
+    reused = read = 0
+    for row in table.rows():
+        path = table.path(row)
+        size, mtime_ns = table.size[row], table.mtime_ns[row]
+        cols["size"][row] = size
+        cols["mtime_ns"][row] = mtime_ns
+        cols["format"][row] = format_of(path)
+        cols["dir_id"][row] = paths_pool.intern(table.dirname(row))
+        cols["name_id"][row] = paths_pool.intern(table.name(row))
+        i = previous.get(path)
+        if i is not None and prev_cols["size"][i] == size and prev_cols["mtime_ns"][i] == mtime_ns:
+            for name in ("duration", "sample_rate", "bits", "channels"):
+                cols[name][row] = prev_cols[name][i]
+            for name in ("artist_id", "title_id", "genre_id"):
+                cols[name][row] = tags_pool.intern(tag_strings[int(prev_cols[name][i])])
+            digests[row] = prev_cols["hash"][i]
+            reused += 1
+            continue
+        duration, rate, bits, channels, artist, title, genre = read_metadata(path)
+        cols["duration"][row] = duration
+        cols["sample_rate"][row] = rate
+        cols["bits"][row] = min(bits, 255)
+        cols["channels"][row] = min(channels, 255)
+        cols["artist_id"][row] = tags_pool.intern(artist)
+        cols["title_id"][row] = tags_pool.intern(title)
+        cols["genre_id"][row] = tags_pool.intern(genre)
+        if hash_payload:
+            try:
+                digests[row] = np.frombuffer(content_digest(path), dtype="u1")
+            except OSError as e:
+                print(f"[SKIP] {path} ({e})")
+                emit("error", path=path, message=str(e))
+        read += 1
+        emit("scanned", path=path, size=size, duration=None if math.isnan(duration) else duration,
+             sample_rate=rate or None, bits=bits or None, artist=artist, title=title, genre=genre)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in cols.items():
+        atomic_write_bytes(os.path.join(out_dir, f"{name}.npy"), _npy_bytes(arr))
+    atomic_write_bytes(os.path.join(out_dir, "hash.npy"), _npy_bytes(digests))
+    for kind, pool in (("paths", paths_pool), ("tags", tags_pool)):
+        blob, off = _pool_arrays(pool)
+        atomic_write_bytes(os.path.join(out_dir, f"{kind}_blob.npy"), _npy_bytes(blob))
+        atomic_write_bytes(os.path.join(out_dir, f"{kind}_off.npy"), _npy_bytes(off))
+    # meta.json last: readers only trust columns whose length matches it
+    save_json(os.path.join(out_dir, "meta.json"), {
+        "version": SNAPSHOT_VERSION,
+        "root": root,
+        "rows": n,
+        "formats": FORMATS,
+        "hashed": hash_payload,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    })
+    print(f"Snapshot written: {out_dir} | Rows: {n} (read {read}, reused {reused})")
+    emit("done", rows=n, read=read, reused=reused)
+
+
+_COND = re.compile(r"^\s*([a-z_]+)\s*(==|!=|<=|>=|<|>|~)\s*(.+?)\s*$")
+
+
+def condition_mask(snap: Snapshot, expr: str) -> "np.ndarray":
+    """Boolean row mask for one `COL OP VALUE` condition."""
+    m = _COND.match(expr)
+    if not m:
+        raise ValueError(f"cannot parse condition {expr!r} (expected COL OP VALUE)")
+    name, op, value = m.group(1), m.group(2), m.group(3).strip("'\"")
+    if name == "format":
+        if op not in ("==", "!="):
+            raise ValueError("format supports == and != only")
+        fmt = _EXT_FORMAT.get("." + value.lower().lstrip("."), value.lower().lstrip("."))
+        ids = [FORMATS.index(fmt)] if fmt in FORMATS else []
+        mask = np.isin(snap.col("format"), ids)
+        return mask if op == "==" else ~mask
+    if name in STRING_COLUMNS:
+        id_col, kind = STRING_COLUMNS[name]
+        if op not in ("==", "!=", "~"):
+            raise ValueError(f"{name} supports ==, != and ~ (contains) only")
+        needle = value.casefold()
+        strings = snap.pool(kind)
+        if op == "~":
+            ids = [i for i, s in enumerate(strings) if needle in s.casefold()]
+        else:
+            ids = [i for i, s in enumerate(strings) if s.casefold() == needle]
+        mask = np.isin(snap.col(id_col), ids)
+        return ~mask if op == "!=" else mask
+    if name not in QUERY_NUMERIC:
+        raise ValueError(f"unknown column {name!r}")
+    if op == "~":
+        raise ValueError(f"{name} is numeric; use ==, !=, <, <=, > or >=")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name} expects a number, got {value!r}")
+    col = snap.col(name)
+    return {
+        "==": col == number,
+        "!=": col != number,
+        "<": col < number,
+        "<=": col <= number,
+        ">": col > number,
+        ">=": col >= number,
+    }[op]
+
+
+def _fmt(col: Optional[str], value: float) -> str:
+    if isinstance(value, float) and math.isnan(value):
+        return "-"
+    if col == "duration":
+        s = int(round(value))
+        return f"{s // 3600}:{s // 60 % 60:02d}:{s % 60:02d}"
+    if col == "size":
+        return f"{value / 1e6:.1f} MB"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def aggregate(values: "np.ndarray", inverse: "np.ndarray", groups: int, func: str) -> "np.ndarray":
+    """Per-group reduction; NaNs (unknown durations) are ignored."""
+    values = values.astype("f8")
+    known = ~np.isnan(values)
+    if func == "sum":
+        return np.bincount(inverse, weights=np.where(known, values, 0.0), minlength=groups)
+    if func == "mean":
+        total = np.bincount(inverse, weights=np.where(known, values, 0.0), minlength=groups)
+        count = np.bincount(inverse, weights=known.astype("f8"), minlength=groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count
+    out = np.full(groups, np.inf if func == "min" else -np.inf)
+    (np.fmin if func == "min" else np.fmax).at(out, inverse, values)
+    out[np.isinf(out)] = np.nan
+    return out
+
+
+def query(snap: Snapshot, where: List[str], group_by: Optional[str], aggs: List[str], list_rows: bool, limit: int) -> None:
+    started = time.perf_counter()
+    mask = np.ones(snap.rows, dtype=bool)
+    for expr in where:
+        for part in re.split(r"\s+and\s+", expr, flags=re.IGNORECASE):
+            mask &= condition_mask(snap, part)
+    rows = np.flatnonzero(mask)
+
+    specs: List[Tuple[str, Optional[str]]] = []
+    for a in aggs or ["count"]:
+        func, _, col = a.partition(":")
+        if func == "count":
+            specs.append(("count", None))
+        elif func in ("sum", "mean", "min", "max") and col in QUERY_NUMERIC:
+            specs.append((func, col))
+        else:
+            raise ValueError(f"bad --agg {a!r} (count, or sum/mean/min/max:COLUMN with a numeric column)")
+
+    if group_by:
+        if group_by == "format":
+            keys = snap.col("format")[rows]
+            label = lambda k: FORMATS[k] or "?"  # noqa: E731
+        elif group_by in STRING_COLUMNS:
+            id_col, kind = STRING_COLUMNS[group_by]
+            keys = snap.col(id_col)[rows]
+            strings = snap.pool(kind)
+            label = lambda k: strings[k] or "(none)"  # noqa: E731
+        elif group_by in QUERY_NUMERIC:
+            keys = snap.col(group_by)[rows]
+            label = lambda k: _fmt(group_by, k)  # noqa: E731
+        else:
+            raise ValueError(f"cannot group by {group_by!r}")
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        groups = len(uniq)
+    else:
+        uniq, inverse, groups = np.zeros(1, dtype="u1"), np.zeros(len(rows), dtype=np.intp), 1
+        label = lambda k: "all"  # noqa: E731
+
+    counts = np.bincount(inverse, minlength=groups)
+    results = []
+    for func, col in specs:
+        if func == "count":
+            results.append(counts)
+        else:
+            results.append(aggregate(snap.col(col)[rows], inverse, groups, func))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    headers = [group_by or ""] + [f"{f}({c})" if c else f for f, c in specs]
+    print("\t".join(headers))
+    order = np.argsort(-counts, kind="stable") if group_by else [0]
+    for g in order:
+        key = uniq[g].item() if group_by else None
+        cells = [label(key)]
+        values = {}
+        for (func, col), res in zip(specs, results):
+            v = res[g].item()
+            cells.append(str(v) if func == "count" else _fmt(col, v))
+            values[f"{func}_{col}" if col else func] = None if isinstance(v, float) and math.isnan(v) else v
+        print("\t".join(cells))
+        emit("result", key=label(key) if group_by else None, **values)
+
+    if list_rows:
+        print()
+        for r in rows[:limit].tolist():
+            print(snap.path(r))
+            emit("result", path=snap.path(r))
+        if len(rows) > limit:
+            print(f"... {len(rows) - limit} more (raise --limit)")
+    print(f"\n{len(rows)} of {snap.rows} rows matched in {elapsed_ms:.1f} ms")
+
+
+def main():
+    # --format ndjson streams build progress and query results as JSON events
+    setup_from_argv("library_snapshot")
+    io_throttle.setup_from_argv()
+    args = sys.argv[1:]
+    if not args or args[0] not in ("build", "query"):
+        print(USAGE)
+        sys.exit(1)
+    _require_numpy()
+
+    valued = {"--snapshot", "--where", "--group-by", "--agg", "--limit", "--format", "--max-read-rate", "--max-write-rate"}
+    positional = [a for i, a in enumerate(args[1:], 1) if not a.startswith("-") and args[i - 1] not in valued]
+    root = positional[0] if positional else os.environ.get("MUSIC_LIBRARY_DIR")
+    snapshot_dir = arg_value("--snapshot")
+    if not root and not snapshot_dir:
+        print("Error: No directory specified.")
+        print(USAGE)
+        print("Or set MUSIC_LIBRARY_DIR in your .env file")
+        sys.exit(1)
+    if root:
+        root = os.path.abspath(os.path.expanduser(root))
+    snapshot_dir = os.path.expanduser(snapshot_dir) if snapshot_dir else cache_path("snapshot", root, "")
+
+    if args[0] == "build":
+        if not root or not os.path.isdir(root):
+            print(f"Root does not exist or is not a directory: {root}")
+            sys.exit(1)
+        build(root, snapshot_dir, hash_payload="--no-hash" not in sys.argv, full="--full" in sys.argv)
+        return
+
+    try:
+        limit = int(arg_value("--limit", "50"))
+        query(
+            Snapshot(snapshot_dir),
+            arg_values("--where"),
+            arg_value("--group-by"),
+            arg_values("--agg"),
+            "--list" in sys.argv,
+            limit,
+        )
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
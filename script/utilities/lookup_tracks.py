@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Tracklist pre-filter: which `Artist - Title` entries are already in the library?
+
+build  Record the normalized artist/title of every audio file under the
+       library (tags first, then find_duplicates.infer_from_filename, both
+       through find_duplicates.make_key/norm) in a small SQLite index. Re-runs
+       only read tags of new or changed files.
+check  Read a tracklist (one `Artist - Title` per line, as written by
+       spotify-list/tidal-list) and report each entry as present (exact, or
+       fuzzy with a 0-100 score) or missing. `--missing-out FILE` writes the
+       missing lines, so the download pipeline only searches for those.
+       With `--exact-only`, fuzzy hits are still reported but count as
+       missing: a remix or edit can score above the threshold against the
+       original.
+
+The index is queried in place rather than loaded: opening it and answering a
+tracklist takes milliseconds whatever the library size. Fuzzy candidates are
+the tracks sharing the most artist/title tokens; each is scored with difflib
+on loosened strings (featuring credits and punctuation removed, tokens
+sorted), the title weighing TITLE_WEIGHT and the artist the rest.
+"""
+
+from __future__ import annotations
+
+import difflib
+import os
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from cache_store import cache_path
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+from find_duplicates import make_key, norm
+from library_index import is_indexed_name
+from walk_cache import walk
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+DEFAULT_MIN_SCORE = 85
+CLOSEST_SCORE = 60  # missing entries still name a candidate scoring this much
+MAX_CANDIDATES = 50
+TITLE_WEIGHT = 0.65  # the rest is the artist's share of a fuzzy score
+
+USAGE = (
+    "Usage: python3 lookup_tracks.py build [<library>] [--index FILE] [--full]\n"
+    "       python3 lookup_tracks.py check <tracklist> [--index FILE] [--refresh] [--min-score N] "
+    "[--exact-only] [--missing-out FILE] [--format text|ndjson]"
+)
+
+_FEAT = re.compile(r"[(\[]\s*(?:feat\.?|ft\.?|featuring|with)\s[^)\]]*[)\]]|\s(?:feat\.?|ft\.?|featuring)\s.*$")
+_PUNCT = re.compile(r"[^\w\s]+")
+_ARTIST_SPLIT = re.compile(r"\s*(?:,|&|;|\bx\b|\band\b|\bfeat\.?|\bft\.?|\bfeaturing\b|\bvs\.?)\s*")
+
+
+class Hit(NamedTuple):
+    path: str
+    artist: str
+    title: str
+    score: int
+    exact: bool
+
+
+def loose(text: str) -> str:
+    """norm()'d text without featuring credits or punctuation, tokens sorted."""
+    text = _FEAT.sub(" ", norm(text))
+    return " ".join(sorted(_PUNCT.sub(" ", text).split()))
+
+
+def tokens(text: str) -> List[str]:
+    return [t for t in loose(text).split() if len(t) > 1]
+
+
+def parse_line(line: str) -> Tuple[str, str]:
+    """`Artist - Title` -> normalized (artist, title); no dash means title only."""
+    if " - " in line:
+        artist, title = line.split(" - ", 1)
+        return norm(artist), norm(title)
+    return "", norm(line)
+
+
+def _ratio(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b).ratio() if a and b else 0.0
+
+
+def _artist_ratio(want: str, have: str) -> float:
+    if not want or not have:
+        return 0.0
+    want_primary = _ARTIST_SPLIT.split(want)[0]
+    have_primary = _ARTIST_SPLIT.split(have)[0]
+    if want_primary and loose(want_primary) == loose(have_primary):
+        return 1.0
+    return _ratio(loose(want), loose(have))
+
+
+def score(artist: str, title: str, lib_artist: str, lib_title: str) -> int:
+    t = max(_ratio(title, lib_title), _ratio(loose(title), loose(lib_title)))
+    return round(100 * (TITLE_WEIGHT * t + (1 - TITLE_WEIGHT) * _artist_ratio(artist, lib_artist)))
+
+
+class LookupIndex:
+    """path -> normalized (artist, title), plus an artist/title token table."""
+
+    def __init__(self, db_path: str) -> None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tracks_key ON tracks (title, artist);
+            CREATE TABLE IF NOT EXISTS tokens (
+                token TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (token, id)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def _remove(self, ids: Iterable[int]) -> None:
+        rows = [(i,) for i in ids]
+        self.db.executemany("DELETE FROM tokens WHERE id = ?", rows)
+        self.db.executemany("DELETE FROM tracks WHERE id = ?", rows)
+
+    def refresh(self, root: str, full: bool = False) -> Tuple[int, int]:
+        """Read tags of new/changed files under root and forget vanished ones.
+        Returns (indexed, removed)."""
+        known = {p: (i, s, m) for i, p, s, m in self.db.execute("SELECT id, path, size, mtime_ns FROM tracks")}
+        seen = set()
+        indexed = 0
+        for dirpath, files in walk(root, incremental=True, full=full):
+            for f in files:
+                if not is_indexed_name(f.name):
+                    continue
+                path = os.path.join(dirpath, f.name)
+                seen.add(path)
+                old = known.get(path)
+                if old and old[1:] == (f.st_size, f.st_mtime_ns):
+                    continue
+                try:
+                    key = make_key(path, f.st_size)
+                except OSError as e:
+                    print(f"[SKIP] {path} ({e})")
+                    continue
+                if old:
+                    self._remove([old[0]])
+                if key is None:
+                    continue
+                artist, title = key[0], key[1]
+                cur = self.db.execute(
+                    "INSERT INTO tracks (path, size, mtime_ns, artist, title) VALUES (?, ?, ?, ?, ?)",
+                    (path, f.st_size, f.st_mtime_ns, artist, title),
+                )
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO tokens (token, id) VALUES (?, ?)",
+                    [(t, cur.lastrowid) for t in set(tokens(title) + tokens(artist))],
+                )
+                indexed += 1
+        gone = [i for p, (i, _s, _m) in known.items() if p not in seen]
+        self._remove(gone)
+        self.db.commit()
+        return indexed, len(gone)
+
+    def find(self, artist: str, title: str) -> Optional[Hit]:
+        """Exact normalized match, else the best-scoring fuzzy candidate."""
+        if not title:
+            return None
+        for path, a, t in self.db.execute(
+            "SELECT path, artist, title FROM tracks WHERE title = ? AND artist = ? LIMIT 1", (title, artist)
+        ):
+            return Hit(path, a, t, 100, True)
+        toks = sorted(set(tokens(title) + tokens(artist)))
+        if not tokens(title):
+            return None
+        marks = ",".join("?" * len(toks))
+        rows = self.db.execute(
+            f"SELECT t.path, t.artist, t.title FROM tracks t JOIN ("
+            f" SELECT id, COUNT(*) AS shared FROM tokens WHERE token IN ({marks}) GROUP BY id"
+            f" ORDER BY shared DESC LIMIT {MAX_CANDIDATES}) c ON c.id = t.id",
+            toks,
+        ).fetchall()
+        best: Optional[Hit] = None
+        for path, a, t in rows:
+            s = score(artist, title, a, t)
+            if best is None or s > best.score:
+                best = Hit(path, a, t, s, False)
+        return best
+
+
+def index_path(root: Optional[str]) -> Optional[str]:
+    explicit = arg_value("--index")
+    if explicit:
+        return os.path.expanduser(explicit)
+    return cache_path("lookup", root, ".sqlite") if root else None
+
+
+def check(index: LookupIndex, lines: List[str], min_score: int, missing_out: Optional[str],
+          exact_only: bool = False) -> None:
+    present = fuzzy = 0
+    missing: List[str] = []
+    for raw in lines:
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        artist, title = parse_line(line)
+        hit = index.find(artist, title)
+        if hit is None or hit.score < min_score:
+            missing.append(line)
+            closest = f"  (closest ~{hit.score}: {hit.path})" if hit is not None and hit.score >= CLOSEST_SCORE else ""
+            print(f"MISSING  {line}{closest}")
+            emit("result", line=line, status="missing", score=hit.score if hit else None, path=hit.path if hit else None)
+            continue
+        if exact_only and not hit.exact:
+            missing.append(line)
+            fuzzy += 1
+            print(f"MAYBE    {line}  [~{hit.score}] -> {hit.path}")
+            emit("result", line=line, status="missing", match="fuzzy", score=hit.score, path=hit.path)
+            continue
+        present += 1
+        fuzzy += not hit.exact
+        label = "exact" if hit.exact else f"~{hit.score}"
+        print(f"HAVE     {line}  [{label}] -> {hit.path}")
+        emit("result", line=line, status="present", match="exact" if hit.exact else "fuzzy",
+             score=hit.score, path=hit.path)
+    if missing_out:
+        with open(missing_out, "w", encoding="utf-8") as f:
+            f.writelines(m + "\n" for m in missing)
+    if exact_only:
+        print(f"\nDone. Entries: {present + len(missing)} | Present: {present} | Missing: {len(missing)} ({fuzzy} fuzzy)")
+    else:
+        print(f"\nDone. Entries: {present + len(missing)} | Present: {present} ({fuzzy} fuzzy) | Missing: {len(missing)}")
+    emit("done", entries=present + len(missing), present=present, fuzzy=fuzzy, missing=len(missing))
+
+
+def main():
+    # --format ndjson streams one JSON event per tracklist entry on stdout
+    setup_from_argv("lookup_tracks")
+    args = sys.argv[1:]
+    if not args or args[0] not in ("build", "check"):
+        print(USAGE)
+        sys.exit(1)
+    valued = {"--index", "--min-score", "--missing-out", "--format"}
+    positional = [a for i, a in enumerate(args[1:], 1) if not a.startswith("-") and args[i - 1] not in valued]
+    library = os.environ.get("MUSIC_LIBRARY_DIR")
+
+    if args[0] == "build":
+        root = positional[0] if positional else library
+        if not root:
+            print("Error: No directory specified.")
+            print(USAGE)
+            print("Or set MUSIC_LIBRARY_DIR in your .env file")
+            sys.exit(1)
+        root = os.path.abspath(os.path.expanduser(root))
+        if not os.path.isdir(root):
+            print(f"Root does not exist or is not a directory: {root}")
+            sys.exit(1)
+        index = LookupIndex(index_path(root))
+        try:
+            added, removed = index.refresh(root, full="--full" in args)
+            print(f"Lookup index: {len(index)} tracks ({added} new or changed, {removed} removed)")
+            emit("done", tracks=len(index), indexed=added, removed=removed)
+        finally:
+            index.close()
+        return
+
+    if not positional:
+        print(USAGE)
+        sys.exit(1)
+    try:
+        min_score = int(arg_value("--min-score", str(DEFAULT_MIN_SCORE)))
+    except ValueError:
+        print("--min-score expects a number from 0 to 100")
+        sys.exit(1)
+    root = os.path.abspath(os.path.expanduser(library)) if library else None
+    db_path = index_path(root)
+    if not db_path:
+        print("Error: pass --index FILE or set MUSIC_LIBRARY_DIR in your .env file")
+        sys.exit(1)
+    refresh = "--refresh" in args
+    if not refresh and not os.path.exists(db_path):
+        print(f"Error: no lookup index at {db_path}; run `lookup_tracks.py build` first (or pass --refresh)")
+        sys.exit(3)
+    try:
+        with open(os.path.expanduser(positional[0]), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    index = LookupIndex(db_path)
+    try:
+        if refresh:
+            if not root or not os.path.isdir(root):
+                print("Error: --refresh needs MUSIC_LIBRARY_DIR to point at the library")
+                sys.exit(1)
+            added, removed = index.refresh(root)
+            if added or removed:
+                print(f"Lookup index: {added} new or changed, {removed} removed")
+        print(f"Lookup index: {len(index)} tracks, opened in {1000 * (time.perf_counter() - t0):.0f} ms\n")
+        check(index, lines, min_score, arg_value("--missing-out"), exact_only="--exact-only" in args)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,19 @@ import os
 import re
 import sys
 import shlex
+from array import array
 from typing import Tuple, Optional
 from mutagen import File as MutagenFile
 from pathlib import Path
 
+from dir_fds import DirFds
+from dir_locks import lock_dir, rename_unique
+from events import emit, setup_from_argv
+from fast_tags import read_fast_tags
+from plan_file import apply_from_argv, plan_from_argv
+from records import FileTable, group_rows
+import tag_writer
+
 # Load .env file if available
 try:
     from dotenv import load_dotenv
@@ -40,29 +49,18 @@ def sanitize_filename_component(s: str) -> str:
 
 
 def read_artist_title(path: str) -> Tuple[str, str]:
-    """Best-effort to read artist/title across MP3/AIFF/WAV using mutagen.
+    """Best-effort to read artist/title across MP3/AIFF/WAV.
+    Uses the native tag reader first, then a single raw mutagen parse.
     Returns (artist, title) or ('','') if not found.
     """
     artist, title = "", ""
 
-    try:
-        audio_easy = MutagenFile(path, easy=True)
-    except Exception:
-        audio_easy = None
-
-    if audio_easy and getattr(audio_easy, "tags", None):
-        # Easy tags provide 'artist' and 'title' for many formats
-        if not artist:
-            a = audio_easy.tags.get("artist") if hasattr(audio_easy.tags, "get") else None
-            if a:
-                artist = norm_ws(", ".join(a))
-        if not title:
-            t = audio_easy.tags.get("title") if hasattr(audio_easy.tags, "get") else None
-            if t:
-                title = norm_ws(", ".join(t))
-
-    if artist and title:
-        return artist, title
+    fast = read_fast_tags(path)
+    if fast is not None:
+        artist = norm_ws(", ".join(fast.get("artist", [])))
+        title = norm_ws(", ".join(fast.get("title", [])))
+        if artist and title:
+            return artist, title
 
     # Fallback to raw tags (e.g., ID3 in MP3/AIFF/WAV, or RIFF INFO in WAV)
     try:
@@ -104,20 +102,48 @@ def read_artist_title(path: str) -> Tuple[str, str]:
     return artist, title
 
 
-def ensure_unique_name(dirpath: str, name: str) -> str:
+def ensure_unique_name(dirpath: str, name: str, taken: set | None = None, fs: DirFds | None = None) -> str:
+    # `taken` holds destinations already claimed by this run (dry runs/plans)
+    exists = fs.exists if fs is not None else os.path.exists
     base, ext = os.path.splitext(name)
     candidate = name
     n = 1
-    while os.path.exists(os.path.join(dirpath, candidate)):
+    while exists(os.path.join(dirpath, candidate)) or (taken and os.path.join(dirpath, candidate) in taken):
         candidate = f"{base} ({n}){ext}"
         n += 1
     return candidate
 
 
-def compute_target_name(path: str) -> Optional[str]:
+def tags_from_filename(fname: str) -> Tuple[str, str]:
+    """("Artist", "Title") from "Artist - Title (2).aiff", or ('','')."""
+    stem = re.sub(r"\s*\(\d+\)$", "", os.path.splitext(fname)[0])
+    artist, sep, title = stem.partition(" - ")
+    if not sep:
+        return "", ""
+    return norm_ws(artist), norm_ws(title)
+
+
+def sync_tags(path: str, dry_run: bool = False) -> Tuple[str, str, Optional[str]]:
+    """Fill a missing artist/title tag on AIFF/WAV from the filename.
+    Returns (artist, title, write mode or None when nothing was written)."""
+    artist, title = read_artist_title(path)
+    if (artist and title) or os.path.splitext(path)[1].lower() not in tag_writer.EXTENSIONS:
+        return artist, title, None
+    name_artist, name_title = tags_from_filename(os.path.basename(path))
+    updates = {}
+    if not artist and name_artist:
+        updates["artist"] = artist = name_artist
+    if not title and name_title:
+        updates["title"] = title = name_title
+    if not updates:
+        return artist, title, None
+    return artist, title, tag_writer.set_tags(path, updates, dry_run=dry_run)
+
+
+def compute_target_name(path: str, tags: Optional[Tuple[str, str]] = None) -> Optional[str]:
     dirpath, fname = os.path.split(path)
     ext = os.path.splitext(fname)[1]
-    artist, title = read_artist_title(path)
+    artist, title = tags if tags is not None else read_artist_title(path)
 
     if not title:
         return None
@@ -134,6 +160,11 @@ def compute_target_name(path: str) -> Optional[str]:
 
 
 def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("normalize_filenames")
+    # --apply FILE executes a saved plan without rescanning or re-reading tags
+    apply_from_argv("normalize_filenames")
+
     # Get directory from command line or environment variable
     if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
         root = sys.argv[1]
@@ -141,62 +172,106 @@ def main():
         root = os.environ.get("MUSIC_LIBRARY_DIR")
         if not root:
             print("Error: No directory specified.")
-            print("Usage: python3 normalize_filenames.py <directory> [--dry-run|-n]")
+            print("Usage: python3 normalize_filenames.py <directory> [--dry-run|-n] [--sync-tags] [--plan-out FILE | --apply FILE] [--format text|ndjson]")
             print("Or set MUSIC_LIBRARY_DIR in your .env file")
             sys.exit(1)
 
     root = os.path.expanduser(root)
     dry_run = "--dry-run" in sys.argv or "-n" in sys.argv
+    plan, plan_out = plan_from_argv("normalize_filenames", root)
+    # --sync-tags fills a missing AIFF/WAV artist/title from "Artist - Title" filenames
+    sync = "--sync-tags" in sys.argv
+    if sync and plan is not None:
+        print("Note: tag writes are not recorded in plans; --sync-tags only previews them with --plan-out")
 
     if not os.path.isdir(root):
         print(f"Root does not exist or is not a directory: {root}")
         sys.exit(1)
 
     # Process only files at root level (assuming flattened). If you want recursive, change to os.walk.
-    entries = [os.path.join(root, f) for f in os.listdir(root)]
-    files = [p for p in entries if os.path.isfile(p) and is_audio(p)]
-
-    # Precompute targets and collect duplicates
-    targets: dict[str, list[str]] = {}
-    planned: list[tuple[str, str]] = []  # (src, target_name)
+    table = FileTable()
+    with os.scandir(root) as it:
+        for entry in sorted(it, key=lambda e: e.name):
+            if is_audio(entry.name) and entry.is_file():
+                table.add_entry(root, entry.name, entry.stat())
+
+    # Precompute targets (interned in the table's string pool) and collect duplicates
+    planned: list[int] = []  # rows with a target name
+    target_id = array("I", [0]) * len(table)
+    target_key = array("I", [0]) * len(table)  # case-insensitive target, for duplicate grouping
     skipped: list[str] = []
 
-    for p in sorted(files):
-        target = compute_target_name(p)
+    for row in table.rows():
+        p = table.path(row)
+        tags = None
+        if sync:
+            try:
+                artist, title, mode = sync_tags(p, dry_run=dry_run or plan is not None)
+            except Exception as e:  # noqa: BLE001 - mutagen raises its own error types
+                print(f"[SKIP] Tag sync failed: {p} ({e})")
+                emit("error", path=p, message=f"tag sync failed: {e}")
+            else:
+                tags = (artist, title)
+                if mode is not None:
+                    applied = not (dry_run or plan is not None)
+                    print(f"{'' if applied else 'DRY: '}tag {p} [{mode}] artist={artist!r}, title={title!r}")
+                    emit("op", op="tag", src=p, mode=mode, status="applied" if applied else "dry_run")
+        target = compute_target_name(p, tags)
+        emit("scanned", path=p, size=table.size[row], target=target)
         if not target:
             print(f"[SKIP] Missing/invalid tags: {p}")
+            emit("error", path=p, message="missing/invalid tags")
             skipped.append(p)
             continue
-        planned.append((p, target))
-        targets.setdefault(target.lower(), []).append(p)
+        planned.append(row)
+        target_id[row] = table.strings.intern(target)
+        target_key[row] = table.strings.intern(target.lower())
 
     # Perform renames, resolving collisions with (n) suffixes
-    for src, target in planned:
-        dirpath, fname = os.path.split(src)
-        if fname == target:
-            continue
-        final_name = ensure_unique_name(dirpath, target)
-        dst = os.path.join(dirpath, final_name)
-        if dry_run:
-            print(f"DRY: rename {src} -> {dst}")
-        else:
-            os.replace(src, dst)
-            print(f"rename {src} -> {dst}")
+    taken: set = set()
+    # Renames and existence checks run relative to the open root directory
+    with DirFds() as fs:
+        for row in planned:
+            src = table.path(row)
+            dirpath, fname = table.dirname(row), table.name(row)
+            target = table.strings.get(target_id[row])
+            if fname == target:
+                continue
+            final_name = ensure_unique_name(dirpath, target, taken, fs)
+            dst = os.path.join(dirpath, final_name)
+            taken.add(dst)
+            if plan is not None:
+                plan.add("rename", src, dst)
+                print(f"PLAN: rename {src} -> {dst}")
+            elif dry_run:
+                print(f"DRY: rename {src} -> {dst}")
+                emit("op", op="rename", src=src, dst=dst, status="dry_run")
+            else:
+                # Re-checked under the folder lock: a concurrent run may have taken the name
+                taken.discard(dst)
+                with lock_dir(dirpath):
+                    dst = rename_unique(src, dirpath, target, lambda d, n: ensure_unique_name(d, n, taken, fs), fs)
+                taken.add(dst)
+                print(f"rename {src} -> {dst}")
+                emit("op", op="rename", src=src, dst=dst, status="applied")
+
+        # Rescan root after any renames to compute filename-based duplicates
+        with fs.scandir(root) as it:
+            files_after = [os.path.join(root, e.name) for e in it if is_audio(e.name) and e.is_file()]
 
     # Summary: list duplicates (same computed target)
-    dupes = {k: v for k, v in targets.items() if len(v) > 1}
+    dupes = list(group_rows(planned, target_key.__getitem__))
     if dupes:
         print("\nDuplicates (same intended filename before suffixes):")
-        for k, paths in dupes.items():
+        for rows in dupes:
             # Show canonical name without lowercasing for readability
-            example = next((t for (_, t) in planned if t.lower() == k), k)
-            print(f"  {example}")
-            for p in paths:
-                print(f"    - {p}")
+            print(f"  {table.strings.get(target_id[rows[0]])}")
+            for row in rows:
+                print(f"    - {table.path(row)}")
+            emit("group", kind="tags", key=table.strings.get(target_id[rows[0]]), paths=[table.path(r) for r in rows])
     else:
         print("\nNo duplicates based on tags.")
 
-    # Rescan root after any renames to compute filename-based duplicates
     def base_without_suffix(name: str) -> Tuple[str, str]:
         base, ext = os.path.splitext(name)
         m = re.match(r"^(.*) \((\d+)\)$", base)
@@ -204,8 +279,6 @@ def main():
             return m.group(1), ext.lower()
         return base, ext.lower()
 
-    entries_after = [os.path.join(root, f) for f in os.listdir(root)]
-    files_after = [p for p in entries_after if os.path.isfile(p) and is_audio(p)]
     groups: dict[Tuple[str, str], list[str]] = {}
     for p in files_after:
         base, ext = base_without_suffix(os.path.basename(p))
@@ -223,13 +296,16 @@ def main():
                 m = re.match(r"^(.*) \((\d+)\)$", name)
                 return (0, 0) if not m else (1, int(m.group(2)))
 
-            for p in sorted(paths, key=sort_key):
+            ordered = sorted(paths, key=sort_key)
+            for p in ordered:
                 print(f"    - {p}")
+            emit("group", kind="suffix", key=f"{base}{ext}", paths=ordered)
             # Mark any with (n) for deletion
             for p in paths:
                 name = os.path.splitext(os.path.basename(p))[0]
                 if re.match(r"^(.*) \((\d+)\)$", name):
                     to_delete.append(p)
+                    emit("op", op="rm", src=p, status="suggested")
 
         if to_delete:
             quoted = " ".join(shlex.quote(p) for p in sorted(to_delete))
@@ -240,7 +316,12 @@ def main():
     else:
         print("\nNo filename-based duplicates found.")
 
-    if dry_run:
+    emit("done", scanned=len(table), renamable=len(planned), skipped=len(skipped),
+         tag_groups=len(dupes), suffix_groups=len(suffix_dupes))
+    if plan is not None:
+        plan.save(plan_out)
+        print("(plan only: no changes made)")
+    elif dry_run:
         print("\n(dry run: no changes made)")
 
 
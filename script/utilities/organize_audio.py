@@ -4,9 +4,11 @@ Organize dropped audio files by Artist/Title based on metadata.
 Works as a CLI for Automator's "Run Shell Script".
 
 Features
-- Accepts files and/or folders (recurses directories)
+- Accepts files and/or folders (recurses directories) and .zip archives, whose
+  audio members are read and written straight to their destination
 - Supports common audio formats (mp3, m4a/aac, wav, aiff, flac, ogg, opus)
-- Extracts Artist/Title via mutagen when available, falls back to mdls, then filename
+- Extracts Artist/Title with a native tag reader (artwork is never loaded), then
+  a single mutagen parse when available, then mdls, then filename
 - Moves (default) or copies files, with --dry-run support
 - Skips duplicates by default; logs and can notify
  - On duplicates, renames the original file to prefix with "[DUPLICATE] " (default behavior)
@@ -28,11 +30,12 @@ from __future__ import annotations
 import argparse
 import os
 import re
-import shutil
 import subprocess
 import sys
+import zipfile
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Iterable, Optional, Tuple, Any
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple, Any
 
 # Load .env file if available
 try:
@@ -42,6 +45,17 @@ try:
 except ImportError:
     pass
 
+import events
+from cache_store import cache_path
+from dir_locks import lock_dir, part_path, rename_noreplace, rename_unique, reserve_name, reserved
+from events import emit
+from fast_tags import first_text, read_fast_tags
+from io_throttle import copy_file, parse_rate
+import io_throttle
+import io_tuning
+from plan_file import Plan, apply_plan, load_plan
+from zip_input import DEFAULT_MEMORY, Extractor, ZipMember, is_zip, iter_members, read_member_tags, workers_for
+
 # Try mutagen if available for robust multi-format tagging
 try:
     from mutagen import File as MFile  # type: ignore
@@ -71,7 +85,9 @@ def is_audio_file(path: Path) -> bool:
     return path.is_file() and path.suffix.lower() in SUPPORTED_EXTS
 
 
-def iter_audio_files(inputs: Iterable[Path]) -> Iterable[Path]:
+def iter_audio_files(inputs: Iterable[Path]) -> Iterable[Path | ZipMember]:
+    """Audio files in the inputs; a .zip input yields its audio members as
+    ZipMember instead of being unpacked."""
     for p in inputs:
         if p.is_dir():
             for root, _dirs, files in os.walk(p):
@@ -79,6 +95,12 @@ def iter_audio_files(inputs: Iterable[Path]) -> Iterable[Path]:
                     fp = Path(root) / name
                     if is_audio_file(fp):
                         yield fp
+        elif is_zip(p):
+            try:
+                yield from iter_members(p, SUPPORTED_EXTS)
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"ERROR reading archive {p}: {e}", file=sys.stderr)
+                emit("error", path=str(p), message=str(e))
         elif is_audio_file(p):
             yield p
 
@@ -97,34 +119,22 @@ def _first_str(value) -> Optional[str]:
     return None
 
 
-def _from_easy_tags(m: Any) -> Tuple[Optional[str], Optional[str]]:
-    tags = getattr(m, "tags", None)
-    if not tags:
-        return None, None
-    artist = (
-        _first_str(tags.get("artist"))
-        or _first_str(tags.get("albumartist"))
-        or _first_str(tags.get("composer"))
-        or _first_str(tags.get("artists"))
-    )
-    title = _first_str(tags.get("title"))
-    return artist, title
-
-
 def _from_raw_tags(m: Any) -> Tuple[Optional[str], Optional[str]]:
     tags = getattr(m, "tags", None)
     if not tags:
         return None, None
-    # MP4/ALAC keys
+    # MP4/ALAC keys, best first: the album artist (aART) is only a fallback,
+    # or compilation tracks would all be filed under "Various Artists"
     try:
-        artist = None
-        title = None
-        for key in ("\u00a9ART", "aART", "ART", "artist"):
-            if key in tags:
-                artist = _first_str(tags.get(key)) or artist
-        for key in ("\u00a9nam", "nam", "title"):
-            if key in tags:
-                title = _first_str(tags.get(key)) or title
+        def _first_of(keys: Tuple[str, ...]) -> Optional[str]:
+            for key in keys:
+                value = _first_str(tags.get(key)) if key in tags else None
+                if value:
+                    return value
+            return None
+
+        artist = _first_of(("\u00a9ART", "ART", "artist", "aART"))
+        title = _first_of(("\u00a9nam", "nam", "title"))
         if artist or title:
             return artist, title
     except Exception:
@@ -167,20 +177,23 @@ def _from_raw_tags(m: Any) -> Tuple[Optional[str], Optional[str]]:
 
 
 def get_tags_with_mutagen(path: Path) -> Tuple[Optional[str], Optional[str]]:
+    # Native reader first: touches only the tag region and skips artwork frames
+    fast = read_fast_tags(path)
+    if fast is not None:
+        artist = first_text(fast, "artist", "albumartist", "composer")
+        title = first_text(fast, "title")
+        if artist or title:
+            return artist, title
     if MFile is None:
         return None, None
+    # Single raw parse; _from_raw_tags covers MP4, ID3 and Vorbis keys
     try:
-        m_easy = MFile(str(path), easy=True)
-        if m_easy:
-            artist, title = _from_easy_tags(m_easy)
-            if artist or title:
-                return artist, title
         m_raw = MFile(str(path))
         if m_raw:
-            artist, title = _from_raw_tags(m_raw)
-            return artist, title
+            return _from_raw_tags(m_raw)
     except Exception:
-        return None, None
+        pass
+    return None, None
 
 
 def parse_mdls_raw(output: str) -> Optional[str]:
@@ -277,22 +290,45 @@ def sanitize_component(name: str) -> str:
     return name or "Unknown"
 
 
-def safe_unique_path(dest: Path) -> Path:
-    if not dest.exists():
+def safe_unique_path(dest: Path, claimed: Optional[set] = None) -> Path:
+    # `claimed` holds destinations already taken by this run (dry runs/plans);
+    # reserved names are being written by a concurrent run
+    def taken(p: Path) -> bool:
+        return p.exists() or (claimed is not None and str(p) in claimed) or reserved(p)
+
+    if not taken(dest):
         return dest
     base = dest.with_suffix("")
     ext = dest.suffix
     i = 1
     while True:
         candidate = Path(f"{base} ({i}){ext}")
-        if not candidate.exists():
+        if not taken(candidate):
             return candidate
         i += 1
 
 
-def extract_artist_title(path: Path) -> Tuple[str, str]:
-    artist, title = get_tags_with_mutagen(path)
-    if not artist or not title:
+def get_member_tags(member: ZipMember) -> Tuple[Optional[str], Optional[str], Optional[float]]:
+    """Artist, title and length in seconds, streamed from the archive."""
+    fast, raw = read_member_tags(member, MFile)
+    if fast is not None:
+        length = fast.get("length")
+        return first_text(fast, "artist", "albumartist", "composer"), first_text(fast, "title"), length
+    if raw:
+        artist, title = _from_raw_tags(raw)
+        return artist, title, getattr(getattr(raw, "info", None), "length", None)
+    return None, None, None
+
+
+def extract_artist_title(path: Path | ZipMember, member_tags: Optional[tuple] = None) -> Tuple[str, str]:
+    """`member_tags`: get_member_tags() of a ZipMember when already read."""
+    if isinstance(path, ZipMember):
+        # Spotlight knows nothing about archive members
+        artist, title, _length = member_tags or get_member_tags(path)
+        path = path.path
+    else:
+        artist, title = get_tags_with_mutagen(path)
+    if (not artist or not title) and path.exists():
         a2, t2 = get_tags_with_mdls(path)
         artist = artist or a2
         title = title or t2
@@ -307,20 +343,100 @@ def extract_artist_title(path: Path) -> Tuple[str, str]:
     return sanitize_component(artist or "Unknown Artist"), sanitize_component(title or "Unknown Title")
 
 
-def move_or_copy(src: Path, dest: Path, mode: str, dry_run: bool) -> Path:
+def move_or_copy(
+    src: Path,
+    dest: Path,
+    mode: str,
+    dry_run: bool,
+    plan: Optional[Plan] = None,
+    claimed: Optional[set] = None,
+    reserved: Optional[Path] = None,
+) -> Path:
+    """`reserved` is a name the caller holds with reserve_name() (see
+    dir_locks); without it a free name is reserved here."""
+    if plan is not None:
+        dest_final = safe_unique_path(dest, claimed)
+        plan.add(mode, str(src), str(dest_final))
+        print(f"[PLAN] {'COPY' if mode == 'copy' else 'MOVE'}: {src} -> {dest_final}")
+        return dest_final
     dest.parent.mkdir(parents=True, exist_ok=True)
-    dest_final = safe_unique_path(dest)
     if dry_run:
+        dest_final = safe_unique_path(dest, claimed)
         action = "COPY" if mode == "copy" else "MOVE"
         print(f"[DRY] {action}: {src} -> {dest_final}")
+        emit("op", op=mode, src=str(src), dst=str(dest_final), status="dry_run")
         return dest_final
-    if mode == "copy":
-        shutil.copy2(src, dest_final)
+    if reserved is not None:
+        dest_final = land(src, reserved, mode, claimed)
+    else:
+        with lock_dir(dest.parent):
+            dest_final = safe_unique_path(dest, claimed)
+            reservation = reserve_name(dest_final)
+        try:
+            dest_final = land(src, dest_final, mode, claimed)
+        finally:
+            with lock_dir(dest.parent):
+                reservation.release()
+    emit("op", op=mode, src=str(src), dst=str(dest_final), status="applied")
+    return dest_final
+
+
+def land(src: Path, dest: Path, mode: str, claimed: Optional[set] = None) -> Path:
+    """Put src at the reserved name dest. Copies (and moves across volumes)
+    are written to a hidden `.part` sibling first, so dest only ever holds
+    a complete file; if a program that takes no lock has created dest in
+    the meantime, the next free name is used. Returns the final path."""
+    part = Path(part_path(dest))
+    if mode == "move" and os.stat(src).st_dev == os.stat(dest.parent).st_dev:
+        tmp = src
     else:
-        shutil.move(src, dest_final)
+        tmp = part
+    try:
+        if tmp == part:
+            copy_file(str(src), str(part))
+        with lock_dir(dest.parent):
+            try:
+                rename_noreplace(str(tmp), str(dest))
+            except FileExistsError:
+                dest = Path(rename_unique(str(tmp), str(dest.parent), dest.name,
+                                          lambda d, n: safe_unique_path(Path(d) / n, claimed).name))
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    if mode == "move" and tmp == part:
+        os.unlink(src)
+    return dest
+
+
+def extract_or_plan(
+    member: ZipMember, dest: Path, dry_run: bool, plan: Optional[Plan] = None, claimed: Optional[set] = None
+) -> Path:
+    """move_or_copy() for an archive member under --plan-out or --dry-run;
+    real extractions are queued on iter_organize()'s Extractor."""
+    dest_final = safe_unique_path(dest, claimed)
+    if plan is not None:
+        plan.add("extract", str(member.archive), str(dest_final), member=member.name)
+        print(f"[PLAN] EXTRACT: {member} -> {dest_final}")
+        return dest_final
+    print(f"[DRY] EXTRACT: {member} -> {dest_final}")
+    emit("op", op="extract", src=str(member.archive), member=member.name, dst=str(dest_final), status="dry_run")
     return dest_final
 
 
+def member_identity(member: ZipMember, member_tags: tuple) -> Any:
+    """library_index.Identity of an archive member from its tags alone. The
+    digest is left empty, so only the artist/title/duration lookup matches."""
+    from find_duplicates import infer_from_filename, norm
+    from library_index import Identity
+
+    artist, title, length = member_tags
+    if not artist or not title:
+        inf_artist, inf_title = infer_from_filename(str(member.path))
+        artist = artist or inf_artist
+        title = title or inf_title
+    return Identity(b"", norm(artist or ""), norm(title or ""), int(length) if length else None)
+
+
 def notify(message: str, title: str = "Audio Organizer") -> None:
     try:
         subprocess.run(
@@ -348,9 +464,10 @@ def write_log(line: str, log_path: Optional[Path]) -> None:
         pass
 
 
-def prepend_duplicate_flag(src: Path, dry_run: bool) -> Path:
+def prepend_duplicate_flag(src: Path, dry_run: bool, plan: Optional[Plan] = None) -> Path:
     """Rename the original file to start with "[DUPLICATE] ".
     Ensures uniqueness if the target name already exists.
+    With a plan, the rename is recorded instead of performed.
     Returns the intended/final new path.
     """
     try:
@@ -360,21 +477,42 @@ def prepend_duplicate_flag(src: Path, dry_run: bool) -> Path:
         if name.startswith("[DUPLICATE]"):
             return src
         candidate = src.with_name(f"[DUPLICATE] {name}")
-        if candidate.exists():
-            i = 1
-            while candidate.exists():
-                candidate = src.with_name(f"[DUPLICATE] ({i}) {name}")
-                i += 1
+        i = 1
+        while candidate.exists():
+            candidate = src.with_name(f"[DUPLICATE] ({i}) {name}")
+            i += 1
+        if plan is not None:
+            plan.add("rename", str(src), str(candidate))
+            print(f"[PLAN] RENAME: {src} -> {candidate}")
+            return candidate
         if dry_run:
             print(f"[DRY] RENAME: {src} -> {candidate}")
+            emit("op", op="rename", src=str(src), dst=str(candidate), status="dry_run")
             return candidate
-        src.rename(candidate)
+        # No-clobber rename; a name taken meanwhile moves on to the next one
+        while True:
+            try:
+                rename_noreplace(str(src), str(candidate))
+                break
+            except FileExistsError:
+                candidate = src.with_name(f"[DUPLICATE] ({i}) {name}")
+                i += 1
+        emit("op", op="rename", src=str(src), dst=str(candidate), status="applied")
         return candidate
     except Exception:
         return src
 
 
-def organize(
+class Organized(NamedTuple):
+    """What became of one input file."""
+    src: str
+    dst: Optional[str]
+    op: Optional[str]  # move/copy/extract, "rename" for a [DUPLICATE] mark, None when skipped or failed
+    status: str  # applied, dry_run, planned, skipped or error
+    reason: Optional[str]  # duplicate reason (name, content, tags, have-*) or the error message
+
+
+def iter_organize(
     paths: Iterable[Path],
     dest_root: Path,
     mode: str,
@@ -382,52 +520,209 @@ def organize(
     on_duplicate: str,
     do_notify: bool,
     log_path: Optional[Path],
-) -> int:
-    count = 0
-    for src in iter_audio_files(paths):
-        try:
-            artist, title = extract_artist_title(src)
-            dest = dest_root / artist / f"{title}{src.suffix.lower()}"
-            if dest.exists():
-                msg = f"Duplicate found: {src} -> {dest}"
-                print(msg)
-                write_log(msg, log_path)
-                if do_notify:
-                    notify(f"Duplicate: {artist} / {title}")
-                if on_duplicate == "overwrite":
-                    final_path = move_or_copy(src, dest, mode, dry_run)
-                    print(f"OVERWRITE: {src} -> {final_path}")
-                    write_log(f"Overwrote existing: {final_path}", log_path)
-                    count += 1
-                elif on_duplicate == "unique":
-                    final_path = move_or_copy(src, dest, mode, dry_run)
-                    print(f"RENAMED: {src} -> {final_path}")
-                    write_log(f"Renamed due to duplicate: {final_path}", log_path)
-                    count += 1
-                else:
-                    dup_path = prepend_duplicate_flag(src, dry_run)
-                    info = f"Marked original as duplicate: {src} -> {dup_path}"
-                    print(info)
-                    write_log(info, log_path)
-                    continue
+    plan: Optional[Plan] = None,
+    index: Any = None,
+    have: Any = None,
+    extract_workers: int = 1,
+) -> Iterator[Organized]:
+    """Yields an Organized record per input as it is decided (archive
+    members once their extraction has finished).
+    Archive members (see zip_input) go straight to their destination,
+    `extract_workers` at a time; `mode` does not apply to them, the archive
+    is never changed.
+    With a LibraryIndex (see library_index), a file is also a duplicate
+    when the library already holds the same payload or the same normalized
+    artist/title/duration under any name; the index learns each file that
+    lands so later inputs in the run are checked against it too.
+    With a have_filter.FilterSet, a file whose payload hash another machine
+    probably already has is a duplicate as well; an artist/title-only hit
+    is reported and the file is organized as usual."""
+    if index is not None:
+        from library_index import identify
+    status = "planned" if plan is not None else "dry_run" if dry_run else "applied"
+    # Destinations claimed by earlier files in this run; lets dry runs and
+    # plans see collisions that only exist once earlier moves are applied
+    claimed: set = set()
+    live = plan is None and not dry_run
+
+    def record(src: Path | ZipMember, final_path: Path, ident: Any, digest: Optional[bytes]) -> None:
+        if index is None:
+            return
+        # Dry runs and plans record it too; main() discards those rows
+        if isinstance(src, ZipMember):
+            if final_path.exists():
+                st = final_path.stat()
+                ident = identify(str(final_path), st.st_size)
+                index.add(os.path.abspath(final_path), st.st_size, st.st_mtime_ns, ident)
             else:
-                final_path = move_or_copy(src, dest, mode, dry_run)
-                print(f"OK: {src} -> {final_path}")
-                write_log(f"OK: {src} -> {final_path}", log_path)
-                count += 1
-        except Exception as e:
-            err = f"ERROR processing {src}: {e}"
-            print(err, file=sys.stderr)
-            write_log(err, log_path)
-    return count
+                index.add(os.path.abspath(final_path), src.size, 0, ident)
+            return
+        if mode == "move":
+            index.remove(os.path.abspath(src))
+        landed = final_path if final_path.exists() else src
+        st = landed.stat()
+        ident = ident or identify(str(landed), st.st_size, digest)
+        index.add(os.path.abspath(final_path), st.st_size, st.st_mtime_ns, ident)
+
+    def failed(src: Path | ZipMember, e: BaseException) -> Organized:
+        err = f"ERROR processing {src}: {e}"
+        print(err, file=sys.stderr)
+        emit("error", path=str(src), message=str(e))
+        write_log(err, log_path)
+        return Organized(str(src), None, None, "error", str(e))
+
+    def extracted(done: list) -> Iterator[Organized]:
+        # Bookkeeping for archive members whose extraction has finished
+        for (member, final_path, line, log_line, ident, reason, reservation), err in done:
+            with lock_dir(final_path.parent):
+                reservation.release()
+            if err is not None:
+                yield failed(member, err)
+                continue
+            emit("op", op="extract", src=str(member.archive), member=member.name, dst=str(final_path), status="applied")
+            print(line)
+            write_log(log_line, log_path)
+            try:
+                record(member, final_path, ident, None)
+            except Exception as e:
+                yield failed(member, e)
+            yield Organized(str(member), str(final_path), "extract", "applied", reason)
+
+    # Archive members are written by a bounded pool while later inputs are
+    # examined; duplicate checks have all run before a member is queued
+    with Extractor(extract_workers) as extractor:
+        for src in iter_audio_files(paths):
+            member = src if isinstance(src, ZipMember) else None
+            try:
+                member_tags = get_member_tags(member) if member is not None else None
+                artist, title = extract_artist_title(src, member_tags)
+                dest = dest_root / artist / f"{title}{src.suffix.lower()}"
+                emit("scanned", path=str(src), artist=artist, title=title)
+                ident = None
+                digest = None
+                hit = None
+                hashed = False
+                if member is None and (have is not None or index is not None) and not (dest.exists() or str(dest) in claimed):
+                    # Hash before taking the folder lock, so drops into the
+                    # same folder do not wait on each other's reads
+                    if have is not None:
+                        hit, digest = have.check(str(src))
+                    if index is not None and hit != "content":
+                        ident = identify(str(src), digest=digest)
+                    hashed = True
+                # Concurrent runs landing in the same folder decide one at a
+                # time; the chosen name is reserved before the lock is released
+                reservation = None
+                with lock_dir(dest.parent) if live else nullcontext():
+                    taken = dest.exists() or str(dest) in claimed or reserved(dest)
+                    existing, reason = (dest, "name") if taken else (None, None)
+                    if reason is None and member is not None and (have is not None or index is not None):
+                        # Members are matched on artist/title only; hashing them
+                        # would mean decompressing each one twice
+                        ident = member_identity(member, member_tags)
+                    if reason is None and have is not None:
+                        # Only a payload-hash hit is acted on; an artist/title
+                        # hit may be another mix or a filter false positive,
+                        # so it is reported and the file is organized anyway
+                        if member is not None:
+                            hit = "tags" if ident.title and have.has_track(ident.artist, ident.title) else None
+                        elif not hashed:
+                            hit, digest = have.check(str(src))
+                        if hit == "content":
+                            reason = "have-content"
+                        elif hit == "tags":
+                            info = f"Probably in a --have library (same artist/title), organizing anyway: {src}"
+                            print(info)
+                            write_log(info, log_path)
+                            emit("group", kind="have", key=None, paths=[str(src)], action="reported", reason="have-tags")
+                    if reason is None and index is not None:
+                        if member is None and ident is None:
+                            ident = identify(str(src), digest=digest)
+                        match = index.find(ident, exclude=os.path.abspath(src) if member is None else None)
+                        if match is not None:
+                            existing, reason = Path(match.path), match.reason
+                    if reason is not None:
+                        if reason == "have-content":
+                            msg = f"Duplicate found: {src} (same audio probably in a --have library)"
+                        else:
+                            msg = f"Duplicate found: {src} -> {existing}"
+                        if reason in ("content", "tags"):
+                            msg += f" (same {'audio' if reason == 'content' else 'artist/title/duration'} in library)"
+                        print(msg)
+                        kind = "destination" if reason == "name" else "have" if reason.startswith("have-") else "library"
+                        emit("group", kind=kind, key=str(existing) if existing else None,
+                             paths=[str(existing), str(src)] if existing else [str(src)], action=on_duplicate, reason=reason)
+                        write_log(msg, log_path)
+                        if do_notify:
+                            notify(f"Duplicate: {artist} / {title}")
+                        if on_duplicate == "overwrite":
+                            line, log_line = "OVERWRITE: {src} -> {dst}", "Overwrote existing: {dst}"
+                        elif on_duplicate == "unique":
+                            line, log_line = "RENAMED: {src} -> {dst}", "Renamed due to duplicate: {dst}"
+                        elif member is not None:
+                            # The archive is left as it is; nothing to mark
+                            info = f"Skipped duplicate archive member: {src}"
+                            print(info)
+                            write_log(info, log_path)
+                            yield Organized(str(src), str(existing) if existing else None, None, "skipped", reason)
+                            continue
+                        else:
+                            dup_path = prepend_duplicate_flag(src, dry_run, plan)
+                            info = f"Marked original as duplicate: {src} -> {dup_path}"
+                            print(info)
+                            write_log(info, log_path)
+                            yield Organized(str(src), str(dup_path), "rename", status, reason)
+                            continue
+                    else:
+                        line, log_line = "OK: {src} -> {dst}", "OK: {src} -> {dst}"
+                    if live:
+                        dest.parent.mkdir(parents=True, exist_ok=True)
+                        final_path = safe_unique_path(dest, claimed)
+                        reservation = reserve_name(final_path)
+                        claimed.add(str(final_path))
+                if member is not None and live:
+                    # extract_member() writes a hidden .part and links it in
+                    # without replacing; the reservation ends in extracted()
+                    context = (member, final_path, line.format(src=src, dst=final_path),
+                               log_line.format(src=src, dst=final_path), ident, reason, reservation)
+                    yield from extracted(extractor.submit(member, str(final_path), False, context))
+                    continue
+                if member is not None:
+                    final_path = extract_or_plan(member, dest, dry_run, plan, claimed)
+                elif live:
+                    try:
+                        final_path = move_or_copy(src, dest, mode, dry_run, plan, claimed, final_path)
+                    finally:
+                        with lock_dir(dest.parent):
+                            reservation.release()
+                else:
+                    final_path = move_or_copy(src, dest, mode, dry_run, plan, claimed)
+                print(line.format(src=src, dst=final_path))
+                write_log(log_line.format(src=src, dst=final_path), log_path)
+                claimed.add(str(final_path))
+                try:
+                    record(src, final_path, ident, digest)
+                except Exception as e:
+                    # The file has landed; only the index missed it
+                    yield failed(src, e)
+                yield Organized(str(src), str(final_path), "extract" if member is not None else mode, status, reason)
+            except Exception as e:
+                yield failed(src, e)
+        yield from extracted(extractor.drain())
+
+
+def organize(*args: Any, **kwargs: Any) -> int:
+    """iter_organize() run to the end; returns the number of files
+    organized (moved, copied or extracted, or planned to be)."""
+    return sum(1 for r in iter_organize(*args, **kwargs) if r.op in ("move", "copy", "extract"))
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Organize audio files into Artist/Title structure")
     p.add_argument(
         "inputs",
-        nargs="+",
-        help="Files or folders to process",
+        nargs="*",
+        help="Files, folders or .zip archives to process",
         type=Path,
     )
     p.add_argument(
@@ -466,20 +761,129 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         default=Path("~/Library/Logs/organize_audio.log"),
         help="Path to log file (default: %(default)s)",
     )
-    return p.parse_args(argv)
+    p.add_argument(
+        "--plan-out",
+        type=Path,
+        help="Write the planned moves/copies/renames (with source fingerprints) to this file; change nothing",
+    )
+    p.add_argument(
+        "--apply",
+        type=Path,
+        help="Execute a plan written by --plan-out without rescanning; changed sources are skipped",
+    )
+    p.add_argument(
+        "--library-index",
+        action="store_true",
+        help="Also treat a file as a duplicate when the destination library already holds the same audio "
+        "or the same artist/title/duration under another name (keeps a persistent index; first run hashes the library)",
+    )
+    p.add_argument(
+        "--have",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="Filter file from have_filter.py build (repeatable); files whose audio it probably contains count as duplicates, artist/title-only hits are reported",
+    )
+    p.add_argument(
+        "--max-read-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="Limit reads (hashing and copies) to RATE bytes/s; K/M/G suffixes, e.g. 20M",
+    )
+    p.add_argument(
+        "--max-write-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="Limit copy writes to RATE bytes/s; K/M/G suffixes, e.g. 20M",
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="Archive members extracted at once (default: tuned for the destination's filesystem, see io_tuning)",
+    )
+    p.add_argument(
+        "--zip-memory",
+        type=parse_rate,
+        default=DEFAULT_MEMORY,
+        metavar="SIZE",
+        help="Memory for parallel .zip extraction, bounding --jobs; K/M/G suffixes (default: 64M)",
+    )
+    p.add_argument(
+        "--background",
+        action="store_true",
+        help="Idle I/O priority, lower CPU priority, and drop consumed files from the page cache",
+    )
+    p.add_argument(
+        "--format",
+        choices=events.FORMATS,
+        default="text",
+        help="ndjson: stream one JSON event per decision on stdout, human text on stderr",
+    )
+    args = p.parse_args(argv)
+    if not args.inputs and not args.apply:
+        p.error("the following arguments are required: inputs")
+    return args
 
 
 def main(argv: list[str]) -> int:
     args = parse_args(argv)
-    processed = organize(
-        args.inputs,
-        args.dest.expanduser(),
-        args.mode,
-        args.dry_run,
-        args.on_duplicate,
-        args.notify,
-        args.log,
-    )
+    if args.format == "ndjson":
+        events.enable("organize_audio")
+    io_throttle.configure(args.max_read_rate, args.max_write_rate, args.background)
+    if args.apply:
+        try:
+            plan = load_plan(str(args.apply), "organize_audio")
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        _applied, skipped = apply_plan(plan)
+        return 1 if skipped else 0
+    plan = Plan("organize_audio", str(args.dest.expanduser())) if args.plan_out else None
+    have = None
+    if args.have:
+        try:
+            from have_filter import FilterSet
+            have = FilterSet(args.have)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Error: --have: {e}", file=sys.stderr)
+            return 1
+    index = None
+    if args.library_index:
+        try:
+            from library_index import LibraryIndex
+        except ImportError as e:
+            print(f"Error: --library-index needs mutagen ({e})", file=sys.stderr)
+            return 1
+        dest = os.path.abspath(args.dest.expanduser())
+        index = LibraryIndex(cache_path("library", dest, ".sqlite"))
+        added, removed = index.refresh(dest)
+        print(f"Library index: {added} new or changed, {removed} removed")
+    workers = 1
+    if any(is_zip(p) for p in args.inputs):
+        dest = args.dest.expanduser()
+        jobs = args.jobs or io_tuning.jobs_for(str(dest if dest.exists() else dest.parent), "copy")
+        workers = workers_for(args.zip_memory, jobs)
+    try:
+        processed = organize(
+            args.inputs,
+            args.dest.expanduser(),
+            args.mode,
+            args.dry_run,
+            args.on_duplicate,
+            args.notify,
+            args.log,
+            plan,
+            index,
+            have,
+            workers,
+        )
+    finally:
+        if index is not None:
+            index.close(commit=not args.dry_run and plan is None)
+    emit("done", processed=processed)
+    if plan is not None:
+        plan.save(str(args.plan_out))
     if processed == 0:
         print("No audio files found to process.")
         return 1
@@ -0,0 +1,228 @@
+"""
+Plan/apply support shared by the utilities.
+
+`--plan-out FILE` records the exact operations a run would perform, each with
+the (size, mtime_ns, inode) fingerprint its source had when the plan was made.
+`--apply FILE` later executes those operations without rescanning or
+re-reading tags. An entry whose source (or, for deletions, the copy being
+kept) no longer matches its fingerprint, or whose destination has appeared
+in the meantime, is skipped and reported instead of being applied.
+
+Operations
+- rename: os.rename within a filesystem (src -> dst)
+- move:   shutil.move, creating dst's parent (src -> dst)
+- copy:   shutil.copy2, creating dst's parent (src -> dst)
+- extract: write `member` of the ZIP archive src to dst (zip_input)
+- rm:     delete src; with `keep`, only while the kept copy is unchanged
+- prune:  remove junk files and empty directories below src (flatten)
+
+Entries may set "overwrite": true to allow replacing an existing dst.
+Each entry is checked holding the destination folder's lock (dir_locks);
+renames never replace a file that appeared after the check, and move/copy
+claim dst with an O_EXCL placeholder before writing, so a concurrent run
+cannot slip a file in between.
+move/copy/extract go through io_throttle, so --max-read-rate, --max-write-rate and
+--background apply to them.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_store import atomic_write_bytes, load_json
+from dir_locks import claim, lock_dir, release, rename_noreplace
+from cli_flags import arg_value
+from events import emit
+from io_throttle import copy_file, move_file
+
+PLAN_VERSION = 1
+
+
+def fingerprint(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class Plan:
+    """Ordered list of operations for one tool, serialisable to JSON."""
+
+    def __init__(self, tool: str, root: Optional[str] = None) -> None:
+        self.tool = tool
+        self.root = root
+        self.ops: List[Dict[str, Any]] = []
+
+    def add(self, op: str, src: str, dst: Optional[str] = None, keep: Optional[str] = None,
+            overwrite: bool = False, keep_from: Optional[str] = None, member: Optional[str] = None) -> None:
+        """`keep_from` is where the kept copy is now, when an earlier entry of
+        the plan moves it to `keep` (renames preserve the fingerprint).
+        `member` names the archive member of an extract entry."""
+        entry: Dict[str, Any] = {"op": op, "src": os.path.abspath(src)}
+        if member is not None:
+            entry["member"] = member
+        if op != "prune":
+            entry["fp"] = fingerprint(src)
+        if dst is not None:
+            entry["dst"] = os.path.abspath(dst)
+        if keep is not None:
+            entry["keep"] = os.path.abspath(keep)
+            entry["keep_fp"] = fingerprint(keep_from or keep)
+        if overwrite:
+            entry["overwrite"] = True
+        self.ops.append(entry)
+        emit("op", op=op, src=entry["src"], dst=entry.get("dst"), keep=entry.get("keep"), member=member, status="planned")
+
+    def save(self, path: str) -> None:
+        doc = {
+            "version": PLAN_VERSION,
+            "tool": self.tool,
+            "root": self.root,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "ops": self.ops,
+        }
+        atomic_write_bytes(os.path.expanduser(path), json.dumps(doc, indent=1).encode("utf-8"))
+        print(f"\nPlan written: {path} ({len(self.ops)} operations)")
+
+
+def load_plan(path: str, tool: str) -> Plan:
+    doc = load_json(os.path.expanduser(path))
+    if not isinstance(doc, dict) or doc.get("version") != PLAN_VERSION:
+        raise ValueError(f"not a plan file: {path}")
+    if doc.get("tool") != tool:
+        raise ValueError(f"plan was made by {doc.get('tool')}, not {tool}")
+    plan = Plan(tool, doc.get("root"))
+    plan.ops = list(doc.get("ops", []))
+    return plan
+
+
+def _check(entry: Dict[str, Any]) -> Optional[str]:
+    # Reason to skip this entry, or None when it is still safe to apply
+    op, src = entry["op"], entry["src"]
+    if op == "prune":
+        return None if os.path.isdir(src) else "directory is gone"
+    current = fingerprint(src)
+    if current is None:
+        return "source is gone"
+    if entry.get("fp") is not None and current != entry["fp"]:
+        return "source changed since plan"
+    if "keep" in entry:
+        if fingerprint(entry["keep"]) != entry.get("keep_fp"):
+            return f"kept copy changed or missing: {entry['keep']}"
+    dst = entry.get("dst")
+    if dst and os.path.lexists(dst) and not entry.get("overwrite"):
+        return "destination already exists"
+    return None
+
+
+def _prune(root: str, junk: set) -> None:
+    for dirpath, _dirnames, filenames in os.walk(root, topdown=False):
+        if os.path.abspath(dirpath) == os.path.abspath(root):
+            continue
+        for name in filenames:
+            if name in junk:
+                try:
+                    os.remove(os.path.join(dirpath, name))
+                    print(f"rm {os.path.join(dirpath, name)}")
+                    emit("op", op="rm", src=os.path.join(dirpath, name), status="applied")
+                except OSError:
+                    pass
+        try:
+            os.rmdir(dirpath)
+            print(f"rmdir {dirpath}")
+            emit("op", op="rmdir", src=dirpath, status="applied")
+        except OSError:
+            pass
+
+
+def apply_plan(plan: Plan, junk: Optional[set] = None) -> Tuple[int, int]:
+    """Apply every still-valid entry in order; returns (applied, skipped)."""
+    applied = skipped = 0
+    for entry in plan.ops:
+        op, src, dst = entry["op"], entry["src"], entry.get("dst")
+        reserved = False
+        with lock_dir(os.path.dirname(dst or src)):
+            reason = _check(entry)
+            if reason is None and op in ("move", "copy") and not entry.get("overwrite"):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                reserved = claim(dst)
+                if not reserved:
+                    reason = "destination already exists"
+        if reason:
+            print(f"[SKIP] {op} {src} ({reason})")
+            emit("op", op=op, src=src, dst=dst, status="skipped", reason=reason)
+            skipped += 1
+            continue
+        try:
+            if op == "rename":
+                if entry.get("overwrite"):
+                    os.replace(src, dst)
+                else:
+                    rename_noreplace(src, dst)
+                print(f"rename {src} -> {dst}")
+            elif op == "move":
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                move_file(src, dst)
+                print(f"move {src} -> {dst}")
+            elif op == "copy":
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                copy_file(src, dst)
+                print(f"copy {src} -> {dst}")
+            elif op == "extract":
+                from zip_input import ZIP_ERRORS, extract_member
+
+                try:
+                    extract_member(src, entry["member"], dst, overwrite=bool(entry.get("overwrite")))
+                except ZIP_ERRORS as e:
+                    raise OSError(f"{entry['member']}: {e}") from e
+                print(f"extract {src}:{entry['member']} -> {dst}")
+            elif op == "rm":
+                os.remove(src)
+                print(f"rm {src}")
+            elif op == "prune":
+                _prune(src, junk or set())
+            else:
+                print(f"[SKIP] unknown operation {op!r} for {src}")
+                emit("op", op=op, src=src, status="skipped", reason="unknown operation")
+                skipped += 1
+                continue
+        except OSError as e:
+            if reserved:
+                release(dst)
+            print(f"[SKIP] {op} {src} ({e})")
+            emit("op", op=op, src=src, dst=dst, status="skipped", reason=str(e))
+            skipped += 1
+            continue
+        emit("op", op=op, src=src, dst=dst, status="applied")
+        applied += 1
+    print(f"\nApplied: {applied} | Skipped: {skipped}")
+    emit("done", applied=applied, skipped=skipped)
+    return applied, skipped
+
+
+def apply_from_argv(tool: str, junk: Optional[set] = None) -> None:
+    """Handle `--apply FILE`: apply the plan and exit. Returns when the flag
+    is absent so the caller can carry on with a normal scan."""
+    path = arg_value("--apply")
+    if path is None:
+        return
+    try:
+        plan = load_plan(path, tool)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    _applied, skipped = apply_plan(plan, junk)
+    sys.exit(1 if skipped else 0)
+
+
+def plan_from_argv(tool: str, root: Optional[str] = None) -> Tuple[Optional[Plan], Optional[str]]:
+    """(Plan, output path) when `--plan-out FILE` was given, else (None, None)."""
+    path = arg_value("--plan-out")
+    if path is None:
+        return None, None
+    return Plan(tool, root), path
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Batch tag edits from a CSV or JSON mapping, without rewriting AIFF/WAV files.
+
+AIFF/WAV files go through tag_writer, which updates the ID3 chunk in place
+(or, when the tag grows, appends it with generous padding) instead of
+copying the audio. Other formats are saved through mutagen.
+
+Mapping formats (paths relative to --base, default: the mapping's folder)
+- CSV with a header row: `path` plus any of artist, title, album, genre,
+  albumartist, composer. An empty cell leaves that tag as it is.
+- JSON: {"<path>": {"title": "...", "genre": null}, ...} or a list of
+  {"path": "...", ...} objects. null (or "") removes the tag.
+
+Usage
+  python3 script/utilities/retag_audio.py <mapping.csv|mapping.json> [--base DIR] [--dry-run|-n] [--format text|ndjson]
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+import io_throttle
+from tag_writer import TAG_KEYS, UnsupportedTag, set_tags
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+USAGE = "Usage: python3 retag_audio.py <mapping.csv|mapping.json> [--base DIR] [--dry-run|-n] [--format text|ndjson]"
+
+Edit = Tuple[str, Dict[str, Optional[str]]]
+
+
+def _check_keys(where: str, keys) -> None:
+    unknown = sorted(set(keys) - set(TAG_KEYS) - {"path"})
+    if unknown:
+        raise ValueError(f"{where}: unknown tag column(s) {', '.join(unknown)}; expected {', '.join(TAG_KEYS)}")
+
+
+def load_mapping(path: str, base: str) -> List[Edit]:
+    """[(absolute path, {tag: value or None})] in mapping order."""
+    edits: List[Edit] = []
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        if isinstance(doc, dict):
+            items = [dict(tags, path=p) for p, tags in doc.items()]
+        elif isinstance(doc, list):
+            items = doc
+        else:
+            raise ValueError(f"{path}: expected an object or a list")
+        for item in items:
+            if not isinstance(item, dict) or not item.get("path"):
+                raise ValueError(f"{path}: every entry needs a path")
+            _check_keys(path, item)
+            tags = {k: (str(v) if v is not None else None) for k, v in item.items() if k != "path"}
+            edits.append((os.path.join(base, os.path.expanduser(item["path"])), tags))
+        return edits
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or "path" not in reader.fieldnames:
+            raise ValueError(f"{path}: the header row needs a `path` column")
+        _check_keys(path, reader.fieldnames)
+        for row in reader:
+            if not row.get("path"):
+                continue
+            tags = {k: v.strip() for k, v in row.items() if k != "path" and k and v and v.strip()}
+            edits.append((os.path.join(base, os.path.expanduser(row["path"])), tags))
+    return edits
+
+
+def main():
+    # --format ndjson streams one JSON event per file on stdout
+    setup_from_argv("retag_audio")
+    io_throttle.setup_from_argv()
+    valued = {"--base", "--format", "--max-read-rate", "--max-write-rate"}
+    args = sys.argv[1:]
+    positional = [a for i, a in enumerate(args) if not a.startswith("-") and (i == 0 or args[i - 1] not in valued)]
+    if len(positional) != 1:
+        print(USAGE)
+        sys.exit(1)
+    mapping = os.path.expanduser(positional[0])
+    base = os.path.expanduser(arg_value("--base") or os.path.dirname(os.path.abspath(mapping)))
+    dry_run = "--dry-run" in args or "-n" in args
+
+    try:
+        edits = load_mapping(mapping, base)
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    modes: Counter = Counter()
+    errors = 0
+    for path, tags in edits:
+        if not tags:
+            continue
+        try:
+            mode = set_tags(path, tags, dry_run=dry_run)
+        except (OSError, UnsupportedTag, ValueError) as e:
+            errors += 1
+            print(f"[ERROR] {path} ({e})")
+            emit("error", path=path, message=str(e))
+            continue
+        except Exception as e:  # noqa: BLE001 - mutagen raises its own error types
+            errors += 1
+            print(f"[ERROR] {path} ({type(e).__name__}: {e})")
+            emit("error", path=path, message=str(e))
+            continue
+        modes[mode] += 1
+        if mode == "unchanged":
+            continue
+        changes = ", ".join(f"{k}={v!r}" if v else f"-{k}" for k, v in tags.items())
+        print(f"{'DRY: ' if dry_run else ''}tag {path} [{mode}] {changes}")
+        emit("op", op="tag", src=path, mode=mode, tags=tags, status="dry_run" if dry_run else "applied")
+
+    summary = " | ".join(f"{m}: {n}" for m, n in sorted(modes.items()))
+    print(f"\nDone. Files: {len(edits)} | {summary or 'nothing to do'} | Errors: {errors}")
+    emit("done", files=len(edits), errors=errors, **{m: n for m, n in modes.items()})
+    if dry_run:
+        print("(dry run: no changes made)")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
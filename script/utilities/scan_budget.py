@@ -0,0 +1,108 @@
+"""
+Time-budgeted, newest-first, resumable scans (`--time-budget`).
+
+A nightly job with a fixed window cannot finish a full pass over a big
+archive, and a killed run used to start from zero the next night. With
+`--time-budget 30m` the scanning utilities:
+
+- visit files newest-first (by mtime), since that is where new duplicates
+  and problems appear
+- stop starting new work once the budget is spent, report what they have,
+  and persist a cursor plus the partial results
+- on the next run reuse every result whose file is unchanged (same size and
+  mtime) and continue with the rest, so coverage converges over several
+  nights without redoing work
+
+State lives next to the other caches (see cache_store), one file per tool
+and root.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from cache_store import cache_path, load_json, save_json
+from cli_flags import arg_value
+
+STATE_VERSION = 1
+_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(text: str) -> float:
+    """'30m' -> 1800.0; plain numbers are seconds."""
+    s = text.strip().lower()
+    unit = s[-1:] if s[-1:] in _UNITS else "s"
+    value = float(s[:-1] if s[-1:] in _UNITS else s)
+    if value <= 0:
+        raise ValueError(text)
+    return value * _UNITS[unit]
+
+
+class Budget:
+    """Wall-clock allowance starting now; seconds=None never expires."""
+
+    def __init__(self, seconds: Optional[float]) -> None:
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+def budget_from_argv(argv: Optional[List[str]] = None) -> Budget:
+    """Handle `--time-budget DURATION` (e.g. 1800, 30m, 2h)."""
+    value = arg_value("--time-budget", None, argv)
+    if not value:
+        return Budget(None)
+    try:
+        return Budget(parse_duration(value))
+    except ValueError:
+        print("--time-budget expects a duration such as 1800, 30m or 2h")
+        sys.exit(2)
+
+
+def newest_first(rows: Iterable[int], mtime_ns: Callable[[int], int]) -> List[int]:
+    return sorted(rows, key=mtime_ns, reverse=True)
+
+
+class ResumeState:
+    """Per-file results of an interrupted pass, plus the cursor it stopped at.
+
+    `key` captures options that change the results (e.g. strict hashing);
+    state saved under a different key is discarded."""
+
+    def __init__(self, tool: str, root: str, key: str = "") -> None:
+        self.path = cache_path("resume-" + tool, root)
+        self.key = key
+        state = load_json(self.path, None)
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION or state.get("key") != key:
+            state = {}
+        self.results: Dict[str, list] = state.get("results", {})
+        self.cursor: Optional[list] = state.get("cursor")
+        self.resumed = bool(self.results) and not state.get("complete", False)
+
+    def get(self, path: str, size: int, mtime_ns: int) -> Any:
+        entry = self.results.get(path)
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, path: str, size: int, mtime_ns: int, result: Any) -> None:
+        self.results[path] = [size, mtime_ns, result]
+        self.cursor = [mtime_ns, path]
+
+    def save(self, complete: bool, keep: Optional[Iterable[str]] = None) -> None:
+        """Persist; `keep` (the paths still present) prunes vanished files."""
+        if keep is not None:
+            live = set(keep)
+            self.results = {p: v for p, v in self.results.items() if p in live}
+        save_json(self.path, {
+            "version": STATE_VERSION,
+            "key": self.key,
+            "complete": complete,
+            "cursor": None if complete else self.cursor,
+            "saved": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "results": self.results,
+        })
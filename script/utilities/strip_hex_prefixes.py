@@ -4,6 +4,12 @@ import re
 import sys
 from pathlib import Path
 
+from dir_fds import DirFds
+from dir_locks import lock_dir, rename_unique
+from events import emit, setup_from_argv
+from plan_file import apply_from_argv, plan_from_argv
+from walk_cache import walk
+
 # Load .env file if available
 try:
     from dotenv import load_dotenv
@@ -21,17 +27,24 @@ def is_audio(name: str) -> bool:
     return os.path.splitext(name)[1].lower() in EXTENSIONS
 
 
-def ensure_unique_name(dirpath: str, name: str) -> str:
+def ensure_unique_name(dirpath: str, name: str, taken: set | None = None, fs: DirFds | None = None) -> str:
+    # `taken` holds destinations already claimed by this run (dry runs/plans)
+    exists = fs.exists if fs is not None else os.path.exists
     base, ext = os.path.splitext(name)
     candidate = name
     n = 1
-    while os.path.exists(os.path.join(dirpath, candidate)):
+    while exists(os.path.join(dirpath, candidate)) or (taken and os.path.join(dirpath, candidate) in taken):
         candidate = f"{base} ({n}){ext}"
         n += 1
     return candidate
 
 
 def main():
+    # --format ndjson streams one JSON event per decision on stdout
+    setup_from_argv("strip_hex_prefixes")
+    # --apply FILE executes a saved plan without rescanning
+    apply_from_argv("strip_hex_prefixes")
+
     # Get directory from command line or environment variable
     if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
         root = sys.argv[1]
@@ -39,12 +52,14 @@ def main():
         root = os.environ.get("MUSIC_LIBRARY_DIR")
         if not root:
             print("Error: No directory specified.")
-            print("Usage: python3 strip_hex_prefixes.py <directory> [--dry-run|-n]")
+            print("Usage: python3 strip_hex_prefixes.py <directory> [--dry-run|-n] [--full] [--plan-out FILE | --apply FILE] [--format text|ndjson]")
             print("Or set MUSIC_LIBRARY_DIR in your .env file")
             sys.exit(1)
 
     root = os.path.expanduser(root)
     dry = "--dry-run" in sys.argv or "-n" in sys.argv
+    full = "--full" in sys.argv
+    plan, plan_out = plan_from_argv("strip_hex_prefixes", root)
 
     if not os.path.isdir(root):
         print(f"Root does not exist or is not a directory: {root}")
@@ -52,26 +67,45 @@ def main():
 
     total = 0
     renamed = 0
-    for dirpath, _dirnames, filenames in os.walk(root):
-        for fname in sorted(filenames):
-            if not is_audio(fname):
-                continue
-            if not HEX_PREFIX.match(fname):
-                continue
-            p = os.path.join(dirpath, fname)
-            total += 1
-            new_name = HEX_PREFIX.sub("", fname)
-            new_name = ensure_unique_name(dirpath, new_name)
-            dst = os.path.join(dirpath, new_name)
-            if dry:
-                print(f"DRY: rename {p} -> {dst}")
-            else:
-                os.replace(p, dst)
-                print(f"rename {p} -> {dst}")
-            renamed += 1
+    taken: set = set()
+    # Existence checks and renames run relative to each open directory
+    with DirFds() as fs:
+        for dirpath, files in walk(root, incremental=True, full=full):
+            for f in sorted(files):
+                fname = f.name
+                if not is_audio(fname):
+                    continue
+                p = os.path.join(dirpath, fname)
+                emit("scanned", path=p, size=f.st_size)
+                if not HEX_PREFIX.match(fname):
+                    continue
+                total += 1
+                stripped = HEX_PREFIX.sub("", fname)
+                new_name = ensure_unique_name(dirpath, stripped, taken, fs)
+                dst = os.path.join(dirpath, new_name)
+                taken.add(dst)
+                if plan is not None:
+                    plan.add("rename", p, dst)
+                    print(f"PLAN: rename {p} -> {dst}")
+                elif dry:
+                    print(f"DRY: rename {p} -> {dst}")
+                    emit("op", op="rename", src=p, dst=dst, status="dry_run")
+                else:
+                    # Re-checked under the folder lock: a concurrent run may have taken the name
+                    taken.discard(dst)
+                    with lock_dir(dirpath):
+                        dst = rename_unique(p, dirpath, stripped, lambda d, n: ensure_unique_name(d, n, taken, fs), fs)
+                    taken.add(dst)
+                    print(f"rename {p} -> {dst}")
+                    emit("op", op="rename", src=p, dst=dst, status="applied")
+                renamed += 1
 
     print(f"\nDone. Prefixed files found: {total} | Renamed: {renamed}")
-    if dry:
+    emit("done", found=total, renamed=renamed)
+    if plan is not None:
+        plan.save(plan_out)
+        print("(plan only: no changes made)")
+    elif dry:
         print("(dry run: no changes made)")
 
 
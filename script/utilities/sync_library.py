@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Incremental library sync to USB export drives.
+
+The library is described by a manifest of (relative path, size, hash) built
+with find_exact_duplicates.content_digest and cached between runs, so only
+new or changed files are hashed. The drive carries its own manifest of what
+an earlier sync put there. The difference becomes:
+
+- rename: a file whose hash is already on the drive under another name is
+          renamed there instead of copied again
+- copy:   new or changed files, copied in parallel
+- rm:     files a previous sync put on the drive that the library no longer has
+
+Only files listed in the drive's manifest are ever renamed or deleted;
+anything else on the drive (Rekordbox's export database, other folders) is
+left alone. On the first sync to a drive without a manifest, audio files
+already under the target folder are hashed, and those identical to a library
+file are adopted (kept or renamed into place instead of copied again).
+
+Hashes cover the whole file by default, so retagging a track in the library
+updates it on the drive; `--payload-only` hashes just the audio payload and
+ignores tag-only changes.
+
+FAT32/exFAT make every fsync expensive, so copies land under temporary names
+and are made durable in batches: one filesystem sync per `--fsync-batch`
+files, then the renames into place, then an atomic rewrite of the drive's
+manifest. Pulling the drive mid-sync loses at most the current batch.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import gzip
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import io_throttle
+import io_tuning
+from cache_store import atomic_write_bytes, cache_path
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+from find_exact_duplicates import content_digest
+from library_index import is_indexed_name
+from library_manifest import MANIFEST_VERSION, read_manifest
+from records import scan_tree
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+MANIFEST_NAME = ".deckready-sync.mf"
+STAGING_DIR = ".deckready-sync"
+PART_PREFIX = ".deckready-part-"
+FSYNC_BATCH = 32
+FSYNC_BATCH_BYTES = 512 * 1024 * 1024
+
+USAGE = (
+    "Usage: python3 sync_library.py [<library>] <target> [--dry-run|-n] [--jobs N] [--fsync-batch N] "
+    "[--no-delete] [--payload-only] [--full] [--retune-io] [--max-read-rate RATE] [--max-write-rate RATE] [--background] "
+    "[--format text|ndjson]"
+)
+
+# rel -> [size, mtime_ns, hash hex]
+Entries = Dict[str, list]
+
+
+def is_synced_name(name: str) -> bool:
+    # macOS writes AppleDouble "._name" companions onto FAT drives
+    return is_indexed_name(name) and not name.startswith(("._", PART_PREFIX))
+
+
+def _sync_fs(path: str) -> None:
+    """Flush the filesystem holding `path` (syncfs on Linux, else sync)."""
+    if sys.platform.startswith("linux"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if ctypes.CDLL(None, use_errno=True).syncfs(fd) == 0:
+                return
+        except (AttributeError, OSError):
+            pass
+        finally:
+            os.close(fd)
+    os.sync()
+
+
+def encode_manifest(root: str, entries: Entries, strict: bool, host: str) -> bytes:
+    header = {
+        "manifest": MANIFEST_VERSION,
+        "host": host,
+        "root": root,
+        "shard": [0, 1],
+        "strict": strict,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "files": len(entries),
+        "complete": True,
+    }
+    lines = [json.dumps(header, separators=(",", ":"))]
+    for rel in sorted(entries):
+        size, mtime_ns, digest = entries[rel]
+        lines.append(json.dumps([rel, size, mtime_ns, digest, None, "", ""], separators=(",", ":")))
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=6)
+
+
+def load_entries(path: str, strict: bool) -> Optional[Entries]:
+    """Entries of a manifest written with the same hashing mode, else None."""
+    try:
+        header, rows = read_manifest(path)
+        if header.get("strict") != strict:
+            return None
+        return {r[0]: [r[1], r[2], r[3]] for r in rows}
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def library_entries(root: str, strict: bool, full: bool, jobs: Optional[int] = None, probe: bool = False) -> Entries:
+    """Manifest of the library; unchanged files reuse the cached hash. New
+    and changed files are hashed by `jobs` threads (default: tuned for the
+    library's filesystem, see io_tuning; an untuned mount is probed only
+    with `probe`)."""
+    cached_path = cache_path("sync", root, ".mf")
+    previous = load_entries(cached_path, strict) or {}
+    table = scan_tree(root, is_synced_name, incremental=True, full=full)
+    entries: Entries = {}
+    hashed = 0
+    work: List[int] = []
+    for row in table.rows():
+        path = table.path(row)
+        rel = os.path.relpath(path, root)
+        prev = previous.get(rel)
+        if prev:
+            # Tags written in place leave the directory mtime alone, so the
+            # walk snapshot can hold a stale stat; a cached hash is only
+            # trusted against a fresh one
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                print(f"[SKIP] {path} ({e})")
+                emit("error", path=path, message=str(e))
+                continue
+            table.size[row], table.mtime_ns[row] = st.st_size, st.st_mtime_ns
+            if prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+                entries[rel] = prev
+                continue
+        work.append(row)
+
+    def digest_row(row: int) -> Tuple[int, Optional[str], Optional[OSError]]:
+        try:
+            return row, content_digest(table.path(row), ignore_metadata=not strict).hex(), None
+        except OSError as e:
+            return row, None, e
+
+    if jobs is None and work:
+        jobs = io_tuning.jobs_for(root, "hash", [table.path(row) for row in work], probe_new=probe)
+    for row, digest, err in io_tuning.imap(digest_row, work, jobs or 1):
+        path = table.path(row)
+        size, mtime_ns = table.size[row], table.mtime_ns[row]
+        if err is not None:
+            print(f"[SKIP] {path} ({err})")
+            emit("error", path=path, message=str(err))
+            continue
+        entries[os.path.relpath(path, root)] = [size, mtime_ns, digest]
+        hashed += 1
+        emit("scanned", path=path, size=size, hash=digest)
+    atomic_write_bytes(cached_path, encode_manifest(root, entries, strict, socket.gethostname()))
+    print(f"Library: {len(entries)} files ({hashed} hashed)")
+    return entries
+
+
+def drive_entries(target: str, strict: bool, src: Entries) -> Entries:
+    """What earlier syncs put on the drive. On the first run, existing files
+    identical to a library file are adopted; the rest stay unmanaged."""
+    entries = load_entries(os.path.join(target, MANIFEST_NAME), strict)
+    if entries is not None:
+        # Trust the manifest, but not for files removed or truncated behind its back
+        live: Entries = {}
+        for rel, entry in entries.items():
+            try:
+                if os.stat(os.path.join(target, rel)).st_size == entry[0]:
+                    live[rel] = entry
+            except OSError:
+                pass
+        return live
+    entries = {}
+    wanted = {(size, digest) for size, _m, digest in src.values()}
+    sizes = {size for size, _d in wanted}
+    for dirpath, dirnames, filenames in os.walk(target):
+        dirnames[:] = [d for d in dirnames if d != STAGING_DIR]
+        for name in filenames:
+            if not is_synced_name(name):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+                if st.st_size not in sizes:
+                    continue
+                digest = content_digest(path, ignore_metadata=not strict).hex()
+            except OSError as e:
+                print(f"[SKIP] {path} ({e})")
+                continue
+            if (st.st_size, digest) in wanted:
+                entries[os.path.relpath(path, target)] = [st.st_size, st.st_mtime_ns, digest]
+    if entries:
+        print(f"Drive has no sync manifest; adopted {len(entries)} existing file(s)")
+    return entries
+
+
+def diff(src: Entries, dst: Entries) -> Tuple[List[str], List[Tuple[str, str]], List[str]]:
+    """(copies, renames as (old, new), deletes) that turn dst into src."""
+    spare: Dict[Tuple[int, str], List[str]] = {}
+    for rel, (size, _m, digest) in sorted(dst.items()):
+        s = src.get(rel)
+        if not (s and s[0] == size and s[2] == digest):
+            spare.setdefault((size, digest), []).append(rel)
+    copies: List[str] = []
+    renames: List[Tuple[str, str]] = []
+    for rel, (size, _m, digest) in sorted(src.items()):
+        d = dst.get(rel)
+        if d and d[0] == size and d[2] == digest:
+            continue
+        olds = spare.get((size, digest))
+        if olds:
+            renames.append((olds.pop(0), rel))
+        else:
+            copies.append(rel)
+    deletes = sorted(rel for rels in spare.values() for rel in rels)
+    return copies, renames, deletes
+
+
+def _prune_dirs(target: str, rels: List[str]) -> None:
+    # Remove directories emptied by deletes/renames, never the target itself
+    dirs = {os.path.dirname(os.path.join(target, r)) for r in rels}
+    for d in sorted(dirs, key=len, reverse=True):
+        while os.path.abspath(d) != os.path.abspath(target):
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+
+
+class Drive:
+    """The target folder and its manifest, rewritten atomically at each checkpoint."""
+
+    def __init__(self, target: str, entries: Entries, strict: bool) -> None:
+        self.target = target
+        self.entries = entries
+        self.strict = strict
+
+    def path(self, rel: str) -> str:
+        return os.path.join(self.target, rel)
+
+    def checkpoint(self) -> None:
+        # Data and renames first, then the manifest that describes them
+        _sync_fs(self.target)
+        data = encode_manifest(self.target, self.entries, self.strict, os.path.basename(self.target.rstrip(os.sep)))
+        atomic_write_bytes(self.path(MANIFEST_NAME), data, durable=True)
+        _sync_fs(self.target)
+
+
+def _copy_one(src_root: str, drive: Drive, rel: str) -> Tuple[str, str, int]:
+    src = os.path.join(src_root, rel)
+    final = drive.path(rel)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    part = os.path.join(os.path.dirname(final), PART_PREFIX + os.path.basename(final))
+    io_throttle.copy_contents(src, part)
+    try:
+        st = os.stat(src)
+        os.utime(part, ns=(st.st_atime_ns, st.st_mtime_ns))
+    except OSError:
+        pass
+    return rel, part, os.path.getsize(part)
+
+
+def _unstage(drive: Drive, old: str, new: str, tmp: str, entry: list, copies: List[str]) -> None:
+    """Undo a staged rename that could not finish: the file goes back to its
+    old name and keeps its entry, so the next sync retries. If even that
+    fails it is dropped and `new` is copied from the source instead."""
+    try:
+        if os.path.lexists(drive.path(old)):
+            # Another staged rename has landed there (a swap)
+            raise FileExistsError(drive.path(old))
+        os.makedirs(os.path.dirname(drive.path(old)), exist_ok=True)
+        os.rename(tmp, drive.path(old))
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        copies.append(new)
+        return
+    drive.entries[old] = entry
+
+
+def sync(src_root: str, drive: Drive, src: Entries, dry_run: bool, delete: bool, jobs: int, batch: int) -> int:
+    copies, renames, deletes = diff(src, drive.entries)
+    if not delete:
+        deletes = []
+    print(f"To copy: {len(copies)} | To rename: {len(renames)} | To delete: {len(deletes)}")
+    status = "dry_run" if dry_run else "applied"
+    errors = 0
+
+    if dry_run:
+        for rel in deletes:
+            print(f"[DRY] RM: {drive.path(rel)}")
+            emit("op", op="rm", src=drive.path(rel), status=status)
+        for old, new in renames:
+            print(f"[DRY] RENAME: {drive.path(old)} -> {drive.path(new)}")
+            emit("op", op="rename", src=drive.path(old), dst=drive.path(new), status=status)
+        for rel in copies:
+            print(f"[DRY] COPY: {os.path.join(src_root, rel)} -> {drive.path(rel)}")
+            emit("op", op="copy", src=os.path.join(src_root, rel), dst=drive.path(rel), status=status)
+        return 0
+
+    # Deletes, then renames in two phases (through a staging folder) so that
+    # swaps and chains of renames cannot collide
+    for rel in deletes:
+        try:
+            os.remove(drive.path(rel))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            errors += 1
+            print(f"[ERROR] rm {drive.path(rel)} ({e})")
+            emit("error", path=drive.path(rel), message=str(e))
+            continue
+        del drive.entries[rel]
+        print(f"rm {drive.path(rel)}")
+        emit("op", op="rm", src=drive.path(rel), status=status)
+    staged: List[Tuple[str, str, str]] = []
+    try:
+        if renames:
+            staging = drive.path(STAGING_DIR)
+            os.makedirs(staging, exist_ok=True)
+            for n, (old, new) in enumerate(renames):
+                tmp = os.path.join(staging, str(n))
+                try:
+                    os.rename(drive.path(old), tmp)
+                except OSError as e:
+                    errors += 1
+                    print(f"[ERROR] rename {drive.path(old)} ({e})")
+                    emit("error", path=drive.path(old), message=str(e))
+                    continue
+                staged.append((old, new, tmp))
+            moved = {old: drive.entries.pop(old) for old, _new, _tmp in staged}
+            for old, new, tmp in staged:
+                entry = moved[old]
+                dest = drive.path(new)
+                try:
+                    if os.path.exists(dest):
+                        # Something the sync does not manage is in the way: copy instead
+                        os.remove(tmp)
+                        copies.append(new)
+                        continue
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.rename(tmp, dest)
+                except OSError as e:
+                    # e.g. a name the drive's filesystem rejects
+                    errors += 1
+                    print(f"[ERROR] rename {drive.path(old)} -> {dest} ({e})")
+                    emit("error", path=dest, message=str(e))
+                    _unstage(drive, old, new, tmp, entry, copies)
+                    continue
+                drive.entries[new] = [entry[0], src[new][1], entry[2]]
+                print(f"rename {drive.path(old)} -> {dest}")
+                emit("op", op="rename", src=drive.path(old), dst=dest, status=status)
+            try:
+                os.rmdir(staging)
+            except OSError:
+                pass
+    finally:
+        # Whatever happened above, the manifest must match the drive
+        _prune_dirs(drive.target, deletes + [old for old, _new, _tmp in staged])
+        if deletes or staged:
+            drive.checkpoint()
+
+    # Copies in parallel; each batch is synced once, then renamed into place
+    pending: List[Tuple[str, str]] = []
+    pending_bytes = 0
+
+    def flush() -> None:
+        nonlocal pending_bytes, errors
+        if not pending:
+            return
+        _sync_fs(drive.target)
+        for rel, part in pending:
+            final = drive.path(rel)
+            try:
+                os.replace(part, final)
+            except OSError as e:
+                errors += 1
+                print(f"[ERROR] {final} ({e})")
+                emit("error", path=final, message=str(e))
+                continue
+            drive.entries[rel] = list(src[rel])
+            print(f"copy {os.path.join(src_root, rel)} -> {final}")
+            emit("op", op="copy", src=os.path.join(src_root, rel), dst=final, status=status)
+        pending.clear()
+        pending_bytes = 0
+        drive.checkpoint()
+
+    todo: List[str] = []
+    for rel in copies:
+        final = drive.path(rel)
+        if rel not in drive.entries and os.path.exists(final):
+            # Left by an interrupted sync (renamed into place, manifest not yet
+            # written) or put there by hand: adopt it if it is the same file
+            try:
+                same = content_digest(final, ignore_metadata=not drive.strict).hex() == src[rel][2]
+            except OSError:
+                same = False
+            if same:
+                drive.entries[rel] = list(src[rel])
+                continue
+            errors += 1
+            print(f"[SKIP] {final} exists on the drive and was not put there by a sync")
+            emit("op", op="copy", src=os.path.join(src_root, rel), dst=final, status="skipped", reason="destination exists")
+            continue
+        todo.append(rel)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(_copy_one, src_root, drive, rel): rel for rel in todo}
+        for fut in as_completed(futures):
+            try:
+                rel, part, size = fut.result()
+            except OSError as e:
+                errors += 1
+                print(f"[ERROR] copy {futures[fut]} ({e})")
+                emit("error", path=os.path.join(src_root, futures[fut]), message=str(e))
+                continue
+            pending.append((rel, part))
+            pending_bytes += size
+            if len(pending) >= batch or pending_bytes >= FSYNC_BATCH_BYTES:
+                flush()
+    flush()
+    return errors
+
+
+def main():
+    # --format ndjson streams one JSON event per operation on stdout
+    setup_from_argv("sync_library")
+    io_throttle.setup_from_argv()
+
+    args = sys.argv[1:]
+    valued = {"--jobs", "--fsync-batch", "--format", "--max-read-rate", "--max-write-rate"}
+    positional = [a for i, a in enumerate(args) if not a.startswith("-") and (i == 0 or args[i - 1] not in valued)]
+    if len(positional) == 1 and os.environ.get("MUSIC_LIBRARY_DIR"):
+        positional.insert(0, os.environ["MUSIC_LIBRARY_DIR"])
+    if len(positional) != 2:
+        print(USAGE)
+        print("Or set MUSIC_LIBRARY_DIR in your .env file and pass only the target")
+        sys.exit(1)
+    src_root, target = (os.path.realpath(os.path.expanduser(p)) for p in positional)
+    dry_run = "--dry-run" in args or "-n" in args
+    strict = "--payload-only" not in args
+    try:
+        jobs = int(arg_value("--jobs")) if arg_value("--jobs") else None
+        batch = max(1, int(arg_value("--fsync-batch", str(FSYNC_BATCH))))
+    except ValueError:
+        print("--jobs and --fsync-batch expect numbers")
+        sys.exit(1)
+    for p in (src_root, target):
+        if not os.path.isdir(p):
+            print(f"Not a directory: {p}")
+            sys.exit(1)
+    if target == src_root or target.startswith(src_root + os.sep):
+        print("The target must not be inside the library")
+        sys.exit(1)
+
+    src = library_entries(src_root, strict, full="--full" in args, jobs=jobs, probe=not dry_run)
+    drive = Drive(target, drive_entries(target, strict, src), strict)
+    if jobs is None:
+        # Copies are bounded by the slower side: usually the USB drive
+        sample = [os.path.join(src_root, rel) for rel in src]
+        jobs = min(io_tuning.jobs_for(src_root, "copy", sample, probe_new=not dry_run), io_tuning.jobs_for(target, "copy"))
+    errors = sync(src_root, drive, src, dry_run, delete="--no-delete" not in args, jobs=jobs, batch=batch)
+    print(f"\nDone. Library files: {len(src)} | On drive: {len(drive.entries)} | Errors: {errors}")
+    emit("done", files=len(src), on_drive=len(drive.entries), errors=errors)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+In-place ID3 tag updates for AIFF and WAV.
+
+AIFF/WAV keep their ID3 tag in a chunk (`ID3 ` / `id3 `). Rewriting that
+chunk through mutagen or ffmpeg copies the whole 40-100 MB file whenever the
+tag changes size. write_tags() instead:
+
+- rebuilds the tag with the changed text frames, keeping every other frame
+  (artwork, cue data, comments) byte for byte
+- overwrites the existing chunk in place when the new tag fits, the rest of
+  the chunk becoming ID3 padding ("padding")
+- when it does not fit and the ID3 chunk is the last chunk, extends the file
+  at the end ("extended"); a file without an ID3 chunk gets one appended
+- when it does not fit and audio follows the chunk: in WAV the old chunk is
+  renamed `JUNK` (which every reader skips) and a new chunk is appended
+  ("relocated"); in AIFF, which has no such convention, the file is
+  rewritten once with the tag moved to the end ("rewritten")
+
+Grown tags get generous padding (PADDING_MIN, or half the tag for big
+ones), so later edits land in the "padding" case. Container and chunk sizes
+are updated; the audio data itself is never moved except in the AIFF
+"rewritten" case.
+
+Every write also bumps the folder's mtime: an in-place edit otherwise
+leaves it alone, and incremental walks (walk_cache) would keep serving the
+file's old size and mtime from their snapshot.
+
+Tags this module does not parse faithfully (ID3v2.2, whole-tag
+unsynchronisation) raise UnsupportedTag; callers fall back to mutagen.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from typing import List, Mapping, Optional, Tuple
+
+from fast_tags import ID3_FRAMES
+from io_throttle import COPY_BUFSIZE, throttle_read, throttle_write
+
+# Tag keys accepted by write_tags(), mirroring fast_tags' result keys
+FRAME_FOR_KEY = {key: fid for fid, key in ID3_FRAMES.items() if key != "length"}
+TAG_KEYS = tuple(FRAME_FOR_KEY)
+
+PADDING_MIN = 16 * 1024
+EXTENSIONS = {".aiff", ".aif", ".wav"}
+
+
+class UnsupportedTag(Exception):
+    """The file's container or ID3 tag cannot be edited in place."""
+
+
+class _Chunk:
+    __slots__ = ("cid", "offset", "size")
+
+    def __init__(self, cid: bytes, offset: int, size: int) -> None:
+        self.cid = cid  # 4-byte id
+        self.offset = offset  # of the 8-byte chunk header
+        self.size = size  # data length, excluding the pad byte
+
+    @property
+    def end(self) -> int:
+        return self.offset + 8 + self.size + (self.size % 2)
+
+
+def _synchsafe(b: bytes) -> int:
+    return (b[0] & 0x7F) << 21 | (b[1] & 0x7F) << 14 | (b[2] & 0x7F) << 7 | (b[3] & 0x7F)
+
+
+def _synchsafe_bytes(n: int) -> bytes:
+    return bytes(((n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F))
+
+
+def _container(f) -> Tuple[str, List[_Chunk], int]:
+    """("wav" | "aiff", chunks, file size)."""
+    head = f.read(12)
+    size = os.fstat(f.fileno()).st_size
+    if head[0:4] == b"RIFF" and head[8:12] == b"WAVE":
+        kind, fmt = "wav", "<I"
+    elif head[0:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        kind, fmt = "aiff", ">I"
+    else:
+        raise UnsupportedTag("not a WAV or AIFF file")
+    chunks: List[_Chunk] = []
+    pos = 12
+    while pos + 8 <= size:
+        f.seek(pos)
+        hdr = f.read(8)
+        clen = struct.unpack(fmt, hdr[4:8])[0]
+        chunk = _Chunk(hdr[0:4], pos, clen)
+        if chunk.offset + 8 + clen > size:
+            raise UnsupportedTag(f"chunk {hdr[0:4]!r} runs past the end of the file")
+        chunks.append(chunk)
+        pos = chunk.end
+    return kind, chunks, size
+
+
+def _split_frames(tag: bytes) -> Tuple[int, List[Tuple[str, bytes]]]:
+    """(major version, [(frame id, raw frame incl. header)]) of an ID3v2 tag."""
+    if len(tag) < 10 or tag[0:3] != b"ID3":
+        raise UnsupportedTag("ID3 chunk does not hold an ID3v2 tag")
+    major, flags = tag[3], tag[5]
+    if major not in (3, 4):
+        raise UnsupportedTag(f"ID3v2.{major} tag")
+    if flags & 0x80:
+        raise UnsupportedTag("unsynchronised ID3 tag")
+    end = min(len(tag), 10 + _synchsafe(tag[6:10]))
+    pos = 10
+    if flags & 0x40:
+        # Extended header (CRC, restrictions): dropped, it would not match the new tag
+        ext = tag[10:14]
+        pos += _synchsafe(ext) if major == 4 else 4 + int.from_bytes(ext, "big")
+    frames: List[Tuple[str, bytes]] = []
+    while pos + 10 <= end and tag[pos] != 0:
+        raw_size = tag[pos + 4:pos + 8]
+        if major == 4 and not any(b & 0x80 for b in raw_size):
+            size = _synchsafe(raw_size)
+        else:
+            size = int.from_bytes(raw_size, "big")
+        if pos + 10 + size > end:
+            raise UnsupportedTag("ID3 frame runs past the tag")
+        frames.append((tag[pos:pos + 4].decode("latin-1"), tag[pos:pos + 10 + size]))
+        pos += 10 + size
+    return major, frames
+
+
+def _text_frame(fid: str, value: str, major: int) -> bytes:
+    if major == 4:
+        body = b"\x03" + value.encode("utf-8")
+        size = _synchsafe_bytes(len(body))
+    else:
+        # ID3v2.3 has no UTF-8: UTF-16 with BOM
+        body = b"\x01" + value.encode("utf-16")
+        size = len(body).to_bytes(4, "big")
+    return fid.encode("latin-1") + size + b"\x00\x00" + body
+
+
+def _current_text(raw: bytes) -> Optional[str]:
+    body = raw[10:]
+    flags = int.from_bytes(raw[8:10], "big")
+    if flags & 0x00FF:
+        return None  # compressed/encrypted/grouped: treat as different
+    if not body:
+        return ""
+    enc, data = body[0], body[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(enc)
+    if codec is None:
+        return None
+    try:
+        return data.decode(codec).rstrip("\0").replace("\0", "; ").lstrip("\ufeff")
+    except UnicodeDecodeError:
+        return None
+
+
+def build_frames(old: Optional[bytes], updates: Mapping[str, Optional[str]]) -> Optional[Tuple[int, bytes]]:
+    """(ID3 major version, frame bytes) of the updated tag, or None when
+    nothing would change. A None/empty value removes the frame."""
+    major, frames = _split_frames(old) if old else (4, [])
+    wanted = {FRAME_FOR_KEY[k]: v for k, v in updates.items()}
+    changed = False
+    out: List[bytes] = []
+    done = set()
+    for fid, raw in frames:
+        if fid not in wanted:
+            out.append(raw)
+            continue
+        if fid in done:
+            changed = True  # duplicate frame of an id being set: drop it
+            continue
+        done.add(fid)
+        value = wanted[fid]
+        if value and _current_text(raw) == value:
+            out.append(raw)
+        else:
+            changed = True
+            if value:
+                out.append(_text_frame(fid, value, major))
+    for fid, value in wanted.items():
+        if fid not in done and value:
+            changed = True
+            out.append(_text_frame(fid, value, major))
+    if not changed:
+        return None
+    return major, b"".join(out)
+
+
+def _tag_bytes(major: int, frames: bytes, capacity: int) -> bytes:
+    """Full ID3 tag (header + frames + zero padding) of exactly `capacity` bytes."""
+    padding = capacity - 10 - len(frames)
+    assert padding >= 0
+    return b"ID3" + bytes([major, 0, 0]) + _synchsafe_bytes(len(frames) + padding) + frames + b"\0" * padding
+
+
+def _grown_capacity(frames_len: int) -> int:
+    # Chunk data length for a tag that has to grow
+    capacity = 10 + frames_len + max(PADDING_MIN, frames_len // 2)
+    return capacity + (capacity % 2)  # even: no chunk pad byte to manage
+
+
+def _pack(kind: str, n: int) -> bytes:
+    return struct.pack("<I" if kind == "wav" else ">I", n)
+
+
+def _touch_dir(path: str) -> None:
+    try:
+        os.utime(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        pass  # costs a stale walk snapshot until the next --full, nothing more
+
+
+def write_tags(path: str, updates: Mapping[str, Optional[str]], dry_run: bool = False) -> str:
+    """Set the given text tags (keys from TAG_KEYS) on an AIFF/WAV file.
+
+    Returns how it was (or, with dry_run, would be) done: "unchanged",
+    "padding", "extended", "relocated" or "rewritten" (see module docstring)."""
+    unknown = set(updates) - set(TAG_KEYS)
+    if unknown:
+        raise ValueError(f"unknown tag keys: {', '.join(sorted(unknown))}")
+    mode = _write_tags(path, updates, dry_run)
+    if mode != "unchanged" and not dry_run:
+        _touch_dir(path)
+    return mode
+
+
+def _write_tags(path: str, updates: Mapping[str, Optional[str]], dry_run: bool) -> str:
+    with open(path, "r+b" if not dry_run else "rb") as f:
+        kind, chunks, size = _container(f)
+        id3 = next((c for c in chunks if c.cid in (b"ID3 ", b"id3 ")), None)
+        old = None
+        if id3 is not None:
+            f.seek(id3.offset + 8)
+            old = f.read(id3.size)
+        built = build_frames(old, updates)
+        if built is None:
+            return "unchanged"
+        major, frames = built
+        last = chunks[-1] if chunks else None
+
+        if id3 is not None and 10 + len(frames) <= id3.size:
+            if not dry_run:
+                f.seek(id3.offset + 8)
+                f.write(_tag_bytes(major, frames, id3.size))
+            return "padding"
+
+        if kind == "aiff" and id3 is not None and id3 is not last:
+            if not dry_run:
+                _rewrite_aiff(f, path, chunks, id3, major, frames)
+            return "rewritten"
+
+        capacity = _grown_capacity(len(frames))
+        if dry_run:
+            return "extended" if id3 is None or id3 is last else "relocated"
+        if id3 is not None and id3 is last:
+            # Grow the last chunk in place
+            start, mode = id3.offset, "extended"
+            cid = id3.cid
+        else:
+            start = size + (size % 2)
+            cid = id3.cid if id3 is not None else (b"id3 " if kind == "wav" else b"ID3 ")
+            mode = "extended" if id3 is None else "relocated"
+        f.seek(start)
+        f.write(cid + _pack(kind, capacity) + _tag_bytes(major, frames, capacity))
+        f.truncate()
+        if mode == "relocated":
+            f.seek(id3.offset)
+            f.write(b"JUNK")
+        total = f.seek(0, os.SEEK_END)
+        f.seek(4)
+        f.write(_pack(kind, total - 8))
+        return mode
+
+
+def _rewrite_aiff(f, path: str, chunks: List[_Chunk], id3: _Chunk, major: int, frames: bytes) -> None:
+    """Copy every chunk except the ID3 one to a temp file, append the padded
+    tag, and replace the original. Later edits then fit in place."""
+    capacity = _grown_capacity(len(frames))
+    tmp = os.path.join(os.path.dirname(path) or ".", f".tmp-retag-{os.getpid()}-{os.path.basename(path)}")
+    try:
+        with open(tmp, "wb") as out:
+            f.seek(0)
+            out.write(f.read(12))
+            for chunk in chunks:
+                if chunk is id3:
+                    continue
+                f.seek(chunk.offset)
+                remaining = chunk.end - chunk.offset
+                while remaining:
+                    block = f.read(min(COPY_BUFSIZE, remaining))
+                    if not block:
+                        raise OSError(f"short read in {path}")
+                    throttle_read(len(block))
+                    throttle_write(len(block))
+                    out.write(block)
+                    remaining -= len(block)
+            out.write(id3.cid + _pack("aiff", capacity) + _tag_bytes(major, frames, capacity))
+            total = out.tell()
+            out.seek(4)
+            out.write(_pack("aiff", total - 8))
+            out.flush()
+            os.fsync(out.fileno())
+        st = os.fstat(f.fileno())
+        os.chmod(tmp, st.st_mode & 0o7777)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def tags_from_mutagen(path: str, updates: Mapping[str, Optional[str]], dry_run: bool = False) -> str:
+    """Fallback for other formats (and tags write_tags refuses) via mutagen's
+    easy interface, which may rewrite the file. Returns "mutagen" or
+    "unchanged"."""
+    from mutagen import File as MutagenFile
+    from mutagen.id3 import ID3, Frames
+
+    audio = MutagenFile(path, easy=True)
+    if audio is None:
+        raise UnsupportedTag("unrecognised audio file")
+    if audio.tags is None:
+        audio.add_tags()
+    changed = False
+    for key, value in updates.items():
+        if isinstance(audio.tags, ID3):
+            # AIFF/WAV have no easy wrapper: their ID3 tag takes frames
+            fid = FRAME_FOR_KEY[key]
+            current = list(audio.tags[fid].text) if fid in audio.tags else None
+            if value:
+                if current != [value]:
+                    audio.tags.setall(fid, [Frames[fid](encoding=3, text=[value])])
+                    changed = True
+            elif current is not None:
+                audio.tags.delall(fid)
+                changed = True
+            continue
+        current = audio.tags.get(key)
+        if value:
+            if current != [value]:
+                audio.tags[key] = [value]
+                changed = True
+        elif current:
+            del audio.tags[key]
+            changed = True
+    if not changed:
+        return "unchanged"
+    if not dry_run:
+        audio.save()
+        _touch_dir(path)
+    return "mutagen"
+
+
+def set_tags(path: str, updates: Mapping[str, Optional[str]], dry_run: bool = False) -> str:
+    """write_tags() for AIFF/WAV, mutagen for everything else or when the
+    existing tag cannot be edited in place."""
+    if os.path.splitext(path)[1].lower() in EXTENSIONS:
+        try:
+            return write_tags(path, updates, dry_run)
+        except UnsupportedTag:
+            pass
+    return tags_from_mutagen(path, updates, dry_run)
@@ -0,0 +1,207 @@
+"""
+tag_writer round trips: each write path ("padding", "extended", "relocated",
+"rewritten") on small synthetic AIFF/WAV files, read back with mutagen, for
+ID3v2.3 and ID3v2.4 tags. The audio payload must come out byte-identical.
+
+Run: python3 -m pytest script/utilities/tests
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mutagen = pytest.importorskip("mutagen")
+
+import tag_writer  # noqa: E402
+from find_exact_duplicates import content_digest  # noqa: E402
+from tag_writer import PADDING_MIN, set_tags, write_tags  # noqa: E402
+
+AUDIO = bytes(range(256)) * 16  # 4 KiB of 16-bit mono samples
+LONG_TITLE = "Ünïcödé Title – " + "x" * 200  # outgrows any unpadded tag
+
+
+def _synchsafe(n: int) -> bytes:
+    return bytes(((n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F))
+
+
+def id3_tag(major: int, frames: dict, padding: int = 0) -> bytes:
+    body = b""
+    for fid, text in frames.items():
+        if major == 4:
+            data = b"\x03" + text.encode("utf-8")
+            size = _synchsafe(len(data))
+        else:
+            data = b"\x01" + text.encode("utf-16")
+            size = len(data).to_bytes(4, "big")
+        body += fid.encode("latin-1") + size + b"\x00\x00" + data
+    body += b"\x00" * padding
+    return b"ID3" + bytes([major, 0, 0]) + _synchsafe(len(body)) + body
+
+
+def _chunk(cid: bytes, data: bytes, fmt: str) -> bytes:
+    return cid + struct.pack(fmt, len(data)) + data + b"\x00" * (len(data) % 2)
+
+
+def make_wav(path, tag: bytes | None = None, tag_first: bool = True) -> None:
+    fmt = _chunk(b"fmt ", struct.pack("<HHIIHH", 1, 1, 8000, 16000, 2, 16), "<I")
+    data = _chunk(b"data", AUDIO, "<I")
+    id3 = _chunk(b"id3 ", tag, "<I") if tag is not None else b""
+    body = b"WAVE" + fmt + (id3 + data if tag_first else data + id3)
+    path.write_bytes(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+
+def make_aiff(path, tag: bytes | None = None, tag_first: bool = True) -> None:
+    # 8000 Hz as an 80-bit extended float
+    rate = b"\x40\x0b\xfa" + b"\x00" * 7
+    comm = _chunk(b"COMM", struct.pack(">hIh", 1, len(AUDIO) // 2, 16) + rate, ">I")
+    ssnd = _chunk(b"SSND", struct.pack(">II", 0, 0) + AUDIO, ">I")
+    id3 = _chunk(b"ID3 ", tag, ">I") if tag is not None else b""
+    body = b"AIFF" + comm + (id3 + ssnd if tag_first else ssnd + id3)
+    path.write_bytes(b"FORM" + struct.pack(">I", len(body)) + body)
+
+
+def read_back(path):
+    audio = mutagen.File(str(path))
+    assert audio is not None and audio.tags is not None
+    return audio
+
+
+@pytest.fixture(params=[3, 4], ids=["v2.3", "v2.4"])
+def major(request):
+    return request.param
+
+
+def test_padding(tmp_path, major):
+    path = tmp_path / "a.wav"
+    make_wav(path, id3_tag(major, {"TIT2": "Old", "TALB": "Album"}, padding=512))
+    payload = content_digest(str(path))
+    size = path.stat().st_size
+    assert write_tags(str(path), {"title": "New Title", "artist": "Ärtist"}) == "padding"
+    assert path.stat().st_size == size
+    audio = read_back(path)
+    assert audio.tags.version[:2] == (2, major)
+    assert str(audio.tags["TIT2"]) == "New Title"
+    assert str(audio.tags["TPE1"]) == "Ärtist"
+    assert str(audio.tags["TALB"]) == "Album"
+    assert content_digest(str(path)) == payload
+
+
+@pytest.mark.parametrize("make", [make_wav, make_aiff], ids=["wav", "aiff"])
+def test_extended_last_chunk(tmp_path, major, make):
+    path = tmp_path / ("a.wav" if make is make_wav else "a.aiff")
+    make(path, id3_tag(major, {"TIT2": "Old", "TCON": "House"}), tag_first=False)
+    payload = content_digest(str(path))
+    assert write_tags(str(path), {"title": LONG_TITLE}) == "extended"
+    audio = read_back(path)
+    assert audio.tags.version[:2] == (2, major)
+    assert str(audio.tags["TIT2"]) == LONG_TITLE
+    assert str(audio.tags["TCON"]) == "House"
+    assert audio.info.length == pytest.approx(len(AUDIO) / 2 / 8000)
+    assert content_digest(str(path)) == payload
+    # The grown tag is padded, so the next edit fits in place
+    assert write_tags(str(path), {"album": "Later"}) == "padding"
+    assert str(read_back(path).tags["TALB"]) == "Later"
+
+
+def test_extended_without_tag(tmp_path):
+    path = tmp_path / "a.wav"
+    make_wav(path)
+    payload = content_digest(str(path))
+    assert write_tags(str(path), {"artist": "Artist", "title": "Title"}) == "extended"
+    audio = read_back(path)
+    assert audio.tags.version[:2] == (2, 4)
+    assert (str(audio.tags["TPE1"]), str(audio.tags["TIT2"])) == ("Artist", "Title")
+    assert content_digest(str(path)) == payload
+
+
+def test_relocated_wav(tmp_path, major):
+    path = tmp_path / "a.wav"
+    make_wav(path, id3_tag(major, {"TIT2": "Old", "TPE1": "Artist"}), tag_first=True)
+    payload = content_digest(str(path))
+    assert write_tags(str(path), {"title": LONG_TITLE}) == "relocated"
+    data = path.read_bytes()
+    assert b"JUNK" in data[:64]  # the old chunk, now skipped by readers
+    assert struct.unpack("<I", data[4:8])[0] == len(data) - 8
+    audio = read_back(path)
+    assert audio.tags.version[:2] == (2, major)
+    assert str(audio.tags["TIT2"]) == LONG_TITLE
+    assert str(audio.tags["TPE1"]) == "Artist"
+    assert content_digest(str(path)) == payload
+
+
+def test_rewritten_aiff(tmp_path, major):
+    path = tmp_path / "a.aiff"
+    make_aiff(path, id3_tag(major, {"TIT2": "Old", "TPE1": "Artist"}), tag_first=True)
+    os.chmod(path, 0o640)
+    payload = content_digest(str(path))
+    assert write_tags(str(path), {"title": LONG_TITLE}) == "rewritten"
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["a.aiff"]  # no temp file left
+    data = path.read_bytes()
+    assert struct.unpack(">I", data[4:8])[0] == len(data) - 8
+    assert data.rfind(b"ID3 ") > data.find(b"SSND")  # tag moved after the audio
+    audio = read_back(path)
+    assert audio.tags.version[:2] == (2, major)
+    assert str(audio.tags["TIT2"]) == LONG_TITLE
+    assert str(audio.tags["TPE1"]) == "Artist"
+    assert content_digest(str(path)) == payload
+    assert len(data) < len(AUDIO) + 10 + len(LONG_TITLE.encode("utf-16")) + PADDING_MIN + 1024
+
+
+def test_remove_and_unchanged(tmp_path, major):
+    path = tmp_path / "a.wav"
+    make_wav(path, id3_tag(major, {"TIT2": "Title", "TALB": "Album"}, padding=64))
+    assert write_tags(str(path), {"title": "Title"}) == "unchanged"
+    assert write_tags(str(path), {"album": None}) == "padding"
+    audio = read_back(path)
+    assert "TALB" not in audio.tags
+    assert str(audio.tags["TIT2"]) == "Title"
+
+
+def test_dry_run_leaves_file(tmp_path):
+    path = tmp_path / "a.aiff"
+    make_aiff(path, id3_tag(4, {"TIT2": "Old"}), tag_first=True)
+    before = path.read_bytes()
+    assert write_tags(str(path), {"title": LONG_TITLE}, dry_run=True) == "rewritten"
+    assert path.read_bytes() == before
+
+
+def test_unknown_key(tmp_path):
+    path = tmp_path / "a.wav"
+    make_wav(path)
+    with pytest.raises(ValueError):
+        write_tags(str(path), {"bpm": "128"})
+
+
+def test_write_bumps_folder_mtime(tmp_path):
+    # Incremental walks only re-list folders whose mtime moved
+    path = tmp_path / "a.wav"
+    make_wav(path, id3_tag(4, {"TIT2": "Old"}, padding=64))
+    os.utime(tmp_path, ns=(10**18, 10**18))
+    assert write_tags(str(path), {"title": "Old"}) == "unchanged"
+    assert os.stat(tmp_path).st_mtime_ns == 10**18
+    assert write_tags(str(path), {"title": "New"}) == "padding"
+    assert os.stat(tmp_path).st_mtime_ns != 10**18
+
+
+def test_set_tags_falls_back_to_mutagen(tmp_path):
+    # ID3v2.2 (three-character frame ids) is left to mutagen
+    data = b"\x00Old"
+    body = b"TT2" + len(data).to_bytes(3, "big") + data
+    path = tmp_path / "a.wav"
+    make_wav(path, b"ID3\x02\x00\x00" + _synchsafe(len(body)) + body)
+    with pytest.raises(tag_writer.UnsupportedTag):
+        write_tags(str(path), {"title": "New"})
+    os.utime(tmp_path, ns=(10**18, 10**18))
+    assert set_tags(str(path), {"title": "Via Mutagen", "artist": "Artist"}) == "mutagen"
+    audio = read_back(path)
+    assert (str(audio.tags["TIT2"]), str(audio.tags["TPE1"])) == ("Via Mutagen", "Artist")
+    assert os.stat(tmp_path).st_mtime_ns != 10**18
+    # mutagen saved it as ID3v2.4, which later edits handle in place
+    assert set_tags(str(path), {"title": "Via Mutagen"}) == "unchanged"
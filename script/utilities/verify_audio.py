@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Header-only integrity and format-conformance scanner.
+
+Reads only a few kilobytes per file (headers plus the tail) to flag:
+- WAV/AIFF: container/chunk sizes that disagree with the file size, missing
+  or truncated `data`/`SSND` payloads, inconsistent `fmt `/`COMM` fields
+- FLAC: metadata blocks past EOF, STREAMINFO total samples vs the sample
+  position of the last frame (header CRC-8 and frame CRC-16 checked)
+- MP3: MPEG frame sync at the start of the payload and a frame chain that
+  ends exactly at the end of the payload
+- All: sample rate / bit depth outside what Rekordbox and CDJs play
+  (reported as WARN; structural problems are ERROR)
+
+Files are checked in a thread pool; the exit status is 1 when any ERROR
+was found.
+
+Usage
+  python3 script/utilities/verify_audio.py [<directory>] [--jobs N] [--errors-only] [--full]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+# Load .env file if available
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent.parent / ".env"
+    load_dotenv(env_path)
+except ImportError:
+    pass
+
+from cli_flags import arg_value
+from events import emit, setup_from_argv
+from fast_tags import ieee_extended
+import io_tuning
+from find_exact_duplicates import (
+    aiff_ssnd_range,
+    flac_payload_start,
+    mp3_payload_range,
+    wav_data_range,
+)
+from records import scan_tree
+
+EXTENSIONS = {".mp3", ".wav", ".aiff", ".aif", ".flac"}
+
+# What Rekordbox/CDJ players reliably handle
+COMPAT_RATES = {44100, 48000}
+COMPAT_BITS = {16, 24}
+
+# How much of the file end to inspect for FLAC/MP3 tail checks
+TAIL_BYTES = 64 * 1024
+MAX_CHUNKS = 4096
+
+
+class Issue(NamedTuple):
+    level: str  # "ERROR" (corrupt/truncated) or "WARN" (odd or incompatible)
+    message: str
+
+
+def _compat(rate: int, bits: Optional[int]) -> List[Issue]:
+    out = []
+    if rate not in COMPAT_RATES:
+        out.append(Issue("WARN", f"sample rate {rate} Hz (players expect {'/'.join(map(str, sorted(COMPAT_RATES)))})"))
+    if bits is not None and bits not in COMPAT_BITS:
+        out.append(Issue("WARN", f"bit depth {bits} (players expect 16/24)"))
+    return out
+
+
+def _iter_chunks(f: BinaryIO, size: int, byteorder: str) -> List[Tuple[bytes, int, int, List[Issue]]]:
+    """Walk RIFF/IFF chunks after the 12-byte header without reading bodies.
+    Returns (id, body offset, declared length, issues) per chunk."""
+    out = []
+    pos = 12
+    while pos + 8 <= size and len(out) < MAX_CHUNKS:
+        f.seek(pos)
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            break
+        cid = hdr[0:4]
+        clen = int.from_bytes(hdr[4:8], byteorder)
+        issues = []
+        if pos + 8 + clen > size:
+            label = cid.decode("latin-1", "replace")
+            missing = pos + 8 + clen - size
+            issues.append(Issue("ERROR", f"chunk '{label}' extends {missing} bytes past end of file"))
+        out.append((cid, pos + 8, clen, issues))
+        pos += 8 + clen + (clen % 2)
+    return out
+
+
+def verify_wav(path: str, size: int) -> List[Issue]:
+    issues: List[Issue] = []
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[0:4] != b"RIFF" or head[8:12] != b"WAVE":
+            return [Issue("ERROR", "not a RIFF/WAVE file")]
+        declared = int.from_bytes(head[4:8], "little") + 8
+        if declared > size:
+            issues.append(Issue("ERROR", f"RIFF declares {declared} bytes but file has {size} (truncated)"))
+        elif declared < size - 1:
+            issues.append(Issue("WARN", f"{size - declared} bytes after the RIFF chunk"))
+        chunks = _iter_chunks(f, size, "little")
+        fmt = None
+        for cid, off, clen, chunk_issues in chunks:
+            issues.extend(chunk_issues)
+            if cid == b"fmt " and clen >= 16:
+                f.seek(off)
+                fmt = f.read(16)
+        if fmt is None or len(fmt) < 16:
+            issues.append(Issue("ERROR", "missing 'fmt ' chunk"))
+            return issues
+        tag = int.from_bytes(fmt[0:2], "little")
+        channels = int.from_bytes(fmt[2:4], "little")
+        rate = int.from_bytes(fmt[4:8], "little")
+        byte_rate = int.from_bytes(fmt[8:12], "little")
+        align = int.from_bytes(fmt[12:14], "little")
+        bits = int.from_bytes(fmt[14:16], "little")
+        if tag not in (1, 0xFFFE):
+            issues.append(Issue("WARN", f"not integer PCM (format tag {tag:#06x})"))
+        if channels == 0 or rate == 0 or bits == 0:
+            issues.append(Issue("ERROR", "'fmt ' has zero channels, rate or bit depth"))
+            return issues
+        if align != channels * ((bits + 7) // 8) or byte_rate != rate * align:
+            issues.append(Issue("WARN", "'fmt ' block align / byte rate inconsistent with channels and bit depth"))
+        issues.extend(_compat(rate, bits))
+    rng = wav_data_range(path)
+    if not rng:
+        issues.append(Issue("ERROR", "no readable 'data' chunk"))
+    elif align and (rng[1] - rng[0]) % align:
+        issues.append(Issue("WARN", "'data' length is not a whole number of sample frames"))
+    return issues
+
+
+def verify_aiff(path: str, size: int) -> List[Issue]:
+    issues: List[Issue] = []
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[0:4] != b"FORM" or head[8:12] not in (b"AIFF", b"AIFC"):
+            return [Issue("ERROR", "not an AIFF/AIFC file")]
+        declared = int.from_bytes(head[4:8], "big") + 8
+        if declared > size:
+            issues.append(Issue("ERROR", f"FORM declares {declared} bytes but file has {size} (truncated)"))
+        elif declared < size - 1:
+            issues.append(Issue("WARN", f"{size - declared} bytes after the FORM chunk"))
+        comm = None
+        for cid, off, clen, chunk_issues in _iter_chunks(f, size, "big"):
+            issues.extend(chunk_issues)
+            if cid == b"COMM" and clen >= 18:
+                f.seek(off)
+                comm = f.read(min(clen, 22))
+        if comm is None or len(comm) < 18:
+            issues.append(Issue("ERROR", "missing 'COMM' chunk"))
+            return issues
+        channels = int.from_bytes(comm[0:2], "big")
+        frames = int.from_bytes(comm[2:6], "big")
+        bits = int.from_bytes(comm[6:8], "big")
+        rate = int(round(ieee_extended(comm[8:18])))
+        if head[8:12] == b"AIFC" and len(comm) >= 22 and comm[18:22] not in (b"NONE", b"sowt"):
+            issues.append(Issue("WARN", f"compressed AIFC ({comm[18:22].decode('latin-1', 'replace')})"))
+        if channels == 0 or rate == 0 or bits == 0:
+            issues.append(Issue("ERROR", "'COMM' has zero channels, rate or bit depth"))
+            return issues
+        issues.extend(_compat(rate, bits))
+    rng = aiff_ssnd_range(path)
+    if not rng:
+        issues.append(Issue("ERROR", "no readable 'SSND' chunk"))
+        return issues
+    expected = frames * channels * ((bits + 7) // 8)
+    actual = max(0, min(rng[1], size) - rng[0])
+    if actual < expected:
+        pct = 100.0 * (expected - actual) / expected
+        issues.append(Issue("ERROR", f"sound data is {expected - actual} bytes short of COMM frame count ({pct:.1f}% missing)"))
+    return issues
+
+
+def _crc8(data: bytes) -> int:
+    crc = 0
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+_CRC16_TABLE = []
+for _i in range(256):
+    _c = _i << 8
+    for _ in range(8):
+        _c = ((_c << 1) ^ 0x8005) & 0xFFFF if _c & 0x8000 else (_c << 1) & 0xFFFF
+    _CRC16_TABLE.append(_c)
+
+
+def _crc16(data: bytes) -> int:
+    crc = 0
+    table = _CRC16_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+    return crc
+
+
+def _flac_frame_header(buf: bytes, i: int) -> Optional[Tuple[bool, int, int]]:
+    """Parse a FLAC frame header at buf[i]; returns (variable_blocksize,
+    coded number, block size) when the header and its CRC-8 are valid."""
+    if i + 6 > len(buf) or buf[i] != 0xFF or buf[i + 1] not in (0xF8, 0xF9):
+        return None
+    variable = buf[i + 1] == 0xF9
+    bs_code = buf[i + 2] >> 4
+    sr_code = buf[i + 2] & 0x0F
+    if bs_code == 0 or sr_code == 15 or buf[i + 3] & 0x01 or (buf[i + 3] >> 4) > 10:
+        return None
+    # UTF-8 style coded frame/sample number
+    first = buf[i + 4]
+    n_extra = 0
+    mask = 0x80
+    while first & mask and n_extra < 7:
+        n_extra += 1
+        mask >>= 1
+    if n_extra == 1 or n_extra > 6:
+        return None
+    value = first & (0x7F >> n_extra) if n_extra else first
+    j = i + 5
+    for _ in range(max(0, n_extra - 1)):
+        if j >= len(buf) or buf[j] & 0xC0 != 0x80:
+            return None
+        value = (value << 6) | (buf[j] & 0x3F)
+        j += 1
+    if bs_code == 6:
+        if j + 1 > len(buf):
+            return None
+        block = buf[j] + 1
+        j += 1
+    elif bs_code == 7:
+        if j + 2 > len(buf):
+            return None
+        block = int.from_bytes(buf[j:j + 2], "big") + 1
+        j += 2
+    elif bs_code == 1:
+        block = 192
+    elif bs_code <= 5:
+        block = 576 << (bs_code - 2)
+    else:
+        block = 256 << (bs_code - 8)
+    j += {12: 1, 13: 2, 14: 2}.get(sr_code, 0)
+    if j >= len(buf) or _crc8(buf[i:j]) != buf[j]:
+        return None
+    return variable, value, block
+
+
+def verify_flac(path: str, size: int) -> List[Issue]:
+    issues: List[Issue] = []
+    with open(path, "rb") as f:
+        if f.read(4) != b"fLaC":
+            return [Issue("ERROR", "missing fLaC signature")]
+        hdr = f.read(4)
+        if len(hdr) < 4 or hdr[0] & 0x7F != 0 or int.from_bytes(hdr[1:4], "big") != 34:
+            return [Issue("ERROR", "first metadata block is not a valid STREAMINFO")]
+        si = f.read(34)
+        if len(si) < 34:
+            return [Issue("ERROR", "truncated STREAMINFO")]
+        block_size = int.from_bytes(si[2:4], "big")
+        max_frame = int.from_bytes(si[7:10], "big")
+        packed = int.from_bytes(si[10:18], "big")
+        rate = packed >> 44
+        bits = ((packed >> 36) & 0x1F) + 1
+        total = packed & 0xFFFFFFFFF
+        if rate == 0:
+            issues.append(Issue("ERROR", "STREAMINFO sample rate is 0"))
+            return issues
+        issues.extend(_compat(rate, bits))
+
+        start = flac_payload_start(path)
+        if start is None or start > size:
+            issues.append(Issue("ERROR", "metadata blocks run past end of file"))
+            return issues
+        if start == size:
+            issues.append(Issue("ERROR", "no audio frames after metadata"))
+            return issues
+        f.seek(start)
+        if _flac_frame_header(f.read(32), 0) is None:
+            issues.append(Issue("ERROR", "no valid frame header where audio starts"))
+
+        window = max(TAIL_BYTES, 2 * max_frame)
+        tail_start = max(start, size - window)
+        f.seek(tail_start)
+        tail = f.read(size - tail_start)
+
+    # Last valid frame header in the tail gives the final sample position
+    last = None
+    i = tail.rfind(b"\xff", 0, len(tail) - 1)
+    while i >= 0:
+        parsed = _flac_frame_header(tail, i)
+        if parsed:
+            last = (i, parsed)
+            break
+        i = tail.rfind(b"\xff", 0, i)
+    if last is None:
+        issues.append(Issue("ERROR", "no frame sync found near end of file"))
+        return issues
+    pos, (variable, number, block) = last
+    first_sample = number if variable else number * block_size
+    end_sample = first_sample + block
+    if _crc16(tail[pos:-2]) != int.from_bytes(tail[-2:], "big"):
+        issues.append(Issue("ERROR", "last frame fails CRC-16 (truncated or trailing data)"))
+    if total:
+        if end_sample < total:
+            pct = 100.0 * (total - end_sample) / total
+            issues.append(Issue("ERROR", f"ends at sample {end_sample} of {total} ({pct:.1f}% missing)"))
+        elif end_sample > total:
+            issues.append(Issue("WARN", f"frames run to sample {end_sample}, STREAMINFO says {total}"))
+    return issues
+
+
+# MPEG audio header tables: kbps by [version is MPEG1][layer index]
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_frame(buf: bytes, i: int) -> Optional[Tuple[int, int]]:
+    """(frame length, sample rate) for a valid MPEG audio header at buf[i]."""
+    if i + 4 > len(buf) or buf[i] != 0xFF or buf[i + 1] & 0xE0 != 0xE0:
+        return None
+    version = (buf[i + 1] >> 3) & 3
+    layer_bits = (buf[i + 1] >> 1) & 3
+    br_idx = buf[i + 2] >> 4
+    sr_idx = (buf[i + 2] >> 2) & 3
+    if version == 1 or layer_bits == 0 or br_idx in (0, 15) or sr_idx == 3:
+        return None
+    layer = 4 - layer_bits
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][br_idx] * 1000
+    rate = _MP3_RATES[version][sr_idx]
+    pad = (buf[i + 2] >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // rate + pad) * 4
+    elif layer == 3 and not mpeg1:
+        length = 72 * bitrate // rate + pad
+    else:
+        length = 144 * bitrate // rate + pad
+    return length, rate
+
+
+def verify_mp3(path: str, size: int) -> List[Issue]:
+    issues: List[Issue] = []
+    start, end = mp3_payload_range(path)
+    end = size if end is None else end
+    with open(path, "rb") as f:
+        f.seek(start)
+        head = f.read(8192)
+        # APE tag footer just before the (already excluded) ID3v1 tag
+        if end - start > 32:
+            f.seek(end - 32)
+            ape = f.read(32)
+            if ape[0:8] == b"APETAGEX":
+                tag_len = int.from_bytes(ape[12:16], "little")
+                flags = int.from_bytes(ape[20:24], "little")
+                end -= tag_len + (32 if flags & 0x80000000 else 0)
+        tail_start = max(start, end - TAIL_BYTES)
+        f.seek(tail_start)
+        tail = f.read(end - tail_start)
+
+    # Start: two consecutive valid headers, ideally right at the payload start
+    first = None
+    for i in range(0, max(0, len(head) - 4)):
+        fr = _mp3_frame(head, i)
+        if fr and (i + fr[0] + 4 > len(head) or _mp3_frame(head, i + fr[0])):
+            first = (i, fr)
+            break
+    if first is None:
+        return [Issue("ERROR", "no MPEG frame sync at start of audio")]
+    if first[0]:
+        issues.append(Issue("WARN", f"{first[0]} junk bytes before first MPEG frame"))
+    issues.extend(_compat(first[1][1], None))
+
+    # End: some frame chain in the tail must land exactly on the payload end
+    ends_clean = False
+    overshoot = False
+    i = tail.find(b"\xff")
+    while 0 <= i < len(tail) - 4:
+        pos = i
+        hops = 0
+        while pos + 4 <= len(tail):
+            fr = _mp3_frame(tail, pos)
+            if not fr:
+                break
+            pos += fr[0]
+            hops += 1
+        if hops >= 2 and pos == len(tail):
+            ends_clean = True
+            break
+        # a false sync rarely chains three frames; a real one that overshoots
+        # means the final frame was cut off
+        if hops >= 3 and pos > len(tail):
+            overshoot = True
+        i = tail.find(b"\xff", i + 1)
+    if overshoot:
+        issues.append(Issue("ERROR", "last MPEG frame is cut off (truncated)"))
+    elif not ends_clean:
+        issues.append(Issue("WARN", "MPEG frames do not end at the end of the audio (trailing data?)"))
+    return issues
+
+
+_VERIFIERS = {
+    ".wav": verify_wav,
+    ".aiff": verify_aiff,
+    ".aif": verify_aiff,
+    ".flac": verify_flac,
+    ".mp3": verify_mp3,
+}
+
+
+def verify_file(path: str) -> List[Issue]:
+    verifier = _VERIFIERS.get(os.path.splitext(path)[1].lower())
+    if verifier is None:
+        return []
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return [Issue("ERROR", "empty file")]
+        return verifier(path, size)
+    except OSError as e:
+        return [Issue("ERROR", f"unreadable ({e})")]
+    except Exception as e:
+        # A header malformed in a way no check anticipated is itself a finding;
+        # it must not end the scan of the remaining files
+        return [Issue("ERROR", f"malformed header ({type(e).__name__}: {e})")]
+
+
+def main():
+    # --format ndjson streams one JSON event per file on stdout
+    setup_from_argv("verify_audio")
+
+    # Get directory from command line or environment variable
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+        root = sys.argv[1]
+    else:
+        root = os.environ.get("MUSIC_LIBRARY_DIR")
+        if not root:
+            print("Error: No directory specified.")
+            print("Usage: python3 verify_audio.py <directory> [--jobs N] [--errors-only] [--full] [--format text|ndjson]")
+            print("Or set MUSIC_LIBRARY_DIR in your .env file")
+            sys.exit(1)
+
+    root = os.path.expanduser(root)
+    errors_only = "--errors-only" in sys.argv
+    full = "--full" in sys.argv
+    try:
+        jobs = int(arg_value("--jobs")) if arg_value("--jobs") else None
+    except ValueError:
+        print("--jobs expects a number")
+        sys.exit(1)
+
+    if not os.path.isdir(root):
+        print(f"Root does not exist or is not a directory: {root}")
+        sys.exit(1)
+
+    table = scan_tree(root, lambda name: os.path.splitext(name)[1].lower() in EXTENSIONS, incremental=True, full=full)
+    paths = [table.path(row) for row in table.rows()]
+    if not paths:
+        print("No files to examine.")
+        return
+    if jobs is None:
+        # Header/tag reads: a few small requests per file (see io_tuning)
+        jobs = io_tuning.jobs_for(root, "tags", paths)
+
+    n_err = n_warn = 0
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for row, issues in zip(table.rows(), pool.map(verify_file, paths)):
+            path = table.path(row)
+            emit("scanned", path=path, size=table.size[row],
+                 issues=[{"level": i.level, "message": i.message} for i in issues])
+            if errors_only:
+                issues = [i for i in issues if i.level == "ERROR"]
+            if not issues:
+                continue
+            print(f"\n{path}")
+            for issue in issues:
+                print(f"  {issue.level}: {issue.message}")
+            if any(i.level == "ERROR" for i in issues):
+                n_err += 1
+            else:
+                n_warn += 1
+
+    print(f"\nDone. Files checked: {len(paths)} | With errors: {n_err} | With warnings only: {n_warn}")
+    emit("done", checked=len(paths), errors=n_err, warnings=n_warn)
+    if n_err:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
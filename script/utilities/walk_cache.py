@@ -0,0 +1,150 @@
+"""
+Directory walker that can skip re-listing unchanged directories.
+
+With `incremental=True` the walk persists a snapshot of every directory's
+(inode, mtime_ns), its subdirectories and its file listing. On the next run a
+directory whose inode and mtime are unchanged is not listed again: its files
+and subdirectories come from the snapshot, and only its subdirectories are
+stat'ed to find changed subtrees. A directory's mtime changes whenever an
+entry is added, removed or renamed in it, so new downloads and deletions are
+always picked up.
+
+Not detected from the snapshot: files rewritten in place (e.g. a tag edit that
+keeps the same name). Pass `full=True` (the scripts' `--full`) to re-list
+everything; a full walk is also forced every `FULL_SCAN_DAYS` days.
+
+Quarantine folders of flatten_all_songs (QUARANTINE_DIR, or any folder
+whose name ends in it) are never descended into: the copies parked there
+must not show up as library files again.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from cache_store import cache_path, load_json, save_json
+
+SNAPSHOT_VERSION = 1
+
+# Force a full re-listing periodically; override with DECKREADY_FULL_SCAN_DAYS
+FULL_SCAN_DAYS = 7.0
+
+# Directories modified this close to the previous snapshot are not trusted:
+# a change in the same timestamp tick would otherwise go unnoticed
+MTIME_SLACK_NS = 2_000_000_000
+
+# flatten_all_songs parks identical copies here (default: a sibling of the
+# root named "<root>.flatten-duplicates")
+QUARANTINE_DIR = ".flatten-duplicates"
+
+_warned = False
+
+
+class FileStat(NamedTuple):
+    """Stat fields the scanners need; duck-types os.stat_result."""
+    name: str
+    st_size: int
+    st_mtime_ns: int
+    st_ino: int
+
+
+def _list_dir(dirpath: str) -> Tuple[List[str], List[FileStat]]:
+    subdirs: List[str] = []
+    files: List[FileStat] = []
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files.append(FileStat(entry.name, st.st_size, st.st_mtime_ns, st.st_ino))
+            except OSError:
+                continue
+    return subdirs, files
+
+
+def in_quarantine(path: str) -> bool:
+    """True if a folder above path is a flatten_all_songs quarantine."""
+    return any(part.endswith(QUARANTINE_DIR) for part in os.path.dirname(path).split(os.sep))
+
+
+def full_scan_days() -> float:
+    """DECKREADY_FULL_SCAN_DAYS, or FULL_SCAN_DAYS when unset or malformed."""
+    global _warned
+    raw = os.environ.get("DECKREADY_FULL_SCAN_DAYS")
+    if raw is None:
+        return FULL_SCAN_DAYS
+    try:
+        return float(raw)
+    except ValueError:
+        if not _warned:
+            print(f"Warning: ignoring DECKREADY_FULL_SCAN_DAYS={raw!r} (not a number); using {FULL_SCAN_DAYS:g}",
+                  file=sys.stderr)
+            _warned = True
+        return FULL_SCAN_DAYS
+
+
+def walk(root: str, incremental: bool = False, full: bool = False) -> Iterator[Tuple[str, List[FileStat]]]:
+    """Yield (dirpath, files) top-down for every directory under root.
+    The snapshot is only rewritten when the walk runs to completion."""
+    started_ns = time.time_ns()
+    snap_path = cache_path("walk", root)
+    snap = load_json(snap_path) if incremental and not full else None
+    if snap and (snap.get("version") != SNAPSHOT_VERSION or snap.get("root") != os.path.realpath(root)):
+        snap = None
+    if snap and started_ns - snap.get("last_full_ns", 0) > full_scan_days() * 86400 * 1e9:
+        snap = None
+    old_dirs: Dict[str, dict] = snap["dirs"] if snap else {}
+    trusted_before = snap["started_ns"] - MTIME_SLACK_NS if snap else 0
+
+    new_dirs: Dict[str, dict] = {}
+    listed = 0
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        dirpath = os.path.join(root, rel) if rel else root
+        try:
+            st = os.stat(dirpath)
+        except OSError:
+            continue
+        prev = old_dirs.get(rel)
+        if (
+            prev
+            and prev["ino"] == st.st_ino
+            and prev["mtime_ns"] == st.st_mtime_ns
+            and st.st_mtime_ns < trusted_before
+        ):
+            subdirs = prev["subdirs"]
+            files = [FileStat(*f) for f in prev["files"]]
+        else:
+            try:
+                subdirs, files = _list_dir(dirpath)
+            except OSError:
+                continue
+            listed += 1
+        if incremental:
+            new_dirs[rel] = {
+                "ino": st.st_ino,
+                "mtime_ns": st.st_mtime_ns,
+                "subdirs": subdirs,
+                "files": [list(f) for f in files],
+            }
+        yield dirpath, files
+        stack.extend(os.path.join(rel, d) for d in reversed(subdirs) if not d.endswith(QUARANTINE_DIR))
+
+    if incremental:
+        try:
+            save_json(snap_path, {
+                "version": SNAPSHOT_VERSION,
+                "root": os.path.realpath(root),
+                "started_ns": started_ns,
+                "last_full_ns": snap["last_full_ns"] if snap else started_ns,
+                "dirs": new_dirs,
+                "listed": listed,
+            })
+        except OSError:
+            pass  # a missing snapshot only costs a full walk next time
@@ -0,0 +1,246 @@
+"""
+Audio straight out of ZIP archives (record-pool and Bandcamp downloads).
+
+Nothing is unpacked to a scratch folder. Tags are read from the member
+stream (fast_tags, then mutagen on the same stream), and extract_member()
+writes a member directly into its final destination through a hidden
+`.part` file in the destination folder, renamed into place once zipfile
+has checked the CRC. A member's bytes are therefore written exactly once.
+
+Stored members seek for free; for deflated ones a forward seek means
+decompressing up to that point, so a WAV/AIFF whose tag chunk sits after
+the audio costs one decompression pass to read and another to extract.
+
+Each extraction holds one EXTRACT_BUFSIZE buffer plus the decompressor's
+state (MEMORY_PER_WORKER); workers_for() turns a memory budget into a
+worker count, and Extractor keeps at most that many members in flight.
+"""
+
+from __future__ import annotations
+
+import errno
+import os
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fast_tags import read_fast_tags_from
+from io_throttle import throttle_read, throttle_write
+
+ZIP_EXTS = {".zip"}
+EXTRACT_BUFSIZE = 1024 * 1024
+MEMORY_PER_WORKER = EXTRACT_BUFSIZE + 256 * 1024
+DEFAULT_MEMORY = 64 * 1024 * 1024
+
+# Errors a damaged or unusual archive raises while reading a member
+ZIP_ERRORS = (OSError, EOFError, zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, NotImplementedError, RuntimeError)
+
+
+def is_zip(path: Path) -> bool:
+    return path.suffix.lower() in ZIP_EXTS and path.is_file()
+
+
+class ZipMember:
+    """One file inside an archive. `path` (archive/member) is for display,
+    logs and filename-based guesses; it does not exist on disk."""
+
+    def __init__(self, archive: Path, info: zipfile.ZipInfo, zf: Optional[zipfile.ZipFile] = None) -> None:
+        self.archive = archive
+        self.info = info
+        self.path = archive / info.filename
+        self._zf = zf
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    @property
+    def name(self) -> str:
+        return self.info.filename
+
+    @property
+    def suffix(self) -> str:
+        return self.path.suffix
+
+    @property
+    def size(self) -> int:
+        return self.info.file_size
+
+    def open(self):
+        """Binary stream of the member; uses the archive handle of
+        iter_members() while it is open, else opens the archive again."""
+        if self._zf is not None and self._zf.fp is not None:
+            return self._zf.open(self.info)
+        zf = zipfile.ZipFile(self.archive)
+        try:
+            return _OwnedStream(zf, zf.open(self.info))
+        except BaseException:
+            zf.close()
+            raise
+
+
+class _OwnedStream:
+    # Member stream that closes its own archive handle
+    def __init__(self, zf: zipfile.ZipFile, f) -> None:
+        self._zf, self._f = zf, f
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._f.close()
+        self._zf.close()
+
+
+def _skipped(name: str) -> bool:
+    # macOS resource forks and Finder metadata ride along in many archives
+    base = name.rsplit("/", 1)[-1]
+    return name.startswith("__MACOSX/") or base.startswith("._") or base == ".DS_Store"
+
+
+def iter_members(archive: Path, exts: Iterable[str]) -> Iterator[ZipMember]:
+    """Members with one of `exts` (lowercase, with dot), in archive order.
+    The archive stays open while the caller iterates."""
+    exts = set(exts)
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or _skipped(info.filename):
+                continue
+            if os.path.splitext(info.filename)[1].lower() in exts:
+                yield ZipMember(archive, info, zf)
+
+
+def read_member_tags(member: ZipMember, mutagen_file: Optional[Callable] = None) -> Tuple[Optional[Dict[str, object]], Any]:
+    """(fast_tags dict or None, mutagen object or None) from the member
+    stream; mutagen is only tried when the native reader gives up."""
+    try:
+        with member.open() as f:
+            fast = read_fast_tags_from(f, member.name)
+            if fast is not None or mutagen_file is None:
+                return fast, None
+            f.seek(0)
+            try:
+                return None, mutagen_file(f)
+            except Exception:  # noqa: BLE001 - mutagen raises its own error types
+                return None, None
+    except ZIP_ERRORS:
+        return None, None
+
+
+def _set_mtime(path: str, info: zipfile.ZipInfo) -> None:
+    try:
+        ts = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(path, (ts, ts))
+    except (OverflowError, ValueError, OSError):
+        pass
+
+
+def _claim(part: str, dst: str) -> None:
+    # link() refuses to replace a file that appeared in the meantime;
+    # filesystems without hard links get a checked rename instead
+    try:
+        os.link(part, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, "File exists", dst)
+        os.rename(part, dst)
+        return
+    os.unlink(part)
+
+
+def extract_member(archive: str, name: str, dst: str, overwrite: bool = False, bufsize: int = EXTRACT_BUFSIZE) -> str:
+    """Stream one member into dst (parent created). Never leaves a partial
+    file at dst: bytes go to a `.part` sibling that is renamed when the
+    member has been read completely and its CRC matched. Without
+    `overwrite` an existing dst raises FileExistsError."""
+    parent = os.path.dirname(dst)
+    os.makedirs(parent, exist_ok=True)
+    part = os.path.join(parent, f".{os.path.basename(dst)}.part")
+    with zipfile.ZipFile(archive) as zf:
+        info = zf.getinfo(name)
+        try:
+            with zf.open(info) as fin, open(part, "wb") as fout:
+                while True:
+                    chunk = fin.read(bufsize)
+                    if not chunk:
+                        break
+                    throttle_read(len(chunk))
+                    throttle_write(len(chunk))
+                    fout.write(chunk)
+            _set_mtime(part, info)
+            if overwrite:
+                os.replace(part, dst)
+            else:
+                _claim(part, dst)
+        except BaseException:
+            try:
+                os.unlink(part)
+            except OSError:
+                pass
+            raise
+    return dst
+
+
+def workers_for(memory_budget: int, jobs: int) -> int:
+    """Extraction workers that fit `memory_budget` bytes, at most `jobs`."""
+    return max(1, min(jobs, memory_budget // MEMORY_PER_WORKER))
+
+
+class Extractor:
+    """Runs extract_member() on up to `workers` threads with at most
+    `workers` members in flight. submit() and drain() return the entries
+    that have finished, in submission order, as (context, error or None)."""
+
+    def __init__(self, workers: int) -> None:
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Deque[Tuple[Future, Any]] = deque()
+
+    def __enter__(self) -> "Extractor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, member: ZipMember, dst: str, overwrite: bool, context: Any) -> List[Tuple[Any, Optional[BaseException]]]:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="unzip")
+        done = []
+        while len(self._pending) >= self.workers:
+            done.append(self._finish())
+        fut = self._pool.submit(extract_member, str(member.archive), member.name, dst, overwrite)
+        self._pending.append((fut, context))
+        while self._pending and self._pending[0][0].done():
+            done.append(self._finish())
+        return done
+
+    def drain(self) -> List[Tuple[Any, Optional[BaseException]]]:
+        done = []
+        while self._pending:
+            done.append(self._finish())
+        return done
+
+    def _finish(self) -> Tuple[Any, Optional[BaseException]]:
+        fut, context = self._pending.popleft()
+        try:
+            fut.result()
+        except Exception as e:  # noqa: BLE001 - reported per member by the caller
+            return context, e
+        return context, None
+
+    def close(self) -> None:
+        self.drain()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None